@@ -0,0 +1,47 @@
+"""
+Reads one field from a multi-megabyte BOC file, once by parsing all the cells
+and once with the memory-mapped lazy reader.
+
+    python -m benchmarks.bench_boc_reader
+"""
+
+import os
+import tempfile
+import time
+
+from fift.boc import BocReader, deserialize_boc, serialize_boc
+from fift.cell import Cell
+
+
+def state(n):
+    """
+    A chain of n cells with 1000 data bits each.
+    """
+    c = Cell()
+    for i in range(n):
+        c = Cell(i << 968 | 1, 1000, [c])
+    return c
+
+
+def main(n=20000):
+    path = os.path.join(tempfile.mkdtemp(), 'state.boc')
+    with open(path, 'wb') as f:
+        f.write(serialize_boc(state(n), has_idx=True))
+    print('state.boc %.1f MB, %d cells' % (os.path.getsize(path) / 1e6, n + 1))
+
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        root, = deserialize_boc(f.read())
+    value = root.refs[0].begin_parse().load_uint(32)
+    print('full    %.3f ms  value=%d' % ((time.perf_counter() - start) * 1e3, value))
+
+    start = time.perf_counter()
+    with BocReader.open(path) as reader:
+        value = reader.root().r().u(32)
+    print('lazy    %.3f ms  value=%d' % ((time.perf_counter() - start) * 1e3, value))
+
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""
+Generates a big script into a file, once from the body and then from the
+on-disk cache.
+
+    python -m benchmarks.bench_cache
+"""
+
+import os
+import tempfile
+import time
+
+from fift.fift import *
+
+
+def messages(n):
+    d = const('d', {})
+    for i in range(n):
+        d.add(i, (32, 'u'), builder().u(i, 64))
+        string('added ', i).print(cr=True)
+
+
+def main(n=20000):
+    tmp = tempfile.mkdtemp()
+    out = os.path.join(tmp, 'messages.fif')
+    f = script(out_filename=out, cache=os.path.join(tmp, 'cache'))(messages)
+
+    for name in ('miss', 'hit'):
+        start = time.perf_counter()
+        code = f(n)
+        print('%-4s %d bytes  %.3f s' % (name, len(code), time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
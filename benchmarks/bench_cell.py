@@ -0,0 +1,38 @@
+"""
+Builds message cells and serializes them to BOC, once by rendering the Fift
+code and running it in the interpreter and once with the native builder.
+
+    python -m benchmarks.bench_cell
+"""
+
+import time
+
+from fift.fift import *
+from fift.interp import run
+
+
+def message(i):
+    body = builder().u(0, 32).s('b{}')
+    return builder().u(0x42, 9).i(-1, 8).s('x{%064X}' % i).u(i * 1000, 64).r(body)
+
+
+def via_interpreter(i):
+    return run(str(message(i)) + ' 2 boc+>B').stack[0]
+
+
+def native(i):
+    return message(i).boc()
+
+
+def main(n=20000):
+    for name, f in (('interp', via_interpreter), ('native', native)):
+        start = time.perf_counter()
+        for i in range(n):
+            with recording():
+                f(i)
+        spent = time.perf_counter() - start
+        print('%-7s %d messages  %.3f s  %.2f us/message' % (name, n, spent, spent / n * 1e6))
+
+
+if __name__ == '__main__':
+    main()
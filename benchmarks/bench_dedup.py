@@ -0,0 +1,37 @@
+"""
+Generates a script which builds many messages with the same body cell, with
+and without `dedup_cells`, and runs both in the in-process interpreter.
+
+    python -m benchmarks.bench_dedup
+"""
+
+import time
+
+from fift.fift import *
+from fift.interp import run
+
+
+def messages(n):
+    for i in range(n):
+        body = builder().u(0, 32).s('x{%s}' % ('00' * 8 + '7472616E73666572' * 6))
+        const('m%d' % i, builder().u(0x42, 9).i(-1, 8).u(i, 64).r(builder().u(1, 8).r(body)))
+
+
+plain = script()(messages)
+deduped = script(dedup_cells=True)(messages)
+
+
+def main(n=2000):
+    for name, f in (('plain', plain), ('dedup', deduped)):
+        start = time.perf_counter()
+        code = f(n)
+        generated = time.perf_counter() - start
+
+        start = time.perf_counter()
+        run(code)
+        spent = time.perf_counter() - start
+        print('%-6s %d messages  %7d bytes  generate %.3f s  run %.3f s' % (name, n, len(code), generated, spent))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Fills a dictionary with many entries: with a `Dict.add` line per entry, with
+`Dict.update` and with a `const` of literal values built as a BOC literal.
+The smaller dictionaries are also run in the in-process interpreter, which
+rebuilds the dictionary on every `udict!`. The `add` lines keep the flag of
+`udict!` on the stack, so they are not run.
+
+    python -m benchmarks.bench_dict
+"""
+
+import time
+
+from fift.fift import *
+from fift.interp import run
+
+
+@script()
+def per_entry(n):
+    d = const('d', {})
+    for i in range(n):
+        d.add(i, (32, 'u'), builder().u(i, 64))
+
+
+@script()
+def bulk(n):
+    d = const('d', {})
+    d.update(((i, builder().u(i, 64)) for i in range(n)), (32, 'u'))
+
+
+@script()
+def literal(n):
+    const('d', {i: builder().u(i, 64) for i in range(n)}, size=(32, 'u'))
+
+
+FILLS = (('add', per_entry), ('update', bulk), ('literal', literal))
+
+
+def main(n=50000, run_n=500):
+    for name, f in FILLS:
+        start = time.perf_counter()
+        code = f(n)
+        spent = time.perf_counter() - start
+        print('%-7s %d entries  %8d bytes  %5d lines  generate %.3f s' % (
+            name, n, len(code), code.count('\n') + 1, spent))
+
+    for name, f in FILLS[1:]:
+        code = f(run_n)
+        start = time.perf_counter()
+        run(code)
+        print('%-7s %d entries  run %.3f s' % (name, run_n, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
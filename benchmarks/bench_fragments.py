@@ -0,0 +1,32 @@
+"""
+Renders a million fragments outside of a script and reports the resident set
+size along the way, it must stay flat.
+
+    python -m benchmarks.bench_fragments
+"""
+
+import resource
+
+from fift.fift import *
+
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main(n=1000000, step=100000):
+    for i in range(1, n + 1):
+        str(string('a', i).print(cr=True))
+        str(builder().u(i, 32).r(dup()))
+
+        if i % step == 0:
+            print('%8d fragments  rss %d kB' % (i, rss_kb()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Generates per-account wallet queries in the current process and in a process
+pool.
+
+    python -m benchmarks.bench_generate_many
+"""
+
+import os
+import time
+
+from fift.fift import *
+
+
+@script()
+def account_query(account, seqno):
+    include('TonUtil.fif')
+    d = const('d', {})
+    for i in range(20):
+        d.add(i, (16, 'u'), builder().u(seqno, 32).u(i, 64))
+    const('msg', builder().s('x{%064X}' % account).u(seqno, 32).d(d))
+    file('query-%d.boc' % account).write()
+
+
+def main(n=20000):
+    kwargs = [{'account': i, 'seqno': i % 100} for i in range(n)]
+    for workers in (1, os.cpu_count()):
+        start = time.perf_counter()
+        generate_many(account_query, kwargs, workers=workers, chunksize=256)
+        print('%2d workers  %d scripts  %.3f s' % (workers, n, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""
+Generates scripts where every line hoists a constant definition and prints
+the time per node, it must stay the same while the script grows.
+
+    python -m benchmarks.bench_hoist
+"""
+
+import time
+
+from fift.fift import *
+
+
+@script()
+def consts(n):
+    for i in range(n):
+        string(const('c%d' % i, i))
+
+
+@script()
+def dict_fill(n):
+    for i in range(n):
+        const('d%d' % i, {}).add(i, (32, 'u'), builder().u(i, 32))
+
+
+def main(sizes=(10000, 25000, 50000, 100000)):
+    for name, f in (('consts', consts), ('dict_fill', dict_fill)):
+        for n in sizes:
+            start = time.perf_counter()
+            code = f(n)
+            spent = time.perf_counter() - start
+            print('%-10s %7d nodes  %6.3f s  %5.2f us/node  %d bytes' % (
+                name, n, spent, spent / n * 1e6, len(code)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+"""
+Measures the memory taken by the nodes of a 1M-node script with tracemalloc.
+
+    python -m benchmarks.bench_nodes
+"""
+
+import tracemalloc
+
+from fift.fift import *
+
+
+def build(n):
+    d = const('d', {})
+    for i in range(n // 4):
+        d.add(i, (32, 'u'), builder().u(i, 32))
+        dup()
+        string('a', i)
+
+
+def main(n=1000000):
+    tracemalloc.start()
+    with recording() as rec:
+        before = tracemalloc.get_traced_memory()[0]
+        build(n)
+        after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print('%d nodes  %.1f MB  %.1f bytes/node' % (n, (after - before) / 2 ** 20, (after - before) / n))
+    return rec
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Generates scripts where the same subtrees are rendered many times: a big
+body cell used as the value of every dict entry and a long message string
+printed by many words.
+
+    python -m benchmarks.bench_render
+"""
+
+import time
+
+from fift.fift import *
+
+
+@script()
+def shared_values(n):
+    body = builder()
+    for i in range(64):
+        body.u(i, 32)
+    body.r(builder().s('x{DEADBEEF}').i(-1, 8))
+
+    d = const('d', {})
+    for i in range(n):
+        d.add(i, (32, 'u'), body)
+
+
+@script()
+def shared_words(n):
+    message = string(*('part %d ' % i for i in range(32)))
+    for i in range(n):
+        word('w%d' % i, message, 'type')
+
+
+def main(n=20000):
+    for name, f in (('shared_values', shared_values), ('shared_words', shared_words)):
+        start = time.perf_counter()
+        code = f(n)
+        print('%-14s %d uses  %.3f s  %d bytes' % (name, n, time.perf_counter() - start, len(code)))
+
+
+if __name__ == '__main__':
+    main()
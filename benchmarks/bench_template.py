@@ -0,0 +1,35 @@
+"""
+Renders a wallet query script many times with different values, once by
+running the body on every call and once as a template.
+
+    python -m benchmarks.bench_template
+"""
+
+import time
+
+from fift.fift import *
+
+
+def wallet_query(dest, seqno, amount):
+    include('TonUtil.fif')
+    string('Transferring ', amount, ' to ', dest, ' seqno ', seqno).print(cr=True)
+    body = builder().u(0, 32).s('b{}')
+    const('msg', builder().u(0x42, 9).i(-1, 8).s(dest).u(amount, 64).r(body))
+    file('wallet-query.boc').write()
+
+
+plain = script()(wallet_query)
+templated = script(template=True)(wallet_query)
+
+
+def main(n=100000):
+    for name, f in (('plain', plain), ('template', templated)):
+        start = time.perf_counter()
+        for i in range(n):
+            f('x{%064X}' % i, i, i * 1000)
+        spent = time.perf_counter() - start
+        print('%-8s %d scripts  %.3f s  %.2f us/script' % (name, n, spent, spent / n * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+The benchmark suite: synthetic workloads measured for the generation time,
+the nodes per second, the peak memory and the size of the emitted code. The
+results are saved as JSON and can be compared with the results of another
+commit.
+
+    python -m benchmarks.suite --out before.json
+    python -m benchmarks.suite --out after.json --compare before.json
+    python -m benchmarks.suite --scale 0.1 --only dict_fill strings
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import time
+import tracemalloc
+
+from fift.fift import *
+from fift.fift import _reachable
+
+
+def nesting(n):
+    """
+    Words with deeply nested conditions like examples/chksign.py.
+    """
+    for w in range(n // 50):
+        body = String('zero').print()
+        for i in range(50):
+            body = (cond('0<')
+                .pos(String('negative %d' % i).print())
+                .neg(cond().pos(body).neg(dup())))
+
+        check_sign = word('check_sign%d' % w, dupnz(), body)
+        check_sign(-17)
+        check_sign(0)
+
+
+def dict_fill(n):
+    d = const('d', {})
+    for i in range(n):
+        d.add(i, (32, 'u'), builder().u(i, 64))
+
+
+def strings(n):
+    a = const('a', 1)
+    for _ in range(n // 1000):
+        string(*(i % 3 and 'part %d ' % i or i % 2 and a or i for i in range(1000))).print(cr=True)
+
+
+def builders(n):
+    for i in range(n // 20):
+        body = builder().u(0, 32).s('x{%064X}' % i)
+        for j in range(8):
+            body = builder().u(j, 16).i(-j, 8).b(b'\x01\x02').r(body)
+        const('msg%d' % i, body)
+        slice(const('msg%d' % i).read()).u(16).s(8).b(2).r().u(16).s(8).r().d()
+
+
+def wallet_query(dest, seqno, amount):
+    include('TonUtil.fif')
+    string('Transferring ', amount, ' to ', dest, ' seqno ', seqno).print(cr=True)
+    body = builder().u(0, 32).s('b{}')
+    const('msg', builder().u(0x42, 9).i(-1, 8).s(dest).u(amount, 64).r(body))
+    file('wallet-query.boc').write()
+
+
+wallet_template = script(template=True)(wallet_query)
+
+
+def count_nodes(roots):
+    """
+    Counts the nodes reachable from the roots through the children, the
+    branches of the conditions and the nested builders.
+    """
+    return sum(1 for _ in _reachable(roots))
+
+
+def generate(body, n):
+    start = time.perf_counter()
+    with recording() as rec:
+        body(n)
+    built = time.perf_counter()
+    code = str(rec)
+    rendered = time.perf_counter()
+    return rec, code, built - start, rendered - built
+
+
+def measure_script(name, body, n, repeat):
+    rec, code, build, render = generate(body, n)
+    nodes = count_nodes(rec.roots())
+    del rec
+    # the best of the runs, the first one also warms up the caches
+    for _ in range(repeat - 1):
+        _, _, b, r = generate(body, n)
+        if b + r < build + render:
+            build, render = b, r
+
+    tracemalloc.start()
+    generate(body, n)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'n': n,
+        'nodes': nodes,
+        'build_s': build,
+        'render_s': render,
+        'seconds': build + render,
+        'nodes_per_s': nodes / (build + render),
+        'peak_bytes': peak,
+        'output_bytes': len(code.encode()),
+    }
+
+
+def measure_template(name, f, n, repeat):
+    spent = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = 0
+        for i in range(n):
+            size += len(f('x{%064X}' % i, i, i * 1000))
+        t = time.perf_counter() - start
+        spent = spent is None and t or min(spent, t)
+
+    tracemalloc.start()
+    for i in range(min(n, 1000)):
+        f('x{%064X}' % i, i, i * 1000)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'n': n,
+        'seconds': spent,
+        'calls_per_s': n / spent,
+        'peak_bytes': peak,
+        'output_bytes': size,
+    }
+
+
+# the name: (the measure, the body, the size at the scale 1.0)
+WORKLOADS = {
+    'nesting': (measure_script, nesting, 20000),
+    'dict_fill': (measure_script, dict_fill, 100000),
+    'strings': (measure_script, strings, 200000),
+    'builders': (measure_script, builders, 100000),
+    'wallet_template': (measure_template, wallet_template, 100000),
+}
+
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """
+    Prints the ratios of the times, the peak memory and the output sizes to
+    the baseline results, above 1.0 is worse.
+    """
+    before = {r['name']: r for r in baseline['results']}
+    for r in results['results']:
+        b = before.get(r['name'])
+        if b is None or b['n'] != r['n']:
+            continue
+
+        print('%-16s time x%.2f  memory x%.2f  output x%.2f' % (
+            r['name'],
+            r['seconds'] / b['seconds'],
+            r['peak_bytes'] / b['peak_bytes'],
+            r['output_bytes'] / b['output_bytes']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--out', help='the JSON file for the results')
+    parser.add_argument('--compare', help='the JSON file with the results of another commit')
+    parser.add_argument('--scale', type=float, default=1.0, help='the multiplier of the workload sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs, the best one is kept')
+    parser.add_argument('--only', nargs='+', choices=sorted(WORKLOADS), help='the workloads to run')
+    args = parser.parse_args(argv)
+
+    results = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'results': [],
+    }
+    for name in args.only or WORKLOADS:
+        measure, body, size = WORKLOADS[name]
+        r = measure(name, body, max(int(size * args.scale), 1), args.repeat)
+        results['results'].append(r)
+        print('%-16s n=%-7d %.3f s  %s  peak %.1f MB  %d bytes' % (
+            name, r['n'], r['seconds'],
+            'nodes_per_s' in r and '%.0f nodes/s' % r['nodes_per_s'] or '%.0f calls/s' % r['calls_per_s'],
+            r['peak_bytes'] / 2 ** 20, r['output_bytes']))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+"""
+Serialization of cells into the bag-of-cells (BOC) format and a lazy reader
+of BOC files.
+"""
+
+import mmap
+
+from fift.cell import Cell, CellError, bits_to_str
+
+
+BOC_MAGIC = b'\xb5\xee\x9c\x72'
+
+
+def _crc32c_table():
+    table = []
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = c & 1 and (c >> 1) ^ 0x82F63B78 or c >> 1
+        table.append(c)
+    return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def crc32c(data):
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc = _CRC32C_TABLE[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def _byte_size(n):
+    return max((n.bit_length() + 7) // 8, 1)
+
+
+def _topological_order(roots):
+    """
+    Returns the unique cells (by hash) so that every cell goes before the
+    cells it references, the roots go first.
+    """
+    order = []
+    visited = set()
+    for root in reversed(roots):
+        stack = [(root, False)]
+        while stack:
+            cell, done = stack.pop()
+            if done:
+                order.append(cell)
+                continue
+
+            if cell.hash in visited:
+                continue
+
+            visited.add(cell.hash)
+            stack.append((cell, True))
+            stack.extend((r, False) for r in cell.refs)
+
+    order.reverse()
+    return order
+
+
+def serialize_boc(roots, has_idx=False, has_crc32c=True):
+    """
+    Serializes a cell or a list of root cells into BOC bytes, the cells with
+    the same hash are stored once.
+    """
+    if isinstance(roots, Cell):
+        roots = [roots]
+
+    cells = _topological_order(roots)
+    index = {c.hash: i for i, c in enumerate(cells)}
+    size_bytes = _byte_size(len(cells))
+
+    payload = []
+    offsets = []
+    total = 0
+    for c in cells:
+        raw = c.descriptors() + c.padded_data() + b''.join(
+            index[r.hash].to_bytes(size_bytes, 'big') for r in c.refs)
+        payload.append(raw)
+        total += len(raw)
+        offsets.append(total)
+
+    off_bytes = _byte_size(total)
+    header = bytearray(BOC_MAGIC)
+    header.append(has_idx << 7 | has_crc32c << 6 | size_bytes)
+    header.append(off_bytes)
+    header += len(cells).to_bytes(size_bytes, 'big')
+    header += len(roots).to_bytes(size_bytes, 'big')
+    header += (0).to_bytes(size_bytes, 'big')
+    header += total.to_bytes(off_bytes, 'big')
+    for r in roots:
+        header += index[r.hash].to_bytes(size_bytes, 'big')
+    if has_idx:
+        for o in offsets:
+            header += o.to_bytes(off_bytes, 'big')
+
+    boc = bytes(header) + b''.join(payload)
+    if has_crc32c:
+        boc += crc32c(boc).to_bytes(4, 'little')
+    return boc
+
+
+class BocReader:
+    """
+    Reads a BOC without parsing it up front. The cells are located on demand
+    and their bits are read straight from the buffer (a memory-mapped file
+    for `BocReader.open()`), so pulling a few fields from a big BOC does not
+    copy or parse the rest of it.
+    """
+
+    def __init__(self, data, verify=False):
+        self._mmap = None
+        self._data = memoryview(data)
+        self._infos = {}
+        self._cells = {}
+        self._parse_header()
+        if verify and self._has_crc32c:
+            if crc32c(self._data[:-4]) != int.from_bytes(self._data[-4:], 'little'):
+                raise CellError('BOC crc32c mismatch')
+
+    @classmethod
+    def open(cls, path, verify=False):
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = cls(m, verify=verify)
+        reader._mmap = m
+        return reader
+
+    def close(self):
+        self._data.release()
+        if self._mmap is not None:
+            self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _int(self, pos, size):
+        if pos + size > len(self._data):
+            raise CellError('Truncated BOC')
+        return int.from_bytes(self._data[pos:pos + size], 'big')
+
+    def _parse_header(self):
+        if self._data[:4] != BOC_MAGIC:
+            raise CellError('Unsupported BOC magic')
+
+        flags = self._int(4, 1)
+        self._has_crc32c = bool(flags & 0x40)
+        has_idx, has_cache_bits = flags & 0x80, flags & 0x20
+        self._size = size = flags & 7
+        off_bytes = self._int(5, 1)
+        self.cells_count = self._int(6, size)
+        roots_count = self._int(6 + size, size)
+        pos = 6 + 3 * size + off_bytes
+        self.roots = [self._int(pos + i * size, size) for i in range(roots_count)]
+        pos += roots_count * size
+
+        self._index = None
+        if has_idx:
+            self._index = (pos, off_bytes, bool(has_cache_bits))
+            pos += self.cells_count * off_bytes
+
+        self._offsets = [0]
+        self._cells_start = pos
+
+    def _offset(self, i):
+        """
+        Returns the offset of the i-th cell. It is read from the index when
+        the BOC has one, otherwise the cells before it are scanned by their
+        descriptors only.
+        """
+        if not 0 <= i < self.cells_count:
+            raise CellError('Invalid cell index %d' % i)
+
+        if self._index is not None:
+            if not i:
+                return self._cells_start
+            pos, off_bytes, cache_bits = self._index
+            off = self._int(pos + (i - 1) * off_bytes, off_bytes)
+            return self._cells_start + (cache_bits and off >> 1 or off)
+
+        offsets = self._offsets
+        while len(offsets) <= i:
+            pos = self._cells_start + offsets[-1]
+            d1, d2 = self._int(pos, 1), self._int(pos + 1, 1)
+            hashes = d1 & 16 and (bin(d1 >> 5).count('1') + 1) * 34 or 0
+            offsets.append(offsets[-1] + 2 + hashes + (d2 + 1) // 2 + (d1 & 7) * self._size)
+        return self._cells_start + offsets[i]
+
+    def info(self, i):
+        """
+        Returns (data offset, bit length, reference indexes) of the i-th cell.
+        """
+        info = self._infos.get(i)
+        if info is None:
+            pos = self._offset(i)
+            d1, d2 = self._int(pos, 1), self._int(pos + 1, 1)
+            # the exotic cells (pruned branches, library references, Merkle
+            # proofs and updates) and the levels they give to their parents
+            # are not modelled by `Cell`
+            if d1 & 8:
+                raise CellError('Exotic cell %d is not supported' % i)
+            if d1 >> 5:
+                raise CellError('Cell %d has a level mask, exotic cells are not supported' % i)
+            if d1 & 7 > 4:
+                raise CellError('Invalid reference count in cell %d' % i)
+            pos += 2 + (d1 & 16 and (bin(d1 >> 5).count('1') + 1) * 34 or 0)
+            length = d2 // 2 * 8
+            if d2 & 1:
+                last = self._int(pos + d2 // 2, 1)
+                if not last:
+                    raise CellError('Missing completion tag in cell %d' % i)
+                length += 7 - (last & -last).bit_length() + 1
+            refs_pos = pos + (d2 + 1) // 2
+            refs = tuple(self._int(refs_pos + k * self._size, self._size) for k in range(d1 & 7))
+            if any(r <= i for r in refs):
+                raise CellError('Invalid reference in cell %d' % i)
+            info = self._infos[i] = (pos, length, refs)
+        return info
+
+    def bits(self, start, pos, size):
+        """
+        Reads `size` bits at bit position `pos` of the data at offset `start`.
+        """
+        a = start + pos // 8
+        b = start + (pos + size + 7) // 8
+        v = int.from_bytes(self._data[a:b], 'big')
+        return (v >> ((b - start) * 8 - pos - size)) & ((1 << size) - 1)
+
+    def root(self, n=0):
+        """
+        Returns a cursor over the n-th root cell.
+        """
+        return BocSlice(self, self.roots[n])
+
+    def cell(self, i):
+        """
+        Returns the i-th cell together with its subtree as Cell objects.
+        """
+        stack = [i]
+        while stack:
+            j = stack[-1]
+            if j in self._cells:
+                stack.pop()
+                continue
+
+            start, length, refs = self.info(j)
+            missing = [r for r in refs if r not in self._cells]
+            if missing:
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+            self._cells[j] = Cell(self.bits(start, 0, length), length, [self._cells[r] for r in refs])
+        return self._cells[i]
+
+
+class BocSlice:
+    """
+    A cursor over a cell of a `BocReader`, the loaders read the bits from the
+    reader buffer and move the cursor forward.
+    """
+    __slots__ = ('reader', 'index', 'pos', 'end', 'ref_pos', '_start', '_refs')
+
+    def __init__(self, reader, index, pos=0, end=None, ref_pos=0):
+        self.reader = reader
+        self.index = index
+        self._start, length, self._refs = reader.info(index)
+        self.pos = pos
+        self.end = length if end is None else end
+        self.ref_pos = ref_pos
+
+    def __repr__(self):
+        return 'BocSlice(%s, %d refs)' % (
+            bits_to_str(self.reader.bits(self._start, self.pos, self.end - self.pos), self.end - self.pos),
+            len(self._refs) - self.ref_pos)
+
+    def remaining_bits(self):
+        return self.end - self.pos
+
+    def remaining_refs(self):
+        return len(self._refs) - self.ref_pos
+
+    def _take(self, size):
+        if size < 0 or self.pos + size > self.end:
+            raise CellError('Cell underflow: %d bits requested, %d left' % (size, self.end - self.pos))
+
+        self.pos += size
+        return self.reader.bits(self._start, self.pos - size, size)
+
+    def u(self, size):
+        return self._take(size)
+
+    def i(self, size):
+        v = self._take(size)
+        if size and v >> (size - 1):
+            v -= 1 << size
+        return v
+
+    def b(self, size):
+        return self._take(size * 8).to_bytes(size, 'big')
+
+    def s(self, size):
+        """
+        Returns the next `size` bits as a new cursor without references.
+        """
+        self._take(size)
+        return BocSlice(self.reader, self.index, self.pos - size, self.pos, len(self._refs))
+
+    def r(self):
+        """
+        Returns a cursor over the next referenced cell.
+        """
+        if self.ref_pos >= len(self._refs):
+            raise CellError('Cell underflow: no references left')
+
+        self.ref_pos += 1
+        return BocSlice(self.reader, self._refs[self.ref_pos - 1])
+
+    def d(self):
+        return self._take(1) and self.r() or None
+
+    def to_cell(self):
+        """
+        Returns the remaining bits and references as a Cell.
+        """
+        return Cell(self.reader.bits(self._start, self.pos, self.end - self.pos), self.end - self.pos,
+                    [self.reader.cell(r) for r in self._refs[self.ref_pos:]])
+
+
+def deserialize_boc(data):
+    """
+    Parses BOC bytes into the list of root cells.
+    """
+    reader = BocReader(data, verify=True)
+    return [reader.cell(r) for r in reader.roots]
@@ -0,0 +1,257 @@
+"""
+In-memory TON cells: up to 1023 data bits and up to 4 references.
+
+The data bits are kept as a Python integer together with their count, the
+first bit of the cell is the most significant bit of the integer.
+"""
+
+import hashlib
+import re
+
+
+MAX_BITS = 1023
+MAX_REFS = 4
+
+
+class CellError(ValueError):
+    pass
+
+
+class Cell:
+    __slots__ = ('data', 'length', 'refs', 'depth', '_hash')
+
+    def __init__(self, data=0, length=0, refs=()):
+        if length > MAX_BITS:
+            raise CellError('Cell overflow: %d bits' % length)
+        if len(refs) > MAX_REFS:
+            raise CellError('Cell overflow: %d references' % len(refs))
+
+        self.data = data
+        self.length = length
+        self.refs = tuple(refs)
+        self.depth = self.refs and max(r.depth for r in self.refs) + 1 or 0
+        self._hash = None
+
+    def descriptors(self):
+        return bytes((len(self.refs), (self.length + 7) // 8 + self.length // 8))
+
+    def padded_data(self):
+        """
+        The data bits padded to whole bytes with the completion tag.
+        """
+        pad = -self.length % 8
+        data = self.data
+        if pad:
+            data = (data << pad) | (1 << (pad - 1))
+        return data.to_bytes((self.length + 7) // 8, 'big')
+
+    @property
+    def hash(self):
+        """
+        The representation hash of the cell. It is computed from the cached
+        hashes of the references, so every cell of a tree is hashed once.
+        """
+        if self._hash is not None:
+            return self._hash
+
+        stack = [self]
+        while self._hash is None:
+            c = stack[-1]
+            missing = [r for r in c.refs if r._hash is None]
+            if missing:
+                stack.extend(missing)
+                continue
+
+            stack.pop()
+            h = hashlib.sha256(c.descriptors())
+            h.update(c.padded_data())
+            for r in c.refs:
+                h.update(r.depth.to_bytes(2, 'big'))
+            for r in c.refs:
+                h.update(r._hash)
+            c._hash = h.digest()
+        return self._hash
+
+    # the cells are compared by the representation hash, it is computed once
+    # and without the recursion, so the deep trees are compared in O(1)
+    def __eq__(self, other):
+        return isinstance(other, Cell) and self.hash == other.hash
+
+    def __hash__(self):
+        return hash(self.hash)
+
+    def __repr__(self):
+        return 'Cell(%s, %d refs)' % (bits_to_str(self.data, self.length), len(self.refs))
+
+    def begin_parse(self):
+        return CellSlice(self)
+
+
+class CellBuilder:
+    __slots__ = ('data', 'length', 'refs')
+
+    def __init__(self):
+        self.data = 0
+        self.length = 0
+        self.refs = []
+
+    def store_bits(self, data, length):
+        if self.length + length > MAX_BITS:
+            raise CellError('Cell overflow: %d bits' % (self.length + length))
+
+        self.data = (self.data << length) | data
+        self.length += length
+        return self
+
+    def store_uint(self, value, size):
+        if value < 0 or value >> size:
+            raise CellError('Integer %d does not fit into %d unsigned bits' % (value, size))
+        return self.store_bits(value, size)
+
+    def store_int(self, value, size):
+        if size == 0 and value == 0:
+            return self
+        if not -(1 << (size - 1)) <= value < (1 << (size - 1)):
+            raise CellError('Integer %d does not fit into %d signed bits' % (value, size))
+        return self.store_bits(value & ((1 << size) - 1), size)
+
+    def store_bytes(self, value):
+        return self.store_bits(int.from_bytes(value, 'big'), len(value) * 8)
+
+    def store_ref(self, cell):
+        if len(self.refs) >= MAX_REFS:
+            raise CellError('Cell overflow: %d references' % (len(self.refs) + 1))
+
+        self.refs.append(cell)
+        return self
+
+    def store_slice(self, s):
+        data, length = s.bits()
+        self.store_bits(data, length)
+        for r in s.remaining_refs():
+            self.store_ref(r)
+        return self
+
+    def store_maybe_ref(self, cell):
+        if cell is None:
+            return self.store_bits(0, 1)
+        return self.store_bits(1, 1).store_ref(cell)
+
+    def end_cell(self):
+        return Cell(self.data, self.length, self.refs)
+
+
+class CellSlice:
+    __slots__ = ('cell', 'pos', 'end', 'ref_pos')
+
+    def __init__(self, cell, pos=0, end=None, ref_pos=0):
+        self.cell = cell
+        self.pos = pos
+        self.end = cell.length if end is None else end
+        self.ref_pos = ref_pos
+
+    def __repr__(self):
+        return 'CellSlice(%s, %d refs)' % (bits_to_str(*self.bits()), len(self.remaining_refs()))
+
+    def remaining_bits(self):
+        return self.end - self.pos
+
+    def remaining_refs(self):
+        return self.cell.refs[self.ref_pos:]
+
+    def bits(self):
+        """
+        Returns the remaining data bits as (data, length).
+        """
+        length = self.end - self.pos
+        return (self.cell.data >> (self.cell.length - self.end)) & ((1 << length) - 1), length
+
+    def copy(self):
+        return CellSlice(self.cell, self.pos, self.end, self.ref_pos)
+
+    def _take(self, size):
+        if size < 0 or self.pos + size > self.end:
+            raise CellError('Cell underflow: %d bits requested, %d left' % (size, self.end - self.pos))
+
+        self.pos += size
+        return (self.cell.data >> (self.cell.length - self.pos)) & ((1 << size) - 1)
+
+    def load_uint(self, size):
+        return self._take(size)
+
+    def load_int(self, size):
+        v = self._take(size)
+        if size and v >> (size - 1):
+            v -= 1 << size
+        return v
+
+    def load_bytes(self, size):
+        return self._take(size * 8).to_bytes(size, 'big')
+
+    def load_bits(self, size):
+        """
+        Returns the next `size` bits as a new slice without references.
+        """
+        start = self.pos
+        self._take(size)
+        return CellSlice(Cell(*self._range(start, size)))
+
+    def _range(self, start, size):
+        return (self.cell.data >> (self.cell.length - start - size)) & ((1 << size) - 1), size
+
+    def load_ref(self):
+        if self.ref_pos >= len(self.cell.refs):
+            raise CellError('Cell underflow: no references left')
+
+        self.ref_pos += 1
+        return self.cell.refs[self.ref_pos - 1]
+
+    def load_maybe_ref(self):
+        return self.load_uint(1) and self.load_ref() or None
+
+    def to_cell(self):
+        data, length = self.bits()
+        return Cell(data, length, self.remaining_refs())
+
+
+def bits_to_str(data, length):
+    """
+    Formats bits the way Fift prints them: x{...} with a completion tag `_`
+    when the length is not divisible by 4.
+    """
+    pad = -length % 4
+    if pad:
+        data = (data << pad) | (1 << (pad - 1))
+    digits = (length + pad) // 4
+    return 'x{%s%s}' % (digits and '%0*X' % (digits, data) or '', pad and '_' or '')
+
+
+_BITSTRING = re.compile(r'^([bx])\{([0-9A-Fa-f_]*)\}$')
+
+
+def parse_bitstring(text):
+    """
+    Parses b{0101} and x{4A_} literals into (data, length).
+    """
+    m = _BITSTRING.match(text)
+    if m is None:
+        raise CellError('Invalid bitstring literal: %s' % text)
+
+    kind, body = m.groups()
+    if kind == 'b':
+        if not set(body) <= {'0', '1'}:
+            raise CellError('Invalid bitstring literal: %s' % text)
+        return int(body or '0', 2), len(body)
+
+    tagged = body.endswith('_')
+    body = body.rstrip('_')
+    data, length = int(body or '0', 16), len(body) * 4
+    if tagged:
+        while length and not data & 1:
+            data >>= 1
+            length -= 1
+        if length:
+            data >>= 1
+            length -= 1
+
+    return data, length
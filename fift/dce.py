@@ -0,0 +1,128 @@
+"""
+Dead-code elimination of the recorded roots.
+
+A root which defines a word or a constant is kept only when its name is used
+by the code which is run: the other roots, the exported words and, through
+them, the bodies of the used definitions. A name is used when it appears as
+a token of the rendered code, which covers the word calls, the `@' name`
+reads of the constants and the `=: name` assignments. The repeated includes
+of the same file are removed as well.
+
+The value of a constant is computed when the constant is defined, so a
+constant whose value includes a file, prints, reads or writes a file or
+calls a word is kept even when its name is not used.
+"""
+
+from fift.fift import (
+    Abort, Cond, Const, Dump, ForRange, Halt, Include, Interface, ReadFromFile, String, Switch, Times, Until,
+    While, Word, WordCall, WriteToFile, _reachable, _walk,
+)
+
+
+# the nodes which run code with effects or code which is not known here
+_EFFECTS = (
+    Include, ReadFromFile, WriteToFile, Halt, Abort, Dump, WordCall, Cond, Times, Until, While, ForRange, Switch,
+)
+
+# the words with effects which are given as strings
+_EFFECT_WORDS = frozenset([
+    'include', 'type', '.', '._', 'emit', 'space', 'cr', '.s', 'csr.', 'x.', 'b.', 'file>B', 'B>file', 'halt',
+    'abort', '."', 'abort"', 'execute', 'times', 'until', 'while', 'cond', 'if', 'ifnot',
+])
+
+
+def _is_pure(args):
+    """
+    Whether the args render only the literals, the reads of the names and
+    the computations without effects.
+    """
+    pending = list(args)
+    seen = set()
+    while pending:
+        a = pending.pop()
+        if isinstance(a, str):
+            if any(t in _EFFECT_WORDS or t.startswith(('."', 'abort"')) for t in a.split()):
+                return False
+
+        elif isinstance(a, tuple):
+            # the fields of the builders
+            pending.extend(a)
+
+        elif isinstance(a, Interface):
+            for m in _reachable([a], seen=seen):
+                if isinstance(m, _EFFECTS) or isinstance(m, String) and m._print or isinstance(m, Const) and m._type:
+                    return False
+                pending.extend(m.args)
+    return True
+
+
+def _is_definition(root):
+    """
+    Whether the root only defines a name: a word, or a constant whose value
+    is computed without effects.
+    """
+    if isinstance(root, Word):
+        return True
+    return isinstance(root, Const) and bool(root.args) and _is_pure(root.args)
+
+
+def _definitions(root):
+    """
+    Returns the names defined by the root: the word or the constant itself
+    and the constants which are hoisted in front of it.
+    """
+    names = [root.name]
+    for m, _ in _walk(root):
+        if m is not root and isinstance(m, Const) and m.ref and m.args:
+            names.append(m.name)
+
+    return names
+
+
+def _tokens(root):
+    tokens = set(str(root).split())
+    for m, _ in _walk(root):
+        if m is not root and isinstance(m, Const) and m.ref and m.args:
+            tokens.update(str(m).split())
+    return tokens
+
+
+def eliminate(recorder):
+    """
+    Removes the unused definitions and the repeated includes from the roots
+    of the recorder and returns the number of the removed roots.
+    """
+    roots = list(recorder.roots())
+    live = [False] * len(roots)
+    defined = {}
+    includes = set()
+    pending = []
+
+    for i, root in enumerate(roots):
+        if isinstance(root, Include):
+            if root._name in includes:
+                continue
+            includes.add(root._name)
+
+        if _is_definition(root):
+            for name in _definitions(root):
+                defined.setdefault(name, []).append(i)
+
+        if not _is_definition(root) or isinstance(root, Word) and root.exported:
+            live[i] = True
+            pending.append(i)
+
+    used = set()
+    while pending:
+        for token in _tokens(roots[pending.pop()]):
+            if token in used or token not in defined:
+                continue
+
+            used.add(token)
+            for i in defined[token]:
+                if not live[i]:
+                    live[i] = True
+                    pending.append(i)
+
+    recorder.set_roots(r for r, keep in zip(roots, live) if keep)
+    return live.count(False)
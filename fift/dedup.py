@@ -0,0 +1,126 @@
+"""
+Hash-consing of the cells built by a script.
+
+A builder which stores only literal values is identified by the hash of the
+cell it builds. When the same cell is built several times it is defined once
+as a constant and every builder of it is rendered as `@' __cellN`.
+"""
+
+from fift.fift import Builder, Cond, Const, _branches, _changed, _literal_cell, _reachable, _walk
+
+
+def _nested(builder):
+    return [a[0] for a in builder.args if type(a[0]) is Builder]
+
+
+def _key(builder, keys):
+    """
+    Returns the hash of the cell built by the builder or None when it depends
+    on the stack, a constant or a template parameter.
+    """
+    b_id = id(builder)
+    if b_id not in keys:
+        cell = _literal_cell(builder)
+        keys[b_id] = cell is not None and cell.hash or None
+    return keys[b_id]
+
+
+def _in_conditions(roots):
+    """
+    Returns the ids of the builders used in the branches of the conditions.
+    The branches are not walked when the code is rendered, so the constants
+    would not be hoisted for them.
+    """
+    unsafe = set()
+    in_branches = set()
+    for m in _reachable(roots):
+        if isinstance(m, Cond):
+            unsafe.update(id(b) for b in _reachable(_branches(m), seen=in_branches) if isinstance(b, Builder))
+    return unsafe
+
+
+def dedup_cells(recorder):
+    """
+    Replaces the repeated cells of the recorded roots with the constants and
+    returns the number of the builders which were merged.
+    """
+    roots = list(recorder.roots())
+    unsafe = _in_conditions(roots)
+    keys = {}
+
+    # the builders which are rendered as lines or inside the lines, and the
+    # number of times every cell is rendered
+    walked = []
+    occurrences = {}
+    builders = {}
+    for root in roots:
+        for m, _ in _walk(root):
+            if not isinstance(m, Builder) or id(m) in unsafe:
+                continue
+
+            walked.append(m)
+            pending = [m]
+            while pending:
+                b = pending.pop()
+                key = id(b) not in unsafe and _key(b, keys) or None
+                if key is not None:
+                    occurrences.setdefault(key, []).append(b)
+                    builders.setdefault(key, b)
+                pending.extend(reversed(_nested(b)))
+
+    chosen = set()
+    merged = 0
+    for key, found in occurrences.items():
+        count = len(found)
+        if count < 2:
+            continue
+
+        text = len(str(builders[key]))
+        name = len('__cell%d' % len(chosen))
+        # an alias has to be shorter than the builders it replaces
+        if count * text > text + len(' constant ') + name + count * (len("@' ") + name):
+            chosen.add(key)
+            merged += count - 1
+
+    if not chosen:
+        return 0
+
+    # the constants are hoisted in front of the first line which renders
+    # them, the nested ones go first
+    aliases = {}
+    deps = {}
+    for w in walked:
+        deps[id(w)] = w_deps = []
+        pending = [(w, False)]
+        while pending:
+            b, done = pending.pop()
+            if not done:
+                pending.append((b, True))
+                pending.extend((n, False) for n in reversed(_nested(b)))
+                continue
+
+            key = keys.get(id(b))
+            if key not in chosen:
+                continue
+
+            if key not in aliases:
+                canonical = Builder()
+                canonical._args = list(builders[key].args)
+                canonical.ref = True
+                aliases[key] = Const('__cell%d' % len(aliases), canonical)
+                aliases[key].ref = True
+                aliases[key].add_child(canonical)
+            if aliases[key] not in w_deps:
+                w_deps.append(aliases[key])
+
+    for found in occurrences.values():
+        for b in found:
+            b._alias = aliases.get(keys[id(b)])
+            _changed(b)
+
+    for w in walked:
+        for alias in deps[id(w)]:
+            if alias not in w.structure:
+                w.add_child(alias)
+
+    return merged
@@ -0,0 +1,262 @@
+"""
+Factoring of the repeated code into the generated words.
+
+The roots of a script and the bodies of the words, blocks, word calls,
+conditions, loops and switches are sequences of nodes. A run of nodes is
+identified by the renderings of its nodes, which are cached, so the same
+code built by different nodes gets the same key. A run which is repeated
+often enough to pay for its definition is defined once as a word
+`{ ... } : __wN` in front of the first root which uses it, and every
+occurrence becomes a call of the word.
+
+The runs which define or assign anything are never factored, a definition
+inside a word would be made only when the word is called.
+"""
+
+import re
+
+from fift.fift import (
+    Block, Cond, ForRange, Interface, Switch, Times, Until, While, Word, WordCall, _changed, _children, _reachable,
+)
+
+
+# the longest run of nodes which is looked for
+MAX_RUN = 8
+
+# the words which define or assign a name
+_DEFINING = re.compile(r'(?<!\S)(:|::|constant|2constant|include|=:|2=:)(?!\S)')
+_STRINGS = re.compile(r'(abort"|\."|")[^"]*"')
+
+
+def _rendered_children(m):
+    """
+    Returns the nodes rendered by the node, the word nested into another
+    node is rendered as its name only.
+    """
+    if isinstance(m, Word) and m.ref:
+        return []
+    return _children(m)
+
+
+def _subtree(items):
+    return {id(m) for m in _reachable([a for a in items if isinstance(a, Interface)], _rendered_children)}
+
+
+def _slots(m):
+    """
+    Returns the slots of the node which hold the sequences of its code, the
+    index is set for the bodies of a switch.
+    """
+    if isinstance(m, (Word, Block, WordCall, Times, Until, ForRange)):
+        return [('_args', None)]
+
+    if isinstance(m, While):
+        return [('_args', None), ('_body', None)]
+
+    if isinstance(m, Cond):
+        return [(s, None) for s in ('_pos_args', '_neg_args') if getattr(m, s)]
+
+    if isinstance(m, Switch):
+        return [('_bodies', i) for i in range(len(m._bodies))] + [('_default', None)]
+
+    return []
+
+
+def _sequences(roots):
+    """
+    Returns the sequences of the code as `(owner, slot, index, items, root)`
+    where `root` is the index of the first root which renders them, the
+    owner of the roots is None.
+    """
+    sequences = [(None, None, None, roots, 0)]
+    seen = set()
+    for i, root in enumerate(roots):
+        for m in _reachable([root], _rendered_children, seen):
+            for slot, index in _slots(m):
+                items = getattr(m, slot)
+                sequences.append((m, slot, index, list(items if index is None else items[index]), i))
+
+    return sequences
+
+
+def _text(item):
+    """
+    Returns the rendering of the item or None when it cannot be moved into
+    a word.
+    """
+    text = item is not None and str(item) or ''
+    if not text:
+        return None
+
+    # the words are looked for outside of the string literals only when
+    # they are found at all, the renderings of the nested nodes are long
+    if _DEFINING.search(text) and _DEFINING.search(_STRINGS.sub(' ', text)):
+        return None
+    return text
+
+
+def _saving(text, name, count):
+    # every occurrence becomes ` name` and the word is defined on its own line
+    return count * (len(text) - len(name) - 1) - len('{  } : \n') - len(text) - len(name)
+
+
+def _candidates(texts):
+    """
+    Returns the starts of every run of the texts which occurs at least
+    twice by the sequence, by the run. The runs are the tuples of the
+    indexes of the texts in the returned list of the distinct texts.
+    """
+    codes = {}
+    counts = []
+    sequences = []
+    for seq_texts in texts:
+        seq_codes = []
+        for text in seq_texts:
+            code = -1
+            if text is not None:
+                code = codes.setdefault(text, len(codes))
+                if code == len(counts):
+                    counts.append(0)
+                counts[code] += 1
+            seq_codes.append(code)
+        sequences.append(seq_codes)
+
+    found = {}
+    for s, seq_codes in enumerate(sequences):
+        size = len(seq_codes)
+        for start in range(size):
+            run = ()
+            end = start
+            # every node of a repeated run is repeated
+            while end < size and end - start < MAX_RUN and seq_codes[end] >= 0 and counts[seq_codes[end]] > 1:
+                run += (seq_codes[end],)
+                end += 1
+                found.setdefault(run, {}).setdefault(s, []).append(start)
+
+    candidates = {}
+    for run, sites in found.items():
+        count = sum(map(len, sites.values()))
+        if count > 1:
+            candidates[run] = (count, sites)
+    return candidates, list(codes)
+
+
+def factor(recorder):
+    """
+    Moves the repeated runs of the code of the recorded roots into the
+    generated words and returns the number of the words.
+    """
+    roots = list(recorder.roots())
+    sequences = _sequences(roots)
+    candidates, texts = _candidates([[_text(a) for a in items] for _, _, _, items, _ in sequences])
+    if not candidates:
+        return 0
+
+    used = set()
+    for root in roots:
+        used.update(str(root).split())
+    names = ('__w%d' % i for i in range(len(used) + len(candidates) + 1))
+    names = (n for n in names if n not in used)
+    name = next(names)
+
+    # the ids of the nodes moved into the words and of the owners of the
+    # replaced sequences, the runs cannot be nested into each other
+    claimed = set()
+    touched = set()
+    busy = [bytearray(len(items)) for _, _, _, items, _ in sequences]
+    free = [len(items) for _, _, _, items, _ in sequences]
+    replaced = [[] for _ in sequences]
+    words = {}
+
+    joined = {run: ' '.join(texts[i] for i in run) for run in candidates}
+    order = sorted(candidates, key=lambda r: -_saving(joined[r], name, candidates[r][0]))
+    for run in order:
+        text = joined[run]
+        count, starts = candidates[run]
+        if _saving(text, name, count) <= 0:
+            break
+
+        sites = []
+        for s, seq_starts in starts.items():
+            owner, _, _, items, _ = sequences[s]
+            if free[s] < len(run) or id(owner) in claimed:
+                continue
+
+            # the starts go in order, the sites of one run cannot overlap
+            last = 0
+            for start in seq_starts:
+                end = start + len(run)
+                if start < last or busy[s].find(1, start, end) >= 0:
+                    continue
+
+                ids = _subtree(items[start:end])
+                if not ids & touched:
+                    sites.append((s, start, ids))
+                    last = end
+
+        if _saving(text, name, len(sites)) <= 0:
+            continue
+
+        for s, start, ids in sites:
+            busy[s][start:start + len(run)] = b'\1' * len(run)
+            free[s] -= len(run)
+            claimed.update(ids)
+
+        s, start, _ = sites[0]
+        w = Word(name, *sequences[s][3][start:start + len(run)])
+        for a in w.args:
+            if isinstance(a, Interface):
+                # the roots moved into the word become its children
+                a.ref = True
+                w.add_child(a)
+
+        for s, start, _ in sites:
+            touched.add(id(sequences[s][0]))
+            call = WordCall(name)
+            call.ref = sequences[s][0] is not None
+            replaced[s].append((start, len(run), call))
+
+        # the runs of the roots are replaced at their own indexes
+        first = min(sequences[s][4] if s else start for s, start, _ in sites)
+        words.setdefault(first, []).append(w)
+        name = next(names)
+
+    if not words:
+        return 0
+
+    for (owner, slot, index, items, _), runs in zip(sequences[1:], replaced[1:]):
+        if not runs:
+            continue
+
+        items = _replace(items, runs)
+        if index is None:
+            setattr(owner, slot, tuple(items))
+        else:
+            getattr(owner, slot)[index] = tuple(items)
+        _changed(owner)
+
+    recorder.set_roots(_replace(roots, replaced[0], words))
+    return sum(map(len, words.values()))
+
+
+def _replace(items, runs, inserted=None):
+    """
+    Replaces the runs `(start, length, call)` of the items with the calls.
+    `inserted` maps the indexes of the items to the nodes which are put in
+    front of them.
+    """
+    starts = {start: (length, call) for start, length, call in runs}
+    out = []
+    i = 0
+    while i < len(items):
+        if inserted and i in inserted:
+            out.extend(inserted[i])
+
+        if i in starts:
+            length, call = starts[i]
+            out.append(call)
+            i += length
+        else:
+            out.append(items[i])
+            i += 1
+    return out
@@ -1,45 +1,393 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import os
+import re
+import sys
+import sysconfig
+import tempfile
+import time
 import typing as t
 
+from fift.boc import BocReader, serialize_boc
+from fift.cell import Cell, CellBuilder, CellError, CellSlice, parse_bitstring
+from fift.hashmap import build_hashmap
 
-_METHOD_RESULTS = []
+
+class Recorder:
+    """
+    Collects the nodes created by `@method()` helpers while a script is built.
+    Each `script()` call records into its own instance, so several scripts can
+    be generated at the same time from threads or asyncio tasks.
+
+    Outside of `script()` and `recording()` nothing is recorded, the nodes are
+    only kept alive by the caller.
+    """
+
+    def __init__(self):
+        # an insertion ordered set of the nodes which are not referenced by
+        # other nodes, `_as_ref` removes a node when it becomes a child
+        self._roots = {}
+        # the counters reported by the passes, see `script(stats=...)`
+        self.stats = {}
+        # whether the rendering adds its timings to the stats
+        self.instrument = False
+
+    def record(self, node):
+        if not node.ref:
+            self._roots[node] = None
+
+    def discard(self, node):
+        self._roots.pop(node, None)
+
+    def roots(self):
+        return iter(self._roots)
+
+    def set_roots(self, nodes):
+        self._roots = dict.fromkeys(nodes)
+
+    def lines(self):
+        """
+        Yields the rendered lines of the recorded roots one by one.
+        """
+        if self.instrument:
+            return _iter_code_instrumented(self.roots(), self.stats)
+        return _iter_code(self.roots())
+
+    def __str__(self):
+        return '\n'.join(self.lines())
+
+
+_RECORDER = contextvars.ContextVar('fift_recorder', default=None)
+
+
+def _current_recorder():
+    return _RECORDER.get()
+
+
+@contextlib.contextmanager
+def recording():
+    """
+    Collects the fragments created inside the block.
+
+    Examples:
+        with recording() as rec:
+            dup()
+            string('abc').print()
+        str(rec)  # 'dup\n."abc"'
+    """
+    token = _RECORDER.set(Recorder())
+    try:
+        yield _RECORDER.get()
+    finally:
+        _RECORDER.reset(token)
+
+
+def _changed(node):
+    """
+    Drops the cached rendering of the changed node and of every node which
+    was rendered from it, the parents are registered when they render the
+    node. The next rendering only renders these nodes again.
+    """
+    node._invalidate()
+    if node._parents is None:
+        # nothing was rendered from the node yet
+        return
+
+    stack = [node]
+    while stack:
+        m = stack.pop()
+        m._invalidate()
+        parents = m._parents
+        if parents is not None:
+            m._parents = None
+            if isinstance(parents, list):
+                stack.extend(parents)
+            else:
+                stack.append(parents)
+
+
+def _add_parent(node, parent):
+    # a node has one parent most of the time, the list is created on demand
+    parents = node._parents
+    if parents is None:
+        node._parents = parent
+    elif isinstance(parents, list):
+        if not any(p is parent for p in parents):
+            parents.append(parent)
+    elif parents is not parent:
+        node._parents = [parents, parent]
 
 
 class Interface:
+    __slots__ = ('_args', '_structure', 'ref', '_rendered', '_parents')
+    # the slots with the nodes used by `_render`, see `_render_tree`
+    _render_slots = ('_args',)
+
     def __init__(self, *args):
         self._args = args
-        self.structure = []
+        # most of the nodes have no children, the list is created on demand
+        self._structure = None
         self.ref = False
-        self._created = False
+        self._rendered = None
+        # the nodes rendered from this node, see `_changed`
+        self._parents = None
+
+    def __str__(self):
+        # a node is rendered once and the result is reused until the node or
+        # a node it renders is changed, see `_changed`
+        rendered = self._rendered
+        if rendered is not None:
+            return rendered
+
+        return _render_tree(self)
+
+    def _invalidate(self):
+        self._rendered = None
+
+    def _render(self):
+        return ''
 
     def get_args(self):
         return self._args
 
     args = property(get_args)
 
+    def get_structure(self):
+        return self._structure or ()
+
+    structure = property(get_structure)
+
+    def add_child(self, node):
+        if self._structure is None:
+            self._structure = [node]
+        else:
+            self._structure.append(node)
+
     def add_to_code(self, code_lines, level):
         if not self.ref:
             code_lines.append(self)
 
 
-def _root_methods():
-    for mr in _METHOD_RESULTS:
-        if not mr.ref:
-            yield mr
+def _pending_deps(m):
+    """
+    Returns the nodes rendered by the node which are not rendered yet and
+    registers the node as their parent. They are kept in the `_render_slots`
+    of the node directly or in the tuples and lists there, also in the pairs
+    like the builder fields and the dictionary entries.
+    """
+    pending = []
+    for name in m._render_slots:
+        v = getattr(m, name)
+        if isinstance(v, Interface):
+            v = (v,)
+        elif not isinstance(v, (tuple, list)):
+            continue
+
+        for a in v:
+            if isinstance(a, Interface):
+                _add_parent(a, m)
+                if a._rendered is None:
+                    pending.append(a)
+
+            elif isinstance(a, (tuple, list)):
+                for b in a:
+                    if isinstance(b, Interface):
+                        _add_parent(b, m)
+                        if b._rendered is None:
+                            pending.append(b)
+
+    return pending
+
+
+# marks the node under it on the stack of `_render_tree` as expanded
+_EXPANDED = object()
+
+
+def _render_tree(root):
+    """
+    Renders the node after all the nodes it depends on, deepest first, with
+    an explicit stack. Every `_render` then only joins the cached renderings
+    of its children, so the nesting depth is not limited by the recursion
+    limit.
+    """
+    stack = [root]
+    while stack:
+        m = stack.pop()
+        if m is _EXPANDED:
+            m = stack.pop()
+            m._rendered = m._render()
+            continue
+
+        if m._rendered is not None:
+            continue
+
+        pending = _pending_deps(m)
+        if pending:
+            stack.append(m)
+            stack.append(_EXPANDED)
+            stack.extend(pending)
+        else:
+            m._rendered = m._render()
+
+    return root._rendered
+
+
+class CodeLines:
+    """
+    The lines produced by one root node: the node itself and the constant
+    definitions which are hoisted in front of it. `defined` is shared by the
+    roots of one rendering, so a constant is defined only in front of its
+    first use and the next rendering defines it again.
+    """
+
+    def __init__(self, defined=None):
+        self.hoisted = []
+        self.lines = []
+        self.defined = set() if defined is None else defined
+
+    def append(self, node):
+        self.lines.append(node)
+
+    def hoist(self, node):
+        self.hoisted.append(node)
+
+    def __iter__(self):
+        yield from self.hoisted
+        yield from self.lines
+
+
+def _walk(m, level=1):
+    """
+    Yields the node and all its children depth-first with their nesting
+    levels. An explicit stack is used, so the nesting depth is not limited by
+    the recursion limit.
+    """
+    stack = [(m, level)]
+    while stack:
+        m, level = stack.pop()
+        yield m, level
+
+        if m._structure:
+            level += 1
+            stack.extend((s, level) for s in reversed(m._structure))
+
+
+def _iter_code(roots):
+    defined = set()
+    for rm in roots:
+        code_lines = CodeLines(defined)
+        for m, level in _walk(rm):
+            m.add_to_code(code_lines, level)
+
+        for l in code_lines:
+            s = str(l)
+            if s:
+                yield s
+
+
+def _iter_code_instrumented(roots, stats):
+    """
+    `_iter_code` which measures the traversal and the rendering separately
+    and adds the timings, the number of the hoisted constants and the size
+    of the code to the stats when all the lines are produced.
+    """
+    clock = time.perf_counter
+    traverse = render = 0.0
+    hoists = size = 0
+    defined = set()
+    for rm in roots:
+        start = clock()
+        code_lines = CodeLines(defined)
+        for m, level in _walk(rm):
+            m.add_to_code(code_lines, level)
+        hoists += len(code_lines.hoisted)
+        traverse += clock() - start
+
+        for l in code_lines:
+            start = clock()
+            s = str(l)
+            render += clock() - start
+            if s:
+                # the lines are joined with a newline
+                size += len(s.encode()) + (size and 1)
+                yield s
+
+    stats.update(traverse_s=traverse, render_s=render, hoists=hoists, output_bytes=size)
+
+
+def _branches(cond):
+    """
+    Returns the nodes of the branches of the condition, they are rendered
+    into its code and are not its children.
+    """
+    return [a for a in (cond._pos_args or ()) + (cond._neg_args or ()) if isinstance(a, Interface)]
+
+
+def _children(m):
+    """
+    Returns the nodes the node renders: its children, the branches of a
+    condition and the nested builders.
+    """
+    children = list(m.structure)
+    if isinstance(m, Cond):
+        children.extend(_branches(m))
+    elif isinstance(m, Builder):
+        children.extend(a[0] for a in m.args if isinstance(a[0], Interface))
+    return children
+
+
+def _reachable(roots, children=_children, seen=None):
+    """
+    Yields every node reachable from the roots once, depth-first. The passes
+    walk the nodes with it, an explicit stack is used, so the nesting depth is
+    not limited by the recursion limit. `seen` keeps the ids of the yielded
+    nodes across the calls.
+    """
+    seen = set() if seen is None else seen
+    stack = list(roots)
+    while stack:
+        m = stack.pop()
+        if id(m) in seen:
+            continue
+
+        seen.add(id(m))
+        yield m
+        stack.extend(children(m))
+
+
+def _count_nodes(roots):
+    """
+    Counts the reachable nodes by class.
+    """
+    counts = {}
+    for m in _reachable(roots):
+        name = type(m).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
 
 
 def _as_ref(args, res=None):
+    recorder = _current_recorder()
     for a in args:
         if isinstance(a, Interface):
             a.ref = True
+            if recorder is not None:
+                recorder.discard(a)
             if res is not None:
-                res.structure.append(a)
+                res.add_child(a)
 
 
 def method():
     def wrap(f):
         def wrap2(*args, **kwargs):
             res = f(*args, **kwargs)
-            _METHOD_RESULTS.append(res)
+            recorder = _current_recorder()
+            if recorder is not None:
+                recorder.record(res)
 
             _as_ref(args, res)
             return res
@@ -50,56 +398,602 @@ def method():
 SCRIPTS = {}
 
 
-def script(out_filename=None):
-    global _METHOD_RESULTS
-    _METHOD_RESULTS = []
+def _write_lines(lines, of):
+    first = True
+    for l in lines:
+        if not first:
+            of.write('\n')
+        of.write(l)
+        first = False
 
-    code_lines = []
 
-    def code_lines_iter():
-        for l in code_lines:
-            s = str(l)
-            if s:
-                yield s
+def _branch_on_param(self, *args):
+    raise ValueError('The body branches on the value of a template parameter and cannot be used as a template')
 
-    def _inner(m, level=1):
-        m.add_to_code(code_lines, level)
 
-        for s in m.structure:
-            level += 1
-            _inner(s, level)
-            level -= 1
+def _compute_from_param(self, *args):
+    raise ValueError('The body computes from the value of a template parameter and cannot be used as a template')
+
+
+class _ParamGuard:
+    """
+    The placeholders are always true and differ from the real values, so a
+    body which compares or tests them would be compiled into the code of a
+    wrong branch. These operations raise instead.
+    """
+
+    __bool__ = __eq__ = __ne__ = __lt__ = __le__ = __gt__ = __ge__ = _branch_on_param
+
+    def __format__(self, spec):
+        # a placeholder is only rendered, a format spec computes from the value
+        if spec:
+            _compute_from_param(self)
+        return str(self)
+
+
+# the operations which render the placeholder or which Python needs to
+# handle the object, everything else computes from the value and raises
+_PARAM_KEPT = frozenset([
+    '__new__', '__init__', '__str__', '__repr__', '__format__', '__hash__', '__class__', '__doc__',
+    '__getattribute__', '__setattr__', '__delattr__', '__init_subclass__', '__subclasshook__', '__dir__',
+    '__sizeof__', '__reduce__', '__reduce_ex__', '__getnewargs__', '__getstate__',
+])
+
+
+def _opaque(cls):
+    """
+    Replaces the methods and the properties of the base type of the
+    placeholder with `_compute_from_param`.
+    """
+    base = cls.__mro__[-2]
+    for name in dir(base) + ['__radd__', '__rmul__']:
+        if name in _PARAM_KEPT or name in _ParamGuard.__dict__ or name in cls.__dict__:
+            continue
+
+        v = getattr(base, name, None)
+        if callable(v) or v is None:
+            setattr(cls, name, _compute_from_param)
+        elif hasattr(v, '__get__'):
+            setattr(cls, name, property(_compute_from_param))
+    return cls
+
+
+@_opaque
+class _IntParam(_ParamGuard, int):
+    def __new__(cls, value, token):
+        p = super(_IntParam, cls).__new__(cls, value)
+        p._token = token
+        return p
+
+    def __str__(self):
+        return self._token
+
+    __repr__ = __str__
+    __hash__ = int.__hash__
+
+
+@_opaque
+class _StrParam(_ParamGuard, str):
+    __hash__ = str.__hash__
+    # `'%s' % param` renders it
+    __rmod__ = str.__rmod__
+
+
+# a string literal of the rendered code, `"..."`, `."..."` or `abort"..."`
+_STRING_LITERAL = re.compile(r'"[^"]*"')
+
+
+def _check_str_param(v, in_literal):
+    """
+    Raises a ValueError when the value cannot be parsed by Fift where the
+    template puts it: a string literal ends at a double quote or at the end
+    of the line, and a word ends at any whitespace.
+    """
+    if in_literal:
+        if '"' in v or '\n' in v or '\r' in v:
+            raise ValueError('A string parameter in a string literal cannot contain a double quote or '
+                             'a line break: %r' % (v,))
+    elif v.split() != [v] or '"' in v:
+        raise ValueError('A string parameter used as a word has to be a non-empty word without '
+                         'whitespace and double quotes: %r' % (v,))
+
+
+class Template:
+    """
+    Runs the script body once per combination of parameter types with
+    placeholders instead of the parameter values and keeps the generated code
+    as a list of segments. Rendering only joins the segments with the values.
+
+    Only `int` and `str` parameters are substituted, a call with any other
+    value runs the body as usual. The body must not branch on the values or
+    compute anything from them: the placeholders raise a ValueError when they
+    are compared or tested for truth, and the body is compiled twice with
+    different placeholders and a ValueError is raised when the outputs
+    differ.
+    """
+
+    def __init__(self, f, passes=()):
+        self._f = f
+        self._passes = passes
+        self._signature = inspect.signature(f)
+        self._compiled = {}
+
+        params = self._signature.parameters.values()
+        self._positional = all(p.kind == p.POSITIONAL_OR_KEYWORD for p in params)
+        self._defaults = [p.default for p in params]
+
+    def _compile(self, bound, kinds):
+        compiled = None
+        for p in range(2):
+            bound.arguments = {
+                name: (_IntParam((i + 1) * (p + 2), '\0%d:%d\0' % (p, i)) if kind is int
+                       else _StrParam('\0%d:%d\0' % (p, i)))
+                for i, (name, kind) in enumerate(zip(bound.arguments, kinds))
+            }
+            rec = _build(self._f, bound.args, bound.kwargs, self._passes)
+            code = str(rec)
+            pieces = re.split('\0%d:(\\d+)\0' % p, code)
+
+            # whether every placeholder is rendered inside a string literal
+            literals = [m.span() for m in _STRING_LITERAL.finditer(code)]
+            quoted = [any(a < m.start() < b for a, b in literals)
+                      for m in re.finditer('\0%d:\\d+\0' % p, code)]
+
+            c = (pieces[0::2], [int(i) for i in pieces[1::2]], quoted)
+            if compiled is not None and c != compiled:
+                raise ValueError(
+                    'The body of %s depends on the values of its parameters '
+                    'and cannot be used as a template' % self._f.__name__)
+            compiled = c
+
+        return compiled
+
+    def render(self, *args, **kwargs) -> t.Optional[str]:
+        """
+        Returns the code for the passed values or None when a value has a type
+        which cannot be substituted.
+        """
+        defaults = self._defaults
+        if self._positional and not kwargs and len(args) <= len(defaults) \
+                and inspect.Parameter.empty not in defaults[len(args):]:
+            values = [*args, *defaults[len(args):]]
+            bound = None
+        else:
+            bound = self._signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            values = list(bound.arguments.values())
+
+        kinds = tuple(map(type, values))
+        if not all(k is int or k is str for k in kinds):
+            return None
+
+        compiled = self._compiled.get(kinds)
+        if compiled is None:
+            if bound is None:
+                bound = self._signature.bind(*values)
+            compiled = self._compiled[kinds] = self._compile(bound, kinds)
+
+        segments, order, quoted = compiled
+        code = [segments[0]]
+        for i, in_literal, segment in zip(order, quoted, segments[1:]):
+            v = values[i]
+            if isinstance(v, str):
+                _check_str_param(v, in_literal)
+            code.append(str(v))
+            code.append(segment)
+
+        return ''.join(code)
+
+
+def _build(f, args, kwargs, passes, instrument=False):
+    start = instrument and time.perf_counter()
+    with recording() as rec:
+        f(*args, **kwargs)
+
+    built = instrument and time.perf_counter()
+    for p in passes:
+        p(rec)
+
+    if instrument:
+        rec.instrument = True
+        rec.stats.update(
+            script=f.__name__,
+            build_s=built - start,
+            passes_s=time.perf_counter() - built,
+            nodes=_count_nodes(rec.roots()))
+
+    return rec
+
+
+def _reported(lines, stats, counters):
+    yield from lines
+    stats(counters)
+
+
+def _fold(rec):
+    from fift import fold
+    rec.stats['folded_nodes'] = fold.fold(rec)
+
+
+def _optimize(rec):
+    from fift import peephole
+    peephole.optimize(rec)
+
+
+def _dce(rec):
+    from fift import dce
+    rec.stats['dead_roots'] = dce.eliminate(rec)
+
+
+def _dedup_cells(rec):
+    from fift import dedup
+    rec.stats['merged_cells'] = dedup.dedup_cells(rec)
+
+
+def _factor(rec):
+    from fift import factor
+    rec.stats['factored_words'] = factor.factor(rec)
+
+
+def _check_stack(rec):
+    from fift import stack
+    stack.check('\n'.join(rec.lines()))
+
+
+_LIBRARY_DIGEST = None
+
+
+def _library_digest():
+    """
+    The digest of the sources of the package, it stands for the version of
+    the library in the cache keys.
+    """
+    global _LIBRARY_DIGEST
+    if _LIBRARY_DIGEST is None:
+        h = hashlib.sha256()
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(root)):
+            if name.endswith('.py'):
+                with open(os.path.join(root, name), 'rb') as f:
+                    h.update(name.encode() + b'\0' + f.read())
+        _LIBRARY_DIGEST = h.hexdigest()
+    return _LIBRARY_DIGEST
+
+
+_STDLIB = sysconfig.get_paths()['stdlib']
+_SITE_PACKAGES = (sysconfig.get_paths()['purelib'], sysconfig.get_paths()['platlib'])
+
+
+def _is_stable_module(name):
+    """
+    Whether the module changes only with the Python installation or with
+    this package, whose version is `_library_digest`.
+    """
+    if name == 'fift' or name.startswith('fift.'):
+        return True
+
+    module = sys.modules.get(name)
+    path = module and getattr(module, '__file__', None)
+    if module is None or path is None:
+        # a built-in module
+        return module is not None
+    path = os.path.abspath(path)
+    return path.startswith(_STDLIB) and not path.startswith(_SITE_PACKAGES)
+
+
+def _code_digest(f):
+    """
+    The digest of the code of the function and of the functions it uses
+    through its globals, closure and defaults, the functions of this
+    package are covered by `_library_digest`. The attributes of the
+    imported modules named in the code and the methods of the classes are
+    followed unless they come from the standard library. The other values
+    are hashed by their repr, None is returned when one of them has no
+    stable repr.
+    """
+    h = hashlib.sha256()
+    seen = set()
+    pending = [f]
+    # the names used by the code, the modules are looked up by them
+    names = set()
+    modules = []
+    followed = set()
+
+    def value(n, v):
+        if isinstance(v, (staticmethod, classmethod)):
+            v = v.__func__
+        if inspect.isfunction(getattr(v, '__wrapped__', v)):
+            pending.append(v)
+        elif isinstance(v, property):
+            pending.extend(fn for fn in (v.fget, v.fset, v.fdel) if fn is not None)
+        elif inspect.ismodule(v):
+            h.update(('%s=module %s\0' % (n, v.__name__)).encode())
+            if id(v) not in seen and not _is_stable_module(v.__name__):
+                seen.add(id(v))
+                modules.append(v)
+        elif inspect.isclass(v):
+            h.update(('%s=class %s.%s\0' % (n, v.__module__, v.__qualname__)).encode())
+            for c in v.__mro__:
+                if id(c) in seen or _is_stable_module(c.__module__):
+                    continue
+
+                seen.add(id(c))
+                for name, attr in sorted(vars(c).items()):
+                    if not value('%s.%s' % (c.__qualname__, name), attr):
+                        return False
+        else:
+            r = repr(v)
+            if ' at 0x' in r:
+                return False
+            h.update(('%s=%s\0' % (n, r)).encode())
+        return True
+
+    while pending or any((id(m), n) not in followed for m in modules for n in names):
+        while pending:
+            fn = pending.pop()
+            fn = getattr(fn, '__wrapped__', fn)
+            if id(fn) in seen or not inspect.isfunction(fn) or (fn.__module__ or '').startswith('fift.'):
+                continue
+
+            seen.add(id(fn))
+            h.update(('%s.%s\0%r\0%r' % (fn.__module__, fn.__qualname__, fn.__defaults__,
+                                          fn.__kwdefaults__)).encode())
+            for cell in fn.__closure__ or ():
+                if not value('', cell.cell_contents):
+                    return None
+
+            codes = [fn.__code__]
+            while codes:
+                code = codes.pop()
+                h.update(code.co_code)
+                h.update(repr((code.co_names, code.co_varnames)).encode())
+                names.update(code.co_names)
+                for c in code.co_consts:
+                    if inspect.iscode(c):
+                        codes.append(c)
+                    else:
+                        h.update(repr(c).encode())
+                for n in code.co_names:
+                    if n in fn.__globals__ and not value(n, fn.__globals__[n]):
+                        return None
+
+        # the attributes of a module are found among the names of the code
+        for m in modules:
+            attrs = vars(m)
+            for n in sorted(names):
+                if (id(m), n) in followed:
+                    continue
+
+                followed.add((id(m), n))
+                if n in attrs and not value('%s.%s' % (m.__name__, n), attrs[n]):
+                    return None
+
+    return h.hexdigest()
+
+
+def _cache_key(code_digest, options, args, kwargs):
+    """
+    Returns the key of a call or None when an argument has no stable repr.
+    """
+    if code_digest is None:
+        return None
+
+    r = repr((options, args, sorted(kwargs.items())))
+    if ' at 0x' in r:
+        return None
+    return hashlib.sha256(('%s\0%s\0%s' % (_library_digest(), code_digest, r)).encode()).hexdigest()
+
+
+_UMASK = None
+
+
+def _umask():
+    global _UMASK
+    if _UMASK is None:
+        # the umask can only be read by setting it
+        _UMASK = os.umask(0o022)
+        os.umask(_UMASK)
+    return _UMASK
+
+
+def _write_if_changed(filename, text):
+    """
+    Writes the file atomically and only when its content is different, so
+    the modification time is kept for the unchanged files.
+    """
+    try:
+        with open(filename) as f:
+            if f.read() == text:
+                return
+    except OSError:
+        pass
+
+    with _atomic_file(filename) as f:
+        f.write(text)
+
+
+@contextlib.contextmanager
+def _atomic_file(filename):
+    """
+    Yields a text file which replaces the file when the block exits, the
+    readers never see a partly written file and a failed block keeps the old
+    one.
+    """
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except OSError:
+        mode = 0o666 & ~_umask()
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), prefix='.fift-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            yield f
+        # mkstemp creates the file readable only by the owner, the mode of a
+        # replaced file is kept and a new one gets the usual mode
+        os.chmod(tmp, mode)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def script(out_filename=None, stream=False, template=False, optimize=False, dedup_cells=False, stats=None,
+           cache=None, dce=False, check_stack=False, factor=False, fold=False):
+    """
+    Examples:
+        @script()  # main() returns the generated code
+        @script(out_filename='a.fif')  # and also saves it into a.fif
+        @script(stream=True)  # main() returns a generator of lines
+        @script(out_filename='a.fif', stream=True)  # lines are streamed into a.fif, replaced at the end
+        @script(stream=sock.makefile('w'))  # lines are written into the text stream
+        @script(template=True)  # the body runs once, see `Template`
+        @script(fold=True)  # literal strings and integer expressions are computed, see `fift.fold`
+        @script(optimize=True)  # stack words are simplified, see `fift.peephole`
+        @script(dedup_cells=True)  # repeated cells are defined once, see `fift.dedup`
+        @script(dce=True)  # unused words, constants and repeated includes are removed, see `fift.dce`
+        @script(factor=True)  # repeated code is moved into the generated words, see `fift.factor`
+        @script(check_stack=True)  # a StackError is raised for an underflow, see `fift.stack`
+        @script(stats=print)  # the generation is measured, see below
+        @script(cache='.fift-cache')  # the generated codes are stored in the directory
+
+    The streaming modes render one root at a time and never join the whole
+    script into a single string.
+
+    The stats callback gets a dict every time the code is built from the body
+    (not when a template is filled in or the code comes from the cache) once
+    all the lines are rendered: the `script` name, the `nodes` counts by
+    class, `build_s` to run the body, `passes_s` for the passes, `traverse_s`
+    to walk the nodes and hoist the constants, `render_s` to render them,
+    the number of `hoists`, `output_bytes` and the counters of the passes
+    (`folded_nodes`, `merged_cells`, `dead_roots`, `factored_words`). Nothing
+    is measured without the callback.
+
+    The cache is keyed by the code of the function (and of the functions and
+    the global values it uses), the arguments and the sources of this
+    library. On a hit the stored code is returned without running the body,
+    the calls with the arguments or the globals without a stable repr are
+    not cached. `out_filename` is
+    written atomically and only when its content changes.
+    """
+    if template and stream:
+        raise ValueError('A template script cannot be streamed')
+    if cache is not None and stream:
+        raise ValueError('A cached script cannot be streamed')
+
+    passes = []
+    if fold:
+        passes.append(_fold)
+    if optimize:
+        passes.append(_optimize)
+    if dce:
+        passes.append(_dce)
+    if dedup_cells:
+        passes.append(_dedup_cells)
+    if factor:
+        passes.append(_factor)
+    if check_stack:
+        passes.append(_check_stack)
 
     def w(f):
         SCRIPTS[f.__name__] = []
+        tmpl = template and Template(f, passes) or None
+        options = (optimize, dedup_cells, dce, check_stack, factor, fold)
 
+        # keeps the name of the wrapped function, so the script can be pickled
+        # by reference and sent to the workers of `generate_many`
+        @functools.wraps(f)
         def w2(*args, **kwargs):
-            f(*args, **kwargs)
+            cached = None
+            if cache is not None:
+                # the digest is taken on every call, the functions defined
+                # after the script and the globals can change between calls
+                key = _cache_key(_code_digest(f), options, args, kwargs)
+                cached = key and os.path.join(cache, key[:2], key + '.fif')
+                if cached and os.path.exists(cached):
+                    with open(cached) as cf:
+                        fift_code = cf.read()
+                    if out_filename is not None:
+                        _write_if_changed(out_filename, fift_code)
+                    return fift_code
+
+            fift_code = tmpl and tmpl.render(*args, **kwargs)
+            if fift_code is None:
+                rec = _build(f, args, kwargs, passes, instrument=stats is not None)
+                lines = rec.lines()
+                if stats is not None:
+                    lines = _reported(lines, stats, rec.stats)
+
+                if stream is True and out_filename is None:
+                    return lines
+
+                if stream:
+                    if stream is True:
+                        with _atomic_file(out_filename) as of:
+                            _write_lines(lines, of)
+                    else:
+                        _write_lines(lines, stream)
+                    return
+
+                fift_code = '\n'.join(lines)
+
+            if cached:
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+                _write_if_changed(cached, fift_code)
 
-            for rm in _root_methods():
-                _inner(rm)
-
-            fift_code = '\n'.join(code_lines_iter())
             if out_filename is not None:
-                with open(out_filename, 'w+') as of:
-                    of.write(fift_code)
+                _write_if_changed(out_filename, fift_code)
 
             return fift_code
         return w2
     return w
 
 
+def _generate(script_fn, out_filename, item):
+    index, kwargs = item
+    fift_code = script_fn(**kwargs)
+    if out_filename is not None:
+        _write_if_changed(out_filename.format(index=index, **kwargs), fift_code)
+
+    return fift_code
+
+
+def generate_many(script_fn, iterable_of_kwargs, workers=None, chunksize=64, out_filename=None):
+    """
+    Calls the `@script` function with every kwargs dict of the iterable in a
+    pool of `workers` processes and returns the generated codes in the same
+    order. `workers=1` generates everything in the current process.
+
+    The script function has to be defined at the module level to be sent to
+    the workers. `out_filename` is formatted with the kwargs and the `index`
+    of the call to get the name of the file for each code, the files are
+    written atomically and only when their content changes.
+
+    Examples:
+        generate_many(wallet_query, ({'seqno': i} for i in range(1000)), out_filename='query-{index}.fif')
+    """
+    job = functools.partial(_generate, script_fn, out_filename)
+    items = enumerate(iterable_of_kwargs)
+
+    if workers == 1:
+        return list(map(job, items))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(job, items, chunksize=chunksize))
+
+
 def seq(*args, separator=' '):
     return separator.join(str(a) for a in args if a is not None)
 
 
 class Dup(Interface):
+    __slots__ = ('_double', '_non_zero')
+
     def __init__(self, double=False, non_zero=False):
         super(Dup, self).__init__()
         self._double = double
         self._non_zero = non_zero
 
-    def __str__(self):
+    def _render(self):
         return '%sdup' % (self._non_zero and '?' or (self._double and '2' or ''))
 
 
@@ -119,11 +1013,13 @@ def dupnz():
 
 
 class Drop(Interface):
+    __slots__ = ('_double',)
+
     def __init__(self, double=False):
         super(Drop, self).__init__()
         self._double = double
 
-    def __str__(self):
+    def _render(self):
         return '%sdrop' % (self._double and '2' or '')
 
 
@@ -138,11 +1034,13 @@ def drop2():
 
 
 class Swap(Interface):
+    __slots__ = ('_double',)
+
     def __init__(self, double=False):
         super(Swap, self).__init__()
         self._double = double
 
-    def __str__(self):
+    def _render(self):
         return '%sswap' % (self._double and '2' or '')
 
 
@@ -157,11 +1055,13 @@ def swap2():
 
 
 class Rot(Interface):
+    __slots__ = ('_neg',)
+
     def __init__(self, neg=False):
         super(Rot, self).__init__()
         self._neg = neg
 
-    def __str__(self):
+    def _render(self):
         return '%srot' % (self._neg and '-' or '')
 
 
@@ -176,7 +1076,9 @@ def nrot():
 
 
 class Over(Interface):
-    def __str__(self):
+    __slots__ = ()
+
+    def _render(self):
         return 'over'
 
 
@@ -186,7 +1088,9 @@ def over():
 
 
 class Tuck(Interface):
-    def __str__(self):
+    __slots__ = ()
+
+    def _render(self):
         return 'tuck'
 
 
@@ -196,7 +1100,9 @@ def tuck():
 
 
 class Nip(Interface):
-    def __str__(self):
+    __slots__ = ()
+
+    def _render(self):
         return 'nip'
 
 
@@ -206,11 +1112,13 @@ def nip():
 
 
 class Pick(Interface):
+    __slots__ = ('_n',)
+
     def __init__(self, n):
         super(Pick, self).__init__()
         self._n = n
 
-    def __str__(self):
+    def _render(self):
         return '%s pick' % self._n
 
 
@@ -223,12 +1131,14 @@ def pick(n):
 
 
 class Roll(Interface):
+    __slots__ = ('_n', '_neg')
+
     def __init__(self, n, neg=False):
         super(Roll, self).__init__()
         self._n = n
         self._neg = neg
 
-    def __str__(self):
+    def _render(self):
         return '%s %sroll' % (self._n, self._neg and '-' or '')
 
 
@@ -249,12 +1159,14 @@ def nroll(n):
 
 
 class Exch(Interface):
+    __slots__ = ('_n', '_m')
+
     def __init__(self, n, m=None):
         super(Exch, self).__init__()
         self._n = n
         self._m = m
 
-    def __str__(self):
+    def _render(self):
         if self._m is None:
             return '%s exch' % self._n
         else:
@@ -277,7 +1189,9 @@ def exch2(n, m):
 
 
 class Dump(Interface):
-    def __str__(self):
+    __slots__ = ()
+
+    def _render(self):
         return '.s'
 
 
@@ -287,11 +1201,13 @@ def dump():
 
 
 class Halt(Interface):
+    __slots__ = ('_code',)
+
     def __init__(self, code):
         super(Halt, self).__init__()
         self._code = code
 
-    def __str__(self):
+    def _render(self):
         return '%s halt' % self._code
 
 
@@ -301,11 +1217,13 @@ def halt(code):
 
 
 class Abort(Interface):
+    __slots__ = ('_text',)
+
     def __init__(self, text):
         super(Abort, self).__init__()
         self._text = text
 
-    def __str__(self):
+    def _render(self):
         return 'abort%s' % String(self._text)
 
 
@@ -315,6 +1233,8 @@ def abort(text):
 
 
 class String(Interface):
+    __slots__ = ('_print', '_cr')
+
     def __init__(self, *args):
         super(String, self).__init__(*args)
         self._print = False
@@ -338,12 +1258,13 @@ class String(Interface):
 
             yield r
 
-    def __str__(self):
+    def _render(self):
         return seq(*self._g()) + (self._cr and ' cr' or '')
 
     def print(self, cr=False):
         self._print = True
         self._cr = cr
+        _changed(self)
         return self
 
 
@@ -353,14 +1274,15 @@ def string(*args):
 
 
 class Const(Interface):
+    __slots__ = ('_name', '_type')
+
     def __init__(self, name, *args):
         super(Const, self).__init__(*args)
 
-        self._defined = False
         self._name = name
         self._type = False
 
-    def __str__(self):
+    def _render(self):
         if self._type:
             return '%s type' % self.read()
 
@@ -376,9 +1298,9 @@ class Const(Interface):
         elif not self._args:
             return
 
-        elif not self._defined:
-            self._defined = True
-            code_lines.insert(len(code_lines) - 1, self)
+        elif self not in code_lines.defined:
+            code_lines.defined.add(self)
+            code_lines.hoist(self)
 
     def get_name(self):
         return self._name
@@ -389,11 +1311,16 @@ class Const(Interface):
         return '@\' %s' % self._name
 
     def type(self):
-        self._type = True
+        if not self._type:
+            self._type = True
+            _changed(self)
         return self
 
 
 class AddToDict(Interface):
+    __slots__ = ('_interface', '_key', '_size', '_val', '_exc')
+    _render_slots = ('_key', '_val')
+
     size_map = {
         'i': 'idict!',
         'u': 'udict!',
@@ -407,7 +1334,7 @@ class AddToDict(Interface):
         self._val = val
         self._exc = exc
 
-    def __str__(self):
+    def _render(self):
         args = [
             self._val,
             '<s', self._key,
@@ -416,9 +1343,9 @@ class AddToDict(Interface):
             self.size_map[self._size[1]] + (self._exc and '+' or ''),
         ]
         if self._exc:
-            args += ['not', abort(self._exc)]
+            args += ['not', Abort(self._exc)]
 
-        return str(Assign(self._interface.name, *args))
+        return _assign_code(self._interface.name, args)
 
 
 @method()
@@ -426,9 +1353,70 @@ def add_to_dict(interface, key, size, val, exc):
     return AddToDict(interface, key, size, val, exc)
 
 
+def _fill_dict(items, size, exc):
+    """
+    Renders the data table of the entries and the loop which adds them to
+    the dictionary on the top of the stack: `<table> <dict> { ... } N times`
+    leaves the filled dictionary.
+    """
+    if not items:
+        return '', ''
+
+    op = AddToDict.size_map[size[1]] + (exc and '+' or '')
+    # the first entry is added first, so it goes on the top of the stack
+    table = seq(*(seq(v, '<s', k) for k, v in reversed(items)))
+    check = exc and seq('not', Abort(exc)) or 'drop'
+    return table, '{ %s %s %s } %d times' % (size[0], op, check, len(items))
+
+
+class UpdateDict(Interface):
+    __slots__ = ('_interface', '_items', '_size', '_exc')
+    _render_slots = ('_items',)
+
+    def __init__(self, interface, items, size, exc):
+        super(UpdateDict, self).__init__()
+        self._interface = interface
+        self._items = items
+        self._size = size
+        self._exc = exc
+
+    def _render(self):
+        table, loop = _fill_dict(self._items, self._size, self._exc)
+        if not table:
+            return ''
+
+        return _assign_code(self._interface.name, (table, self._interface.read(), loop))
+
+
+@method()
+def update_dict(interface, items, size, exc):
+    res = UpdateDict(interface, items, size, exc)
+    _as_ref([v for _, v in items], res)
+    return res
+
+
 class Dict(Const):
-    def __str__(self):
-        return 'dictnew constant %s' % self._name
+    __slots__ = ('_items', '_size')
+    _render_slots = ('_items',)
+
+    def __init__(self, name, *args, size=None):
+        super(Dict, self).__init__(name, *args)
+        self._items = list(args[-1].items())
+        self._size = size
+        if self._items and size is None:
+            raise ValueError('The key size of the dictionary %s is not set' % name)
+        _as_ref([v for _, v in self._items], self)
+
+    def _render(self):
+        # a dictionary of literal values is built in Python and embedded as
+        # a BOC literal, otherwise it is filled by the Fift code
+        cells = [_literal_cell(v) for _, v in self._items]
+        if self._items and None not in cells:
+            root = build_hashmap(zip((k for k, _ in self._items), cells), *self._size)
+            return 'B{%s} B>boc constant %s' % (serialize_boc(root, has_crc32c=False).hex().upper(), self._name)
+
+        table, loop = _fill_dict(self._items, self._size, False)
+        return seq(table or None, 'dictnew', loop or None, 'constant', self._name)
 
     def __setitem__(self, key, value):
         self.add(key, value[0], value[1], value[2] if len(value) > 2 else False)
@@ -444,21 +1432,43 @@ class Dict(Const):
         add_to_dict(self, key, size, val, exc)
         return self
 
+    def update(self, entries, size: t.Tuple[int, str], exc: t.Union[bool, str] = False):
+        """
+        Adds all the entries with one table and one loop instead of a line
+        per entry.
+
+        Examples:
+            a.update({1: builder().u(1, 8), 2: builder().u(2, 8)}, (16, 'u'))
+            a.update(((i, builder().u(i, 32)) for i in range(50000)), (32, 'u'))
+        """
+        items = list(isinstance(entries, dict) and entries.items() or entries)
+        update_dict(self, items, size, exc)
+        return self
+
 
 @method()
-def const(name, *args):
+def const(name, *args, size=None):
+    """
+    Examples:
+        const('a', 1)
+        const('d', {})  # an empty dictionary
+        const('d', {1: builder().u(7, 8)}, size=(16, 'u'))  # a filled dictionary
+    """
     is_dict = args and isinstance(args[-1], dict)
-    cls = is_dict and Dict or Const
-    return cls(name, *args)
+    if is_dict:
+        return Dict(name, *args, size=size)
+    return Const(name, *args)
 
 
 class Include(Interface):
+    __slots__ = ('_name',)
+
     def __init__(self, name, *args):
         super(Include, self).__init__(*args)
 
         self._name = name
 
-    def __str__(self):
+    def _render(self):
         return '%s include' % String(self._name)
 
     def const(self, name):
@@ -471,6 +1481,8 @@ def include(name):
 
 
 class Assign(Interface):
+    __slots__ = ('_name', '_double')
+
     def __init__(self, name, *args, double=False):
         super(Assign, self).__init__(*args)
 
@@ -480,11 +1492,14 @@ class Assign(Interface):
     def _resolve_name(self):
         return isinstance(self._name, Const) and self._name.name or self._name
 
-    def __str__(self):
-        return '%s %s=: %s' % (
-            seq(*self._args),
-            self._double and '2' or '',
-            self._resolve_name())
+    def _render(self):
+        return _assign_code(self._resolve_name(), self._args, self._double)
+
+
+def _assign_code(name, args, double=False):
+    # the nodes which assign a value render it without a temporary `Assign`,
+    # which would be registered as a parent of the nodes in the value
+    return '%s %s=: %s' % (seq(*args), double and '2' or '', name)
 
 
 @method()
@@ -498,7 +1513,9 @@ def assign2(name, *args):
 
 
 class Block(Interface):
-    def __str__(self):
+    __slots__ = ()
+
+    def _render(self):
         return '{ %s }' % seq(*self._args)
 
 
@@ -508,11 +1525,14 @@ def block(*args):
 
 
 class Word(Interface):
-    def __init__(self, name, *args):
+    __slots__ = ('_name', '_export')
+
+    def __init__(self, name, *args, export=False):
         super(Word, self).__init__(*args)
         self._name = name
+        self._export = export
 
-    def __str__(self):
+    def _render(self):
         return '{ %s } : %s' % (
             seq(*(
                 isinstance(a, Word) and a.name
@@ -522,35 +1542,65 @@ class Word(Interface):
             self._name)
 
     def __call__(self, *args, **kwargs):
-        @method()
-        def inner(name, *_args):
-            class _I(Interface):
-                def __str__(self):
-                    return seq(seq(*_args), name)
-
-            return _I()
-
-        return inner(self.name, *args)
+        return call_word(self.name, *args)
 
     def get_name(self):
         return self._name
 
     name = property(get_name)
 
+    def get_exported(self):
+        return self._export
+
+    exported = property(get_exported)
+
 
 @method()
-def word(name, *args):
-    return Word(name, *args)
+def word(name, *args, export=False):
+    """
+    Examples:
+        word('square', dup(), '*')
+        word('main', ..., export=True)  # kept by `script(dce=True)` even if it is not called
+    """
+    return Word(name, *args, export=export)
+
+
+class WordCall(Interface):
+    __slots__ = ('_name',)
+
+    def __init__(self, name, *args):
+        super(WordCall, self).__init__(*args)
+        self._name = name
+
+    def _render(self):
+        return seq(seq(*self._args), self._name)
+
+
+@method()
+def call_word(name, *args):
+    return WordCall(name, *args)
 
 
 class Builder(Interface):
+    __slots__ = ('_inspect', '_alias', '_cell')
+
     def __init__(self):
         super(Builder, self).__init__()
         self._inspect = False
+        self._alias = None
+        self._cell = None
         self._args = []
 
-    def __str__(self):
-        r = seq(*(seq(*a) for a in self._args), separator=', ')
+    def _invalidate(self):
+        self._rendered = None
+        self._cell = None
+
+    def _render(self):
+        if self._alias is not None:
+            return self._alias.read()
+
+        r = seq(*(seq(*(isinstance(v, bytes) and 'B{%s}' % v.hex().upper() or v for v in a))
+                  for a in self._args), separator=', ')
 
         return '<b %s%s b>' % (
             r and r + ',' or '',
@@ -558,32 +1608,124 @@ class Builder(Interface):
 
     def inspect(self):
         self._inspect = True
+        _changed(self)
         return self
 
     def u(self, val, size):
         self._args.append((val, size, 'u'))
+        _changed(self)
         return self
 
     def i(self, val, size):
         self._args.append((val, size, 'i'))
+        _changed(self)
         return self
 
     def b(self, val):
         self._args.append((val, 'B'))
+        _changed(self)
         return self
 
     def s(self, val):
         self._args.append((val, 's'))
+        _changed(self)
         return self
 
     def r(self, val):
         self._args.append((val, 'ref'))
+        _changed(self)
         return self
 
     def d(self, val='null'):
         self._args.append((isinstance(val, Const) and val.read() or val, 'dict'))
+        _changed(self)
         return self
 
+    def cell(self):
+        """
+        Builds the cell in memory instead of rendering the Fift code. Only
+        literal values can be stored: integers, bytes, `b{..}`/`x{..}`
+        bitstrings, cells and slices, and builders (or constants defined
+        with a builder) as references.
+        """
+        # cached like the renderings, until the builder or a nested builder
+        # is changed
+        if self._cell is not None:
+            return self._cell
+
+        b = CellBuilder()
+        for a in self._args:
+            val, kind = a[0], a[-1]
+            if kind == 'u' and _is_int(val, a[1]):
+                b.store_uint(val, a[1])
+            elif kind == 'i' and _is_int(val, a[1]):
+                b.store_int(val, a[1])
+            elif kind == 'B' and isinstance(val, bytes):
+                b.store_bytes(val)
+            elif kind == 's' and isinstance(val, (str, Cell, CellSlice)):
+                b.store_slice(_native_slice(val))
+            elif kind == 'ref' and _native_cell(val, self) is not None:
+                b.store_ref(_native_cell(val, self))
+            elif kind == 'dict' and (val in (None, 'null') or isinstance(val, Cell)):
+                b.store_maybe_ref(val != 'null' and val or None)
+            else:
+                raise TypeError('Cannot build a cell from %r' % (a,))
+
+        self._cell = b.end_cell()
+        return self._cell
+
+    def boc(self, has_idx=False, has_crc32c=True):
+        """
+        Builds the cell in memory and serializes it into bag-of-cells bytes.
+        """
+        return serialize_boc(self.cell(), has_idx=has_idx, has_crc32c=has_crc32c)
+
+
+_LITERALS = (int, str, bytes, Cell, type(None))
+
+
+def _literal_cell(node):
+    """
+    Returns the cell built by a builder of literal values or None when the
+    builder depends on the stack, a constant or a template parameter.
+    """
+    if type(node) is not Builder or node._inspect:
+        return None
+
+    for a in node.args:
+        for v in a[:-1]:
+            if type(v) not in _LITERALS and _literal_cell(v) is None:
+                return None
+
+    try:
+        return node.cell()
+    except (TypeError, CellError):
+        return None
+
+
+def _is_int(val, size):
+    return isinstance(val, int) and isinstance(size, int)
+
+
+def _native_slice(val):
+    if isinstance(val, str):
+        return Cell(*parse_bitstring(val)).begin_parse()
+    if isinstance(val, Cell):
+        return val.begin_parse()
+    return val
+
+
+def _native_cell(val, parent):
+    if isinstance(val, Const) and len(val.args) == 1 and isinstance(val.args[0], Builder):
+        val = val.args[0]
+    if isinstance(val, Builder):
+        # the cached cell of the parent is dropped when the builder changes
+        _add_parent(val, parent)
+        return val.cell()
+    if isinstance(val, Cell):
+        return val
+    return None
+
 
 @method()
 def builder():
@@ -591,12 +1733,15 @@ def builder():
 
 
 class Slice(Interface):
+    __slots__ = ('_unpack_args', '_silent')
+    _render_slots = ('_args', '_unpack_args')
+
     def __init__(self, *args, silent=False):
         super(Slice, self).__init__(*args)
         self._unpack_args = []
         self._silent = silent
 
-    def __str__(self):
+    def _render(self):
         return '<s %s%s' % (
             seq(*self._args),
             (self._args and self._unpack_args and ' ' or '') + seq(*(seq(*ua) for ua in self._unpack_args)))
@@ -611,6 +1756,7 @@ class Slice(Interface):
             v = (Assign(s2c.name, size, self._symbol('u')),)
 
         self._unpack_args.append(v)
+        _changed(self)
         return self
 
     def s(self, size, s2c=None):
@@ -620,6 +1766,7 @@ class Slice(Interface):
             v = (Assign(s2c.name, size, self._symbol('s')),)
 
         self._unpack_args.append(v)
+        _changed(self)
         return self
 
     def b(self, size, s2c=None):
@@ -629,6 +1776,7 @@ class Slice(Interface):
             v = (Assign(s2c.name, size, self._symbol('B')),)
 
         self._unpack_args.append(v)
+        _changed(self)
         return self
 
     def r(self, s2c=None):
@@ -638,6 +1786,7 @@ class Slice(Interface):
             v = (Assign(s2c.name, self._symbol('ref')),)
 
         self._unpack_args.append(v)
+        _changed(self)
         return self
 
     def d(self, s2c=None):
@@ -647,6 +1796,7 @@ class Slice(Interface):
             v = (Assign(s2c.name, self._symbol('dict')),)
 
         self._unpack_args.append(v)
+        _changed(self)
         return self
 
 
@@ -656,11 +1806,14 @@ def slice(*args, silent=False):
 
 
 class ReadFromFile(Interface):
+    __slots__ = ('_name',)
+    _render_slots = ('_name',)
+
     def __init__(self, name):
         super(ReadFromFile, self).__init__()
         self._name = name
 
-    def __str__(self):
+    def _render(self):
         return '%s file>B' % self._name
 
 
@@ -670,11 +1823,14 @@ def read_from_file(name):
 
 
 class WriteToFile(Interface):
+    __slots__ = ('_name',)
+    _render_slots = ('_name',)
+
     def __init__(self, name):
         super(WriteToFile, self).__init__()
         self._name = name
 
-    def __str__(self):
+    def _render(self):
         return '%s B>file' % self._name
 
 
@@ -684,7 +1840,9 @@ def write_to_file(name):
 
 
 class Deserialize(Interface):
-    def __str__(self):
+    __slots__ = ()
+
+    def _render(self):
         return '%s B>boc' % seq(*self._args)
 
 
@@ -694,11 +1852,14 @@ def deserialize(*args):
 
 
 class File(Interface):
+    __slots__ = ('_name',)
+    _render_slots = ()
+
     def __init__(self, name):
         super(File, self).__init__()
         self._name = name
 
-    def __str__(self):
+    def _render(self):
         return ''
 
     def _resolve_name(self):
@@ -714,6 +1875,22 @@ class File(Interface):
         deserialize(ReadFromFile(self._resolve_name()))
         return slice()
 
+    @contextlib.contextmanager
+    def parse(self, root=0):
+        """
+        Memory-maps the BOC file in Python and yields a cursor over its root
+        cell, the cursor `u/i/b/s/r/d` read the fields from the mapped file.
+        The file is unmapped when the block exits.
+
+        Examples:
+            with file('state.boc').parse() as s:
+                s.u(7), s.r().u(64)
+        """
+        if not isinstance(self._name, str):
+            raise TypeError('Cannot open a file named by %r' % (self._name,))
+        with BocReader.open(self._name) as reader:
+            yield reader.root(root)
+
 
 @method()
 def file(name):
@@ -721,11 +1898,13 @@ def file(name):
 
 
 class IsDef(Interface):
+    __slots__ = ('_word_name',)
+
     def __init__(self, word_name):
         super(IsDef, self).__init__()
         self._word_name = word_name
 
-    def __str__(self):
+    def _render(self):
         return 'def? %s' % (self._word_name,)
 
 
@@ -735,13 +1914,16 @@ def is_def(word_name):
 
 
 class Cond(Interface):
+    __slots__ = ('_v', '_pos_args', '_neg_args')
+    _render_slots = ('_v', '_pos_args', '_neg_args')
+
     def __init__(self, v=None, pos_args=None, neg_args=None):
         super(Cond, self).__init__()
         self._v = v
         self._pos_args = pos_args
         self._neg_args = neg_args
 
-    def __str__(self):
+    def _render(self):
         return '%s{ %s } { %s } cond' % (
             self._v is not None and str(self._v) + ' ' or '',
             self._pos_args and seq(*self._pos_args) or '',
@@ -750,14 +1932,203 @@ class Cond(Interface):
     def pos(self, *args):
         _as_ref(args)
         self._pos_args = args
+        _changed(self)
         return self
 
     def neg(self, *args):
         _as_ref(args)
         self._neg_args = args
+        _changed(self)
         return self
 
 
 @method()
 def cond(v=None, pos_args=None, neg_args=None):
     return Cond(v=v, pos_args=pos_args, neg_args=neg_args)
+
+
+class Times(Interface):
+    __slots__ = ('_count',)
+    _render_slots = ('_count', '_args')
+
+    def __init__(self, count, *args):
+        super(Times, self).__init__(*args)
+        self._count = count
+
+    def _render(self):
+        # without the count it is taken from the stack under the block
+        return '{ %s } %s times' % (seq(*self._args), self._count is None and 'swap' or self._count)
+
+
+@method()
+def times(count, *args):
+    """
+    Examples:
+        times(3, string('a').print())  # `{ ."a" } 3 times`
+        times(const('n').read(), dup(), '*')  # `{ dup * } @' n times`
+        times(None, drop())  # the count is on the stack, `{ drop } swap times`
+    """
+    return Times(count, *args)
+
+
+class Until(Interface):
+    __slots__ = ()
+
+    def _render(self):
+        return '{ %s } until' % seq(*self._args)
+
+
+@method()
+def until(*args):
+    """
+    The body runs until it leaves a true flag on the stack.
+
+    Examples:
+        until('1+', dup(), 10, '=')  # `{ 1+ dup 10 = } until`
+    """
+    return Until(*args)
+
+
+class While(Interface):
+    __slots__ = ('_body',)
+    _render_slots = ('_args', '_body')
+
+    def __init__(self, *args):
+        super(While, self).__init__(*args)
+        self._body = ()
+
+    def _render(self):
+        return '{ %s } { %s } while' % (seq(*self._args), seq(*self._body))
+
+    def do(self, *args):
+        _as_ref(args, self)
+        self._body = args
+        _changed(self)
+        return self
+
+
+@method()
+def while_(*args):
+    """
+    The body runs while the condition leaves a true flag on the stack.
+
+    Examples:
+        while_(dup(), 10, '<').do('1+')  # `{ dup 10 < } { 1+ } while`
+    """
+    return While(*args)
+
+
+class ForRange(Interface):
+    __slots__ = ('_start', '_stop', '_step')
+    _render_slots = ('_start', '_stop', '_args')
+
+    def __init__(self, start, stop, step=1):
+        super(ForRange, self).__init__()
+        # the sign of the step decides how the count is rounded, so it has
+        # to be known when the code is generated
+        if not isinstance(step, int):
+            raise TypeError('The step of the range has to be an int, not %r' % (step,))
+        if not step:
+            raise ValueError('The step of the range cannot be zero')
+
+        self._start = start
+        self._stop = stop
+        self._step = step
+
+    def _count(self):
+        if isinstance(self._start, int) and isinstance(self._stop, int):
+            return len(range(self._start, self._stop, self._step))
+
+        # the number of the values rounded up, it is computed by Fift when
+        # the bounds are not known in Python
+        return seq(self._stop, self._start, '-', self._step - (self._step > 0 and 1 or -1), '+', self._step, '/',
+                   '0 max')
+
+    def _render(self):
+        return '%s { dup %s%s + } %s times drop' % (
+            self._start, self._args and seq(*self._args) + ' ' or '', self._step, self._count())
+
+    def do(self, *args):
+        _as_ref(args, self)
+        self._args = args
+        _changed(self)
+        return self
+
+
+@method()
+def for_range(start, stop, step=1):
+    """
+    Runs the body for every value of `range(start, stop, step)`, the body
+    gets the value on the top of the stack and has to consume it. The bounds
+    can be computed by Fift, the step has to be an int.
+
+    Examples:
+        for_range(0, 3).do('.')  # `0 { dup . 1 + } 3 times drop`
+        for_range(0, const('n').read()).do(drop())  # the count is computed by Fift
+    """
+    return ForRange(start, stop, step)
+
+
+class Switch(Interface):
+    __slots__ = ('_v', '_keys', '_bodies', '_default')
+    _render_slots = ('_v', '_bodies', '_default')
+
+    def __init__(self, v, cases, default=()):
+        super(Switch, self).__init__()
+        for k in cases:
+            if not isinstance(k, int):
+                raise TypeError('The case of a switch has to be an int, not %r' % (k,))
+
+        self._v = v
+        self._keys = sorted(cases)
+        self._bodies = [_as_body(cases[k]) for k in self._keys]
+        self._default = _as_body(default)
+
+    def _tree(self, lo, hi, found, default):
+        # the keys are split in halves, so a value is found with about
+        # log2(len(keys)) comparisons
+        if hi - lo == 1:
+            return 'dup %s = { %s } { %s } cond' % (
+                self._keys[lo], seq(found, *self._bodies[lo]), default)
+
+        mid = (lo + hi) // 2
+        return 'dup %s < { %s } { %s } cond' % (
+            self._keys[mid], self._tree(lo, mid, found, default), self._tree(mid, hi, found, default))
+
+    def _render(self):
+        if not self._keys:
+            return seq(self._v, 'drop', *self._default)
+
+        if not self._default or len(self._keys) == 1:
+            # the default body is rendered once, the branch drops the value
+            default = seq('drop', *self._default)
+            return seq(self._v, self._tree(0, len(self._keys), 'drop', default))
+
+        # the default body is kept as a block under the value, so it is
+        # rendered once and every leaf which does not match runs it
+        return seq(self._v, '{ %s } swap' % seq(*self._default),
+                   self._tree(0, len(self._keys), '2drop', 'drop execute'))
+
+
+def _as_body(v):
+    return tuple(v) if isinstance(v, (tuple, list)) else (v,)
+
+
+@method()
+def switch(v, cases, default=()):
+    """
+    Runs the body of the case equal to the value or the default body, the
+    value is dropped before the body runs. Without the value it is taken from
+    the stack. The cases are compared as a balanced tree, so the dispatch
+    takes about log2(len(cases)) comparisons. The default body is rendered
+    once as a block which the cases which do not match execute.
+
+    Examples:
+        switch(None, {1: string('one').print(), 2: (dup(), '*')}, default=string('?').print())
+        # `{ ."?" } swap dup 2 < { dup 1 = { 2drop ."one" } { drop execute } cond }
+        #  { dup 2 = { 2drop dup * } { drop execute } cond } cond`
+        switch(const('op').read(), {0: ..., 1: ...})  # `@' op dup 1 < { ... } { ... } cond`
+    """
+    res = Switch(v, cases, default)
+    _as_ref([a for b in res._bodies + [res._default] for a in b], res)
+    return res
@@ -0,0 +1,164 @@
+"""
+Constant folding of the values known when the code is generated.
+
+The adjacent literal parts of a string, the Python strings and integers,
+are merged into one quoted literal: `"a" "b" $+ 1 (.) $+` becomes `"ab1"`.
+The integer expressions of the values of the constants and of the
+assignments are computed when all their operands are integer literals:
+`1 2 + constant a` becomes `3 constant a`. The values read from the
+constants, the nodes and the other words are computed by Fift as before.
+"""
+
+from fift.fift import Assign, Const, Dict, String, _changed, _reachable
+from fift.interp import MAX_INT, MIN_INT
+
+
+def _flag(v):
+    return v and -1 or 0
+
+
+def _div(a, b):
+    if b:
+        return a // b
+
+
+def _mod(a, b):
+    if b:
+        return a % b
+
+
+def _shift_left(a, b):
+    # a longer shift overflows unless the value is zero
+    if 0 <= b <= 256:
+        return a << b
+
+
+def _shift_right(a, b):
+    if 0 <= b <= 1023:
+        return a >> b
+
+
+# the words which are computed like `fift.interp` does, None is returned
+# when Fift raises an error
+BINARY = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': _div,
+    'mod': _mod,
+    'min': min,
+    'max': max,
+    'and': lambda a, b: a & b,
+    'or': lambda a, b: a | b,
+    'xor': lambda a, b: a ^ b,
+    '<<': _shift_left,
+    '>>': _shift_right,
+    '<': lambda a, b: _flag(a < b),
+    '>': lambda a, b: _flag(a > b),
+    '<=': lambda a, b: _flag(a <= b),
+    '>=': lambda a, b: _flag(a >= b),
+    '=': lambda a, b: _flag(a == b),
+    '<>': lambda a, b: _flag(a != b),
+    'cmp': lambda a, b: (a > b) - (a < b),
+}
+
+UNARY = {
+    'negate': lambda a: -a,
+    'abs': abs,
+    'not': lambda a: ~a,
+    '1+': lambda a: a + 1,
+    '1-': lambda a: a - 1,
+    '2+': lambda a: a + 2,
+    '2-': lambda a: a - 2,
+    '2*': lambda a: a * 2,
+    '2/': lambda a: a >> 1,
+    'sgn': lambda a: (a > 0) - (a < 0),
+    '0=': lambda a: _flag(a == 0),
+    '0<>': lambda a: _flag(a != 0),
+    '0<': lambda a: _flag(a < 0),
+    '0>': lambda a: _flag(a > 0),
+    '0<=': lambda a: _flag(a <= 0),
+    '0>=': lambda a: _flag(a >= 0),
+}
+
+
+def _is_int(v):
+    # the booleans and the placeholders of the templates are not folded, a
+    # result out of the range is left to Fift which raises the overflow
+    return type(v) is int and MIN_INT <= v <= MAX_INT
+
+
+def fold_expression(args):
+    """
+    Computes the integer words of the sequence whose operands are integer
+    literals, the operands are on the top of the stack when the word runs.
+
+    Examples:
+        fold_expression((1, 2, '+', 3, '*'))  # (9,)
+        fold_expression((const('a').read(), 2, 3, '*', '+'))  # ("@' a", 6, '+')
+    """
+    out = []
+    for a in args:
+        r = None
+        if isinstance(a, str) and a in BINARY and len(out) > 1 and _is_int(out[-2]) and _is_int(out[-1]):
+            r = BINARY[a](out[-2], out[-1])
+            n = 2
+        elif isinstance(a, str) and a in UNARY and out and _is_int(out[-1]):
+            r = UNARY[a](out[-1])
+            n = 1
+
+        if r is not None and _is_int(r):
+            del out[-n:]
+            out.append(r)
+        else:
+            out.append(a)
+
+    return tuple(out)
+
+
+def _is_literal(v):
+    return isinstance(v, str) or isinstance(v, int) and not isinstance(v, bool)
+
+
+def fold_string(args):
+    """
+    Merges the adjacent strings and integers of the parts of a string into
+    one string.
+
+    Examples:
+        fold_string(('a', 'b', 1, const('c'), 'd'))  # ('ab1', Const, 'd')
+    """
+    out = []
+    for a in args:
+        if _is_literal(a) and out and _is_literal(out[-1]):
+            out[-1] = '%s%s' % (out[-1], a)
+        elif isinstance(a, int) and _is_literal(a):
+            # a single integer is rendered as a string as well
+            out.append('%s' % a)
+        else:
+            out.append(a)
+
+    return tuple(out)
+
+
+def fold(recorder):
+    """
+    Folds the strings, the constants and the assignments reachable from the
+    roots of the recorder and returns the number of the changed nodes.
+    """
+    folded = 0
+    for m in _reachable(list(recorder.roots())):
+        if isinstance(m, String):
+            args = fold_string(m._args)
+        elif isinstance(m, Assign) or isinstance(m, Const) and m._args and not isinstance(m, Dict):
+            args = fold_expression(m._args)
+        else:
+            continue
+
+        # the placeholders of the templates cannot be compared
+        if len(args) != len(m._args) or any(a is not b for a, b in zip(args, m._args)):
+            m._args = args
+            _changed(m)
+            folded += 1
+
+    return folded
@@ -0,0 +1,153 @@
+"""
+The TON dictionaries (HashmapE n X) built and parsed in Python.
+
+    hm_edge#_ label:(HmLabel ~l n) node:(HashmapNode m X) = Hashmap n X;  n = m + l
+    hmn_leaf#_ value:X = HashmapNode 0 X;
+    hmn_fork#_ left:^(Hashmap n X) right:^(Hashmap n X) = HashmapNode (n + 1) X;
+    hml_short$0 len:(Unary ~n) s:(n * Bit) = HmLabel ~n m;
+    hml_long$10 n:(#<= m) s:(n * Bit) = HmLabel ~n m;
+    hml_same$11 v:Bit n:(#<= m) = HmLabel ~n m;
+    hme_empty$0 = HashmapE n X;
+    hme_root$1 root:^(Hashmap n X) = HashmapE n X;
+
+A dictionary on the Fift stack is the root cell of the Hashmap or null for
+an empty one, the values are slices.
+"""
+
+import bisect
+
+from fift.cell import CellBuilder, CellError, CellSlice
+
+
+def _key_bits(key, size, kind):
+    if kind == 'i':
+        if not -(1 << (size - 1)) <= key < (1 << (size - 1)):
+            raise CellError('Key %d does not fit into %d signed bits' % (key, size))
+        return key & ((1 << size) - 1)
+
+    if key < 0 or key >> size:
+        raise CellError('Key %d does not fit into %d unsigned bits' % (key, size))
+    return key
+
+
+def _store_label(b, label, length, max_len):
+    """
+    Stores the label with the shortest of the three encodings, the ties go
+    to hml_short, then to hml_long.
+    """
+    k = max_len.bit_length()
+    short = 2 * length + 2
+    long = 2 + k + length
+    same = 3 + k
+    if short <= long and (short <= same or not _is_same(label, length)):
+        b.store_bits(((1 << length) - 1) << 1, length + 2)
+        b.store_bits(label, length)
+    elif long <= same or not _is_same(label, length):
+        b.store_bits(2, 2).store_bits(length, k).store_bits(label, length)
+    else:
+        b.store_bits(6 | (label & 1), 3).store_bits(length, k)
+
+
+def _is_same(label, length):
+    return label == 0 or label == (1 << length) - 1
+
+
+def _store_value(b, value):
+    if not isinstance(value, CellSlice):
+        value = value.begin_parse()
+    b.store_slice(value)
+
+
+def build_hashmap(items, size, kind='u'):
+    """
+    Returns the root cell of the dictionary with the (key, value) items or
+    None when there are no items. The values are cells or slices, for a
+    repeated key the last value is kept.
+
+    The tree is built in one pass over the sorted keys, every key bit is
+    looked at a constant number of times.
+    """
+    entries = sorted({_key_bits(k, size, kind): v for k, v in items}.items())
+    if not entries:
+        return None
+    keys = [k for k, _ in entries]
+
+    # an explicit stack of (lo, hi, n, done) over the sorted entries[lo:hi]
+    # which share all the bits but the lowest n ones
+    built = []
+    stack = [(0, len(entries), size, False)]
+    while stack:
+        lo, hi, n, done = stack.pop()
+        first, last = keys[lo] & ((1 << n) - 1), keys[hi - 1] & ((1 << n) - 1)
+        if hi - lo == 1:
+            b = CellBuilder()
+            _store_label(b, first, n, n)
+            _store_value(b, entries[lo][1])
+            built.append(b.end_cell())
+            continue
+
+        # the common prefix of the first and the last key is the label
+        prefix = n - (first ^ last).bit_length()
+        if not done:
+            # the keys of the right branch start with the prefix and 1
+            m = n - prefix - 1
+            split = bisect.bisect_left(keys, (keys[lo] >> m | 1) << m, lo, hi)
+            stack.append((lo, hi, n, True))
+            stack.append((split, hi, m, False))
+            stack.append((lo, split, m, False))
+            continue
+
+        left, right = built[-2:]
+        del built[-2:]
+        b = CellBuilder()
+        _store_label(b, first >> (n - prefix), prefix, n)
+        built.append(b.store_ref(left).store_ref(right).end_cell())
+
+    return built[0]
+
+
+def _load_label(s, max_len):
+    k = max_len.bit_length()
+    if not s.load_uint(1):
+        length = 0
+        while s.load_uint(1):
+            length += 1
+        return s.load_uint(length), length
+
+    if not s.load_uint(1):
+        length = s.load_uint(k)
+        return s.load_uint(length), length
+
+    bit = s.load_uint(1)
+    length = s.load_uint(k)
+    return bit and (1 << length) - 1 or 0, length
+
+
+def parse_hashmap(root, size, kind='u'):
+    """
+    Returns the {key: value slice} items of the dictionary with the root cell
+    (or None for an empty one) in the order of the key bits.
+    """
+    items = {}
+    stack = root is not None and [(root, 0, size)] or []
+    while stack:
+        cell, prefix, n = stack.pop()
+        s = cell.begin_parse()
+        label, length = _load_label(s, n)
+        if length > n:
+            raise CellError('Invalid dictionary label')
+
+        prefix = (prefix << length) | label
+        n -= length
+        if not n:
+            key = prefix
+            if kind == 'i' and key >> (size - 1):
+                key -= 1 << size
+            items[key] = s
+            continue
+
+        left, right = s.load_ref(), s.load_ref()
+        stack.append((right, prefix << 1 | 1, n - 1))
+        stack.append((left, prefix << 1, n - 1))
+
+    return items
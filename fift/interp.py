@@ -0,0 +1,835 @@
+"""
+A small pure-Python Fift interpreter for the subset of the language generated
+by `fift.fift`. It runs scripts in-process, so generated code can be checked
+without the external `fift` binary.
+
+Examples:
+    run('2 3 + .')  # Result(stack=[], output='5 ', exit_code=0)
+"""
+
+import collections
+import re
+
+from fift.boc import deserialize_boc, serialize_boc
+from fift.cell import Cell, CellBuilder, CellError, CellSlice, bits_to_str, parse_bitstring
+from fift.hashmap import build_hashmap, parse_hashmap
+
+
+class FiftError(Exception):
+    pass
+
+
+class FiftAbort(FiftError):
+    pass
+
+
+class _Halt(Exception):
+    def __init__(self, code):
+        super(_Halt, self).__init__(code)
+        self.code = code
+
+
+Result = collections.namedtuple('Result', 'stack output exit_code')
+
+# the includes which are ignored when they are not passed to `run()`
+STANDARD_INCLUDES = frozenset(['Fift.fif', 'Asm.fif', 'TonUtil.fif'])
+
+_TOKENS = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|(abort"|\."|")([^"]*)"|(\S+)', re.S)
+_NUMBER = re.compile(r'^-?(0x[0-9a-fA-F]+|0b[01]+|\d+)$')
+
+# the words which take the next word of the source as their argument
+_NAMED = frozenset(["constant", "2constant", "=:", "2=:", ":", "@'", "def?"])
+
+
+class Block(tuple):
+    """
+    A compiled `{ ... }` block: a tuple of (operation, argument) pairs.
+    """
+
+    def __repr__(self):
+        return '{ %d ops }' % len(self)
+
+
+_PUSH, _WORD, _NAMED_OP, _PRINT, _ABORT = range(5)
+
+
+def _literal(token):
+    m = _NUMBER.match(token)
+    if m is not None:
+        digits = m.group(1)
+        v = int(digits[2:], {'x': 16, 'b': 2}[digits[1]]) if digits[:2] in ('0x', '0b') else int(digits)
+        return token.startswith('-') and -v or v
+
+    if token[:2] in ('b{', 'x{') and token.endswith('}'):
+        return CellSlice(Cell(*parse_bitstring(token)))
+
+    if token.startswith('B{') and token.endswith('}'):
+        try:
+            return bytes.fromhex(token[2:-1])
+        except ValueError:
+            raise FiftError('Invalid bytes literal: %s' % token)
+
+    return None
+
+
+def compile_source(source):
+    """
+    Splits the source into words and compiles it into a top level `Block`.
+    """
+    stack = [[]]
+    tokens = _TOKENS.finditer(source)
+    for m in tokens:
+        prefix, text, word = m.groups()
+        if prefix is not None:
+            stack[-1].append(({'"': _PUSH, '."': _PRINT, 'abort"': _ABORT}[prefix], text))
+            continue
+
+        if word is None:
+            continue
+
+        if word == '{':
+            stack.append([])
+
+        elif word == '}':
+            if len(stack) == 1:
+                raise FiftError('Unbalanced }')
+            block = Block(stack.pop())
+            stack[-1].append((_PUSH, block))
+
+        elif word in _NAMED:
+            name = next((n for n in (t.group(3) for t in tokens) if n is not None), None)
+            if name is None:
+                raise FiftError('Word name expected after %s' % word)
+            stack[-1].append((_NAMED_OP, (word, name)))
+
+        else:
+            value = _literal(word)
+            stack[-1].append(value is None and (_WORD, word) or (_PUSH, value))
+
+    if len(stack) != 1:
+        raise FiftError('Unbalanced {')
+
+    return Block(stack[0])
+
+
+def _flag(v):
+    return v and -1 or 0
+
+
+# the integers of Fift are signed 257-bit
+MIN_INT = -(1 << 256)
+MAX_INT = (1 << 256) - 1
+
+
+def _checked(v):
+    if not MIN_INT <= v <= MAX_INT:
+        raise FiftError('Integer overflow')
+    return v
+
+
+class Interpreter:
+    def __init__(self, argv=(), includes=None):
+        self.stack = []
+        self.output = []
+        self.includes = includes or {}
+        self.words = {}
+        self.values = {}
+
+        for i, a in enumerate(argv):
+            self.values['$%d' % i] = a
+        self.values['$#'] = max(len(argv) - 1, 0)
+
+    # stack helpers
+
+    def push(self, v):
+        self.stack.append(v)
+
+    def pop(self):
+        try:
+            return self.stack.pop()
+        except IndexError:
+            raise FiftError('Stack underflow')
+
+    def pop_typed(self, kind, name):
+        v = self.pop()
+        if not isinstance(v, kind):
+            raise FiftError('%s expected, got %r' % (name, v))
+        return v
+
+    def pop_int(self):
+        return self.pop_typed(int, 'Integer')
+
+    def pop_str(self):
+        return self.pop_typed(str, 'String')
+
+    def pop_block(self):
+        return self.pop_typed(Block, 'Block')
+
+    def pop_builder(self):
+        return self.pop_typed(CellBuilder, 'Builder')
+
+    def pop_slice(self):
+        return self.pop_typed(CellSlice, 'Slice')
+
+    def pop_cell(self):
+        return self.pop_typed(Cell, 'Cell')
+
+    def pop_bytes(self):
+        return self.pop_typed(bytes, 'Bytes')
+
+    def index(self, n):
+        if n < 0 or n >= len(self.stack):
+            raise FiftError('Stack underflow')
+        return len(self.stack) - 1 - n
+
+    # execution
+
+    def execute(self, block):
+        for op, arg in block:
+            if op == _WORD:
+                self.call(arg)
+            elif op == _PUSH:
+                self.stack.append(arg)
+            elif op == _PRINT:
+                self.output.append(arg)
+            elif op == _ABORT:
+                if self.pop_int():
+                    raise FiftAbort(arg)
+            else:
+                self.named(*arg)
+
+    def call(self, name):
+        f = BUILTINS.get(name)
+        if f is not None:
+            try:
+                return f(self)
+            except (CellError, ArithmeticError, ValueError) as e:
+                # the errors of Python are reported as the errors of the code
+                raise FiftError(str(e))
+
+        if name in self.words:
+            return self.execute(self.words[name])
+
+        if name in self.values:
+            return self.push(self.values[name])
+
+        raise FiftError('Undefined word: %s' % name)
+
+    def named(self, word, name):
+        if word in ('constant', '=:'):
+            self.values[name] = self.pop()
+            self.words.pop(name, None)
+        elif word in ('2constant', '2=:'):
+            self.values[name] = _Pair(self.pop(), self.pop())
+            self.words.pop(name, None)
+        elif word == ':':
+            self.words[name] = self.pop_block()
+            self.values.pop(name, None)
+        elif word == "@'":
+            v = self.values.get(name)
+            if isinstance(v, _Pair):
+                self.push(v.second)
+                self.push(v.first)
+            else:
+                self.call(name)
+        elif word == 'def?':
+            self.push(_flag(name in BUILTINS or name in self.words or name in self.values))
+
+    def include(self, name):
+        if name in self.includes:
+            return self.execute(compile_source(self.includes[name]))
+
+        if name not in STANDARD_INCLUDES:
+            raise FiftError('Cannot include %s' % name)
+
+
+class _Pair(collections.namedtuple('_Pair', 'first second')):
+    pass
+
+
+def run(source, argv=(), includes=None):
+    """
+    Runs the Fift source and returns the final stack, the printed output and
+    the exit code passed to `halt` (0 when the script ends normally).
+
+    `includes` maps the names of the included files to their source, the
+    standard libraries which are not passed are ignored. Errors and
+    `abort"..."` raise FiftError.
+    """
+    vm = Interpreter(argv, includes)
+    exit_code = 0
+    try:
+        vm.execute(compile_source(source))
+    except _Halt as h:
+        exit_code = h.code
+
+    return Result(vm.stack, ''.join(vm.output), exit_code)
+
+
+BUILTINS = {}
+
+
+def builtin(*names):
+    def wrap(f):
+        for n in names:
+            BUILTINS[n] = f
+        return f
+    return wrap
+
+
+def _stack_word(name, n, f):
+    def word(vm):
+        if len(vm.stack) < n:
+            raise FiftError('Stack underflow')
+        args = vm.stack[len(vm.stack) - n:]
+        del vm.stack[len(vm.stack) - n:]
+        vm.stack.extend(f(*args))
+
+    BUILTINS[name] = word
+
+
+for _name, _n, _f in [
+    ('dup', 1, lambda a: (a, a)),
+    ('drop', 1, lambda a: ()),
+    ('swap', 2, lambda a, b: (b, a)),
+    ('rot', 3, lambda a, b, c: (b, c, a)),
+    ('-rot', 3, lambda a, b, c: (c, a, b)),
+    ('over', 2, lambda a, b: (a, b, a)),
+    ('tuck', 2, lambda a, b: (b, a, b)),
+    ('nip', 2, lambda a, b: (b,)),
+    ('2dup', 2, lambda a, b: (a, b, a, b)),
+    ('2drop', 2, lambda a, b: ()),
+    ('2swap', 4, lambda a, b, c, d: (c, d, a, b)),
+    ('2over', 4, lambda a, b, c, d: (a, b, c, d, a, b)),
+]:
+    _stack_word(_name, _n, _f)
+
+
+def _int_word(name, n, f):
+    def word(vm):
+        args = [vm.pop_int() for _ in range(n)][::-1]
+        vm.push(_checked(f(*args)))
+
+    BUILTINS[name] = word
+
+
+def _div(a, b):
+    if b == 0:
+        raise FiftError('Division by zero')
+    return a // b
+
+
+def _mod(a, b):
+    if b == 0:
+        raise FiftError('Division by zero')
+    return a % b
+
+
+def _shift_count(b):
+    if not 0 <= b <= 1023:
+        raise FiftError('Shift count out of range: %d' % b)
+    return b
+
+
+def _shift_left(a, b):
+    # the count is checked first, a long shift would be computed in full
+    return a << _shift_count(b)
+
+
+def _shift_right(a, b):
+    return a >> _shift_count(b)
+
+
+for _name, _n, _f in [
+    ('+', 2, lambda a, b: a + b),
+    ('-', 2, lambda a, b: a - b),
+    ('*', 2, lambda a, b: a * b),
+    ('/', 2, _div),
+    ('mod', 2, _mod),
+    ('min', 2, min),
+    ('max', 2, max),
+    ('and', 2, lambda a, b: a & b),
+    ('or', 2, lambda a, b: a | b),
+    ('xor', 2, lambda a, b: a ^ b),
+    ('<<', 2, _shift_left),
+    ('>>', 2, _shift_right),
+    ('<', 2, lambda a, b: _flag(a < b)),
+    ('>', 2, lambda a, b: _flag(a > b)),
+    ('<=', 2, lambda a, b: _flag(a <= b)),
+    ('>=', 2, lambda a, b: _flag(a >= b)),
+    ('<>', 2, lambda a, b: _flag(a != b)),
+    ('cmp', 2, lambda a, b: (a > b) - (a < b)),
+    ('negate', 1, lambda a: -a),
+    ('abs', 1, abs),
+    ('not', 1, lambda a: ~a),
+    ('1+', 1, lambda a: a + 1),
+    ('1-', 1, lambda a: a - 1),
+    ('2+', 1, lambda a: a + 2),
+    ('2-', 1, lambda a: a - 2),
+    ('2*', 1, lambda a: a * 2),
+    ('2/', 1, lambda a: a >> 1),
+    ('sgn', 1, lambda a: (a > 0) - (a < 0)),
+    ('0=', 1, lambda a: _flag(a == 0)),
+    ('0<>', 1, lambda a: _flag(a != 0)),
+    ('0<', 1, lambda a: _flag(a < 0)),
+    ('0>', 1, lambda a: _flag(a > 0)),
+    ('0<=', 1, lambda a: _flag(a <= 0)),
+    ('0>=', 1, lambda a: _flag(a >= 0)),
+]:
+    _int_word(_name, _n, _f)
+
+
+@builtin('=')
+def _eq(vm):
+    b, a = vm.pop(), vm.pop()
+    if isinstance(a, int) and isinstance(b, int):
+        return vm.push(_flag(a == b))
+    raise FiftError('Integer expected, got %r' % ((a, b),))
+
+
+@builtin('/mod')
+def _divmod(vm):
+    b, a = vm.pop_int(), vm.pop_int()
+    vm.push(_checked(_div(a, b)))
+    vm.push(a % b)
+
+
+@builtin('true')
+def _true(vm):
+    vm.push(-1)
+
+
+@builtin('false')
+def _false(vm):
+    vm.push(0)
+
+
+@builtin('null')
+def _null(vm):
+    vm.push(None)
+
+
+@builtin('null?')
+def _is_null(vm):
+    vm.push(_flag(vm.pop() is None))
+
+
+@builtin('?dup')
+def _dupnz(vm):
+    x = vm.pop_int()
+    vm.push(x)
+    if x:
+        vm.push(x)
+
+
+@builtin('pick')
+def _pick(vm):
+    vm.push(vm.stack[vm.index(vm.pop_int())])
+
+
+@builtin('roll')
+def _roll(vm):
+    vm.push(vm.stack.pop(vm.index(vm.pop_int())))
+
+
+@builtin('-roll')
+def _nroll(vm):
+    n = vm.pop_int()
+    i = vm.index(n)
+    vm.stack.insert(i, vm.pop())
+
+
+@builtin('exch')
+def _exch(vm):
+    i = vm.index(vm.pop_int())
+    vm.stack[i], vm.stack[-1] = vm.stack[-1], vm.stack[i]
+
+
+@builtin('exch2')
+def _exch2(vm):
+    m = vm.pop_int()
+    i, j = vm.index(vm.pop_int()), vm.index(m)
+    vm.stack[i], vm.stack[j] = vm.stack[j], vm.stack[i]
+
+
+@builtin('depth')
+def _depth(vm):
+    vm.push(len(vm.stack))
+
+
+def _format(v):
+    if v is None:
+        return '(null)'
+    if isinstance(v, str):
+        return '"%s"' % v
+    if isinstance(v, int):
+        return str(v)
+    if isinstance(v, bytes):
+        return 'BYTES:%s' % v.hex().upper()
+    if isinstance(v, CellSlice):
+        return 'CS{%s}' % bits_to_str(*v.bits())
+    if isinstance(v, Cell):
+        return 'C{%s}' % bits_to_str(v.data, v.length)
+    if isinstance(v, CellBuilder):
+        return 'BC{%d bits}' % v.length
+    if isinstance(v, Block):
+        return '{...}'
+    return repr(v)
+
+
+@builtin('.s')
+def _dump(vm):
+    vm.output.append(' '.join(_format(v) for v in vm.stack) + '\n')
+
+
+@builtin('.')
+def _print(vm):
+    vm.output.append('%d ' % vm.pop_int())
+
+
+@builtin('(.)')
+def _to_str(vm):
+    vm.push(str(vm.pop_int()))
+
+
+@builtin('type')
+def _type(vm):
+    vm.output.append(vm.pop_str())
+
+
+@builtin('cr')
+def _cr(vm):
+    vm.output.append('\n')
+
+
+@builtin('space')
+def _space(vm):
+    vm.output.append(' ')
+
+
+@builtin('emit')
+def _emit(vm):
+    vm.output.append(chr(vm.pop_int()))
+
+
+@builtin('$+')
+def _concat(vm):
+    b, a = vm.pop_str(), vm.pop_str()
+    vm.push(a + b)
+
+
+@builtin('$len')
+def _str_len(vm):
+    vm.push(len(vm.pop_str().encode()))
+
+
+@builtin('$=')
+def _str_eq(vm):
+    vm.push(_flag(vm.pop_str() == vm.pop_str()))
+
+
+@builtin('$>B')
+def _str_to_bytes(vm):
+    vm.push(vm.pop_str().encode())
+
+
+@builtin('B>$')
+def _bytes_to_str(vm):
+    vm.push(vm.pop_bytes().decode())
+
+
+@builtin('Blen')
+def _bytes_len(vm):
+    vm.push(len(vm.pop_bytes()))
+
+
+@builtin('B=')
+def _bytes_eq(vm):
+    vm.push(_flag(vm.pop_bytes() == vm.pop_bytes()))
+
+
+# control flow
+
+@builtin('execute')
+def _execute(vm):
+    vm.execute(vm.pop_block())
+
+
+@builtin('if')
+def _if(vm):
+    e = vm.pop_block()
+    if vm.pop_int():
+        vm.execute(e)
+
+
+@builtin('ifnot')
+def _ifnot(vm):
+    e = vm.pop_block()
+    if not vm.pop_int():
+        vm.execute(e)
+
+
+@builtin('cond')
+def _cond(vm):
+    neg, pos = vm.pop_block(), vm.pop_block()
+    vm.execute(pos if vm.pop_int() else neg)
+
+
+@builtin('times')
+def _times(vm):
+    n = vm.pop_int()
+    e = vm.pop_block()
+    for _ in range(n):
+        vm.execute(e)
+
+
+@builtin('while')
+def _while(vm):
+    body, c = vm.pop_block(), vm.pop_block()
+    while True:
+        vm.execute(c)
+        if not vm.pop_int():
+            break
+        vm.execute(body)
+
+
+@builtin('until')
+def _until(vm):
+    e = vm.pop_block()
+    while True:
+        vm.execute(e)
+        if vm.pop_int():
+            break
+
+
+@builtin('halt')
+def _halt(vm):
+    raise _Halt(vm.pop_int())
+
+
+@builtin('include')
+def _include(vm):
+    vm.include(vm.pop_str())
+
+
+# builders and slices
+
+@builtin('<b')
+def _begin_builder(vm):
+    vm.push(CellBuilder())
+
+
+@builtin('b>')
+def _end_builder(vm):
+    vm.push(vm.pop_builder().end_cell())
+
+
+@builtin('u,')
+def _store_uint(vm):
+    size, value = vm.pop_int(), vm.pop_int()
+    vm.push(vm.pop_builder().store_uint(value, size))
+
+
+@builtin('i,')
+def _store_int(vm):
+    size, value = vm.pop_int(), vm.pop_int()
+    vm.push(vm.pop_builder().store_int(value, size))
+
+
+@builtin('B,')
+def _store_bytes(vm):
+    value = vm.pop_bytes()
+    vm.push(vm.pop_builder().store_bytes(value))
+
+
+@builtin('$,')
+def _store_str(vm):
+    value = vm.pop_str()
+    vm.push(vm.pop_builder().store_bytes(value.encode()))
+
+
+@builtin('s,')
+def _store_slice(vm):
+    value = vm.pop_slice()
+    vm.push(vm.pop_builder().store_slice(value))
+
+
+@builtin('ref,')
+def _store_ref(vm):
+    value = vm.pop_cell()
+    vm.push(vm.pop_builder().store_ref(value))
+
+
+@builtin('dict,')
+def _store_dict(vm):
+    value = vm.pop()
+    if value is not None and not isinstance(value, Cell):
+        raise FiftError('Cell or null expected, got %r' % (value,))
+    vm.push(vm.pop_builder().store_maybe_ref(value))
+
+
+@builtin('<s')
+def _begin_parse(vm):
+    vm.push(vm.pop_cell().begin_parse())
+
+
+@builtin('s>')
+def _end_parse(vm):
+    s = vm.pop_slice()
+    if s.remaining_bits() or s.remaining_refs():
+        raise FiftError('Extra data remaining in deserialized cell')
+
+
+@builtin('s>c')
+def _slice_to_cell(vm):
+    vm.push(vm.pop_slice().to_cell())
+
+
+@builtin('sbits')
+def _sbits(vm):
+    vm.push(vm.pop_slice().remaining_bits())
+
+
+@builtin('srefs')
+def _srefs(vm):
+    vm.push(len(vm.pop_slice().remaining_refs()))
+
+
+@builtin('empty?')
+def _empty(vm):
+    s = vm.pop_slice()
+    vm.push(_flag(not s.remaining_bits() and not s.remaining_refs()))
+
+
+@builtin('hashB')
+def _hash_bytes(vm):
+    vm.push(vm.pop_cell().hash)
+
+
+@builtin('hashu')
+def _hash_uint(vm):
+    vm.push(int.from_bytes(vm.pop_cell().hash, 'big'))
+
+
+@builtin('boc>B')
+def _boc_to_bytes(vm):
+    vm.push(serialize_boc(vm.pop_cell(), has_crc32c=False))
+
+
+@builtin('B>boc')
+def _bytes_to_boc(vm):
+    roots = deserialize_boc(vm.pop_bytes())
+    if len(roots) != 1:
+        raise FiftError('BOC with one root expected, got %d' % len(roots))
+    vm.push(roots[0])
+
+
+@builtin('boc+>B')
+def _boc_to_bytes_ext(vm):
+    mode = vm.pop_int()
+    vm.push(serialize_boc(vm.pop_cell(), has_idx=bool(mode & 1), has_crc32c=bool(mode & 2)))
+
+
+def _fetch_word(name, load, sized):
+    """
+    Defines the `x@`, `x@+`, `x@?` and `x@?+` words for a slice fetch.
+    """
+    for suffix in ('@', '@+', '@?', '@?+'):
+        def word(vm, keep='+' in suffix, quiet='?' in suffix):
+            size = sized and vm.pop_int() or 0
+            source = vm.pop_slice()
+            s = source.copy()
+            try:
+                v = load(s, size) if sized else load(s)
+            except CellError:
+                if not quiet:
+                    raise
+                if keep:
+                    vm.push(source)
+                vm.push(0)
+                return
+
+            vm.push(v)
+            if keep:
+                vm.push(s)
+            if quiet:
+                vm.push(-1)
+
+        BUILTINS[name + suffix] = word
+
+
+_fetch_word('u', CellSlice.load_uint, True)
+_fetch_word('i', CellSlice.load_int, True)
+_fetch_word('B', CellSlice.load_bytes, True)
+_fetch_word('s', CellSlice.load_bits, True)
+_fetch_word('ref', CellSlice.load_ref, False)
+_fetch_word('dict', CellSlice.load_maybe_ref, False)
+
+
+# dictionaries
+
+@builtin('dictnew')
+def _dictnew(vm):
+    vm.push(None)
+
+
+def _pop_dict(vm):
+    d = vm.pop()
+    if d is not None and not isinstance(d, Cell):
+        raise FiftError('Dictionary expected, got %r' % (d,))
+    return d
+
+
+def _dict_words(kind):
+    """
+    Defines the `xdict!`, `xdict!+` and `xdict@` words for the key kind. The
+    dictionary is parsed and built again on every change.
+    """
+    def store(vm, add_only):
+        size, d, key, value = vm.pop_int(), _pop_dict(vm), vm.pop_int(), vm.pop_slice()
+        items = parse_hashmap(d, size, kind)
+        if add_only and key in items:
+            vm.push(d)
+            vm.push(0)
+            return
+
+        items[key] = value
+        vm.push(build_hashmap(items.items(), size, kind))
+        vm.push(-1)
+
+    def fetch(vm):
+        size, d, key = vm.pop_int(), _pop_dict(vm), vm.pop_int()
+        value = parse_hashmap(d, size, kind).get(key)
+        if value is not None:
+            vm.push(value)
+        vm.push(_flag(value is not None))
+
+    BUILTINS[kind + 'dict!'] = lambda vm: store(vm, False)
+    BUILTINS[kind + 'dict!+'] = lambda vm: store(vm, True)
+    BUILTINS[kind + 'dict@'] = fetch
+
+
+_dict_words('u')
+_dict_words('i')
+
+
+# files
+
+@builtin('file>B')
+def _read_file(vm):
+    name = vm.pop_str()
+    try:
+        with open(name, 'rb') as f:
+            vm.push(f.read())
+    except OSError as e:
+        raise FiftError('Cannot read %s: %s' % (name, e))
+
+
+@builtin('B>file')
+def _write_file(vm):
+    name, data = vm.pop_str(), vm.pop_bytes()
+    try:
+        with open(name, 'wb') as f:
+            f.write(data)
+    except OSError as e:
+        raise FiftError('Cannot write %s: %s' % (name, e))
@@ -0,0 +1,192 @@
+"""
+Peephole optimizer for the stack manipulation words.
+
+It rewrites the sequences of the stack words emitted one after another
+(the root lines of a script and the bodies of words, blocks, word calls,
+conditions, loops and switches) into shorter equivalents. Only nodes
+created with the stack helpers (`dup()`, `swap()`, `pick(0)`, ...) are
+rewritten, raw strings are left as they are. The runs of the stack words
+left by the rules are replaced with the cheapest sequence of the same
+stack effect, see `fift.stack.shortest`.
+"""
+
+from fift import stack
+from fift.fift import (
+    Block, Cond, Drop, Dup, Exch, ForRange, Nip, Over, Pick, Roll, Rot, Swap, Switch, Times, Tuck, Until,
+    While, Word, WordCall, _changed, _reachable,
+)
+
+
+# a word which is equivalent to a shorter or cheaper sequence
+SINGLE_RULES = {
+    '0 pick': ('dup',),
+    '1 pick': ('over',),
+    '0 roll': (),
+    '0 -roll': (),
+    '1 roll': ('swap',),
+    '1 -roll': ('swap',),
+    '2 roll': ('rot',),
+    '2 -roll': ('-rot',),
+    '0 exch': (),
+    '1 exch': ('swap',),
+}
+
+# two adjacent words which are equivalent to a shorter sequence
+PAIR_RULES = {
+    ('swap', 'swap'): (),
+    ('2swap', '2swap'): (),
+    ('dup', 'drop'): (),
+    ('2dup', '2drop'): (),
+    ('over', 'drop'): (),
+    ('rot', '-rot'): (),
+    ('-rot', 'rot'): (),
+    ('rot', 'rot'): ('-rot',),
+    ('-rot', '-rot'): ('rot',),
+    ('dup', 'swap'): ('dup',),
+    ('swap', 'drop'): ('nip',),
+    ('swap', 'nip'): ('drop',),
+    ('tuck', 'drop'): ('swap',),
+    ('swap', 'over'): ('tuck',),
+    ('over', 'over'): ('2dup',),
+    ('drop', 'drop'): ('2drop',),
+}
+
+NODES = {
+    'dup': lambda: Dup(),
+    '2dup': lambda: Dup(double=True),
+    'drop': lambda: Drop(),
+    '2drop': lambda: Drop(double=True),
+    'swap': lambda: Swap(),
+    '2swap': lambda: Swap(double=True),
+    'rot': lambda: Rot(),
+    '-rot': lambda: Rot(neg=True),
+    'over': lambda: Over(),
+    'tuck': lambda: Tuck(),
+    'nip': lambda: Nip(),
+}
+
+INDEXED_NODES = {
+    'pick': lambda n: Pick(n),
+    'roll': lambda n: Roll(n),
+    '-roll': lambda n: Roll(n, neg=True),
+    'exch': lambda n: Exch(n),
+}
+
+_STACK_WORDS = (Dup, Drop, Swap, Rot, Over, Tuck, Nip)
+_INDEXED_WORDS = (Pick, Roll)
+
+
+def token(node):
+    """
+    Returns the word of a stack manipulation node or None for anything else.
+    """
+    if isinstance(node, _STACK_WORDS):
+        return str(node)
+
+    if isinstance(node, _INDEXED_WORDS) and type(node._n) is int:
+        return str(node)
+
+    if isinstance(node, Exch) and node._m is None and type(node._n) is int:
+        return str(node)
+
+    return None
+
+
+def peephole(items):
+    """
+    Rewrites the stack words of the sequence until no rule can be applied.
+    """
+    out = []
+    pending = list(reversed(items))
+    while pending:
+        item = pending.pop()
+        tok = token(item)
+        if tok is None:
+            out.append(item)
+            continue
+
+        if tok in SINGLE_RULES:
+            pending.extend(NODES[r]() for r in reversed(SINGLE_RULES[tok]))
+            continue
+
+        prev = out and token(out[-1])
+        if prev and (prev, tok) in PAIR_RULES:
+            out.pop()
+            pending.extend(NODES[r]() for r in reversed(PAIR_RULES[(prev, tok)]))
+            continue
+
+        out.append(item)
+
+    return _shortest_runs(out)
+
+
+def _node(word):
+    if word in NODES:
+        return NODES[word]()
+
+    n, word = word.split()
+    return INDEXED_NODES[word](int(n))
+
+
+def _shortest_runs(items):
+    """
+    Replaces every run of the stack words with the cheapest sequence of the
+    same effect found by `fift.stack.shortest`.
+    """
+    out = []
+    run = []
+    for item in items + [None]:
+        tok = item is not None and token(item)
+        if tok:
+            run.append(item)
+            continue
+
+        if len(run) > 1:
+            best = stack.shortest([token(n) for n in run], named=tuple(NODES))
+            if best is not None:
+                run = [_node(w) for w in best]
+
+        out.extend(run)
+        run = []
+        if item is not None:
+            out.append(item)
+
+    return out
+
+
+def _optimize_args(args):
+    if not any(token(a) is not None for a in args):
+        return args
+
+    return tuple(peephole(args))
+
+
+def optimize(recorder):
+    """
+    Applies the rules to the roots of the recorder and to the bodies of all
+    the reachable words, blocks, word calls, conditions, loops and switches.
+    """
+    roots = list(recorder.roots())
+    for m in _reachable(roots):
+        if isinstance(m, (Word, Block, WordCall, Times, Until, ForRange)):
+            m._args = _optimize_args(m._args)
+
+        elif isinstance(m, While):
+            m._args = _optimize_args(m._args)
+            m._body = _optimize_args(m._body)
+
+        elif isinstance(m, Switch):
+            m._bodies = [_optimize_args(b) for b in m._bodies]
+            m._default = _optimize_args(m._default)
+
+        elif isinstance(m, Cond):
+            if m._pos_args:
+                m._pos_args = _optimize_args(m._pos_args)
+            if m._neg_args:
+                m._neg_args = _optimize_args(m._neg_args)
+
+        else:
+            continue
+        _changed(m)
+
+    recorder.set_roots(peephole(roots))
@@ -0,0 +1,438 @@
+"""
+Static stack-effect analysis of the generated code.
+
+Every word has a known effect ( inputs -- outputs ): `dup` is ( a -- a a ),
+`rot` is ( a b c -- b c a ), `n pick` needs n + 1 values and so on. The
+analysis follows the code compiled by `fift.interp` without running it: the
+depth is tracked through the word definitions, the blocks, the conditions
+and the loops. A script which takes a value from the empty stack or a
+condition whose branches leave different depths raise a StackError.
+
+A word with an effect which depends on the values (`?dup`, `u@?`, the words
+of the included libraries, ...) makes the rest of its body unknown, nothing
+is reported for it.
+
+The same model finds the shortest equivalent of a sequence of the stack
+manipulation words, see `shortest`.
+"""
+
+import functools
+import heapq
+
+from fift.interp import _ABORT, _NAMED_OP, _PRINT, _PUSH, Block, compile_source
+
+
+class StackError(ValueError):
+    pass
+
+
+# the words which reorder the values: (the number of the inputs, the outputs)
+SHUFFLES = {
+    'dup': (1, lambda a: (a, a)),
+    'drop': (1, lambda a: ()),
+    'swap': (2, lambda a, b: (b, a)),
+    'rot': (3, lambda a, b, c: (b, c, a)),
+    '-rot': (3, lambda a, b, c: (c, a, b)),
+    'over': (2, lambda a, b: (a, b, a)),
+    'tuck': (2, lambda a, b: (b, a, b)),
+    'nip': (2, lambda a, b: (b,)),
+    '2dup': (2, lambda a, b: (a, b, a, b)),
+    '2drop': (2, lambda a, b: ()),
+    '2swap': (4, lambda a, b, c, d: (c, d, a, b)),
+    '2over': (4, lambda a, b, c, d: (a, b, c, d, a, b)),
+}
+
+# the words which take an index from the stack: the number of the values
+# under the index which are used for the index n
+INDEXED = {
+    'pick': lambda n: n + 1,
+    'roll': lambda n: n + 1,
+    '-roll': lambda n: n + 1,
+    'exch': lambda n: n + 1,
+}
+
+# the other words: (inputs, outputs)
+EFFECTS = {
+    'true': (0, 1), 'false': (0, 1), 'null': (0, 1), 'dictnew': (0, 1), '<b': (0, 1), 'depth': (0, 1),
+    '.': (1, 0), 'type': (1, 0), 'emit': (1, 0), 'cr': (0, 0), 'space': (0, 0), '.s': (0, 0),
+    'halt': (1, 0), 'include': (1, 0), 's>': (1, 0), 'B>file': (2, 0),
+    '/mod': (2, 2), 'u,': (3, 1), 'i,': (3, 1), 'boc+>B': (2, 1),
+    'udict!': (4, 2), 'udict!+': (4, 2), 'idict!': (4, 2), 'idict!+': (4, 2),
+    'u@': (2, 1), 'i@': (2, 1), 'B@': (2, 1), 's@': (2, 1), 'ref@': (1, 1), 'dict@': (1, 1),
+    'u@+': (2, 2), 'i@+': (2, 2), 'B@+': (2, 2), 's@+': (2, 2), 'ref@+': (1, 2), 'dict@+': (1, 2),
+}
+EFFECTS.update(dict.fromkeys((
+    '+', '-', '*', '/', 'mod', 'min', 'max', 'and', 'or', 'xor', '<<', '>>', '<', '>', '<=', '>=', '<>', 'cmp',
+    '=', '$+', '$=', 'B=', 'B,', '$,', 's,', 'ref,', 'dict,',
+), (2, 1)))
+EFFECTS.update(dict.fromkeys((
+    'negate', 'abs', 'not', '1+', '1-', '2+', '2-', '2*', '2/', 'sgn', '0=', '0<>', '0<', '0>', '0<=', '0>=',
+    '(.)', '$len', '$>B', 'B>$', 'Blen', 'null?', 'hashB', 'hashu', 'boc>B', 'B>boc', 'b>', '<s', 's>c',
+    'sbits', 'srefs', 'empty?', 'file>B',
+), (1, 1)))
+
+
+class _Unknown(Exception):
+    """
+    The effect of the rest of the body depends on the values.
+    """
+
+
+class _Frame:
+    """
+    The values pushed by a body. The values taken from under the body are
+    counted in `taken`, the top level of a script has nothing under it.
+    """
+
+    def __init__(self, where, strict):
+        self.where = where
+        self.strict = strict
+        self.items = []
+        self.taken = 0
+
+    def need(self, n, word):
+        missing = n - len(self.items)
+        if missing > 0:
+            if self.strict:
+                raise StackError('Stack underflow at `%s` in %s: %d values needed, %d on the stack' % (
+                    word, self.where, n, len(self.items)))
+            self.items[:0] = [None] * missing
+            self.taken += missing
+
+    def pop(self, word):
+        self.need(1, word)
+        return self.items.pop()
+
+    def apply(self, effect, word):
+        inputs, outputs = effect
+        self.need(inputs, word)
+        if inputs:
+            del self.items[-inputs:]
+        self.items.extend([None] * outputs)
+
+
+def _repeat(effect, count):
+    """
+    The effect of a body run `count` times.
+    """
+    inputs, outputs = effect
+    if count <= 0:
+        return 0, 0
+    inputs += max(0, (count - 1) * (inputs - outputs))
+    return inputs, inputs + count * (outputs - effect[0])
+
+
+class _Analyzer:
+    def __init__(self):
+        self.words = {}
+        self.values = set()
+        self.pairs = set()
+        self.blocks = {}
+
+    def block(self, block, where):
+        key = id(block)
+        if key not in self.blocks:
+            self.blocks[key] = (block, self.body(block, where, strict=False))
+        return self.blocks[key][1]
+
+    def body(self, block, where, strict):
+        frame = _Frame(where, strict)
+        for op, arg in block:
+            try:
+                self.step(frame, op, arg)
+            except _Unknown:
+                if not strict:
+                    return None
+                # the depth of the script is not known any more, the rest of
+                # it is still followed for the definitions of the words
+                frame.strict = False
+                frame.items = []
+        return frame.taken, len(frame.items)
+
+    def pop_block(self, frame, word):
+        b = frame.pop(word)
+        if not isinstance(b, Block):
+            raise _Unknown()
+        e = self.block(b, 'a block of %s' % frame.where)
+        if e is None:
+            raise _Unknown()
+        return e
+
+    def pop_int(self, frame, word):
+        v = frame.pop(word)
+        return v if type(v) is int else None
+
+    def step(self, frame, op, arg):
+        if op == _PUSH:
+            frame.items.append(arg)
+        elif op == _PRINT:
+            pass
+        elif op == _ABORT:
+            frame.pop('abort"%s"' % arg)
+        elif op == _NAMED_OP:
+            self.named(frame, *arg)
+        else:
+            self.word(frame, arg)
+
+    def named(self, frame, word, name):
+        if word in ('constant', '=:'):
+            frame.pop('%s %s' % (word, name))
+            self.values.add(name)
+            self.pairs.discard(name)
+            self.words.pop(name, None)
+        elif word in ('2constant', '2=:'):
+            frame.need(2, '%s %s' % (word, name))
+            del frame.items[-2:]
+            self.values.add(name)
+            self.pairs.add(name)
+            self.words.pop(name, None)
+        elif word == ':':
+            b = frame.pop(': %s' % name)
+            self.words[name] = isinstance(b, Block) and self.block(b, 'word %s' % name) or None
+            self.values.discard(name)
+        elif word == "@'":
+            if name in self.words:
+                self.call(frame, name)
+            else:
+                frame.items.extend([None] * (name in self.pairs and 2 or 1))
+        else:
+            frame.items.append(None)
+
+    def call(self, frame, name):
+        effect = self.words[name]
+        if effect is None:
+            raise _Unknown()
+        frame.apply(effect, name)
+
+    def word(self, frame, w):
+        if w in SHUFFLES:
+            n, f = SHUFFLES[w]
+            frame.need(n, w)
+            args = frame.items[-n:]
+            del frame.items[-n:]
+            frame.items.extend(f(*args))
+
+        elif w in INDEXED:
+            n = self.pop_int(frame, w)
+            if n is None or n < 0:
+                raise _Unknown()
+            self.indexed(frame, w, n)
+
+        elif w == 'exch2':
+            m = self.pop_int(frame, w)
+            n = self.pop_int(frame, w)
+            if n is None or m is None or n < 0 or m < 0:
+                raise _Unknown()
+            frame.need(max(n, m) + 1, '%d %d exch2' % (n, m))
+            items = frame.items
+            items[-1 - n], items[-1 - m] = items[-1 - m], items[-1 - n]
+
+        elif w in EFFECTS:
+            frame.apply(EFFECTS[w], w)
+
+        elif w in ('execute', 'if', 'ifnot', 'cond', 'times', 'while', 'until'):
+            self.control(frame, w)
+
+        elif w in self.words:
+            self.call(frame, w)
+
+        elif w in self.values:
+            frame.items.append(None)
+
+        else:
+            raise _Unknown()
+
+    def indexed(self, frame, w, n):
+        frame.need(INDEXED[w](n), '%d %s' % (n, w))
+        items = frame.items
+        if w == 'pick':
+            items.append(items[-1 - n])
+        elif w == 'roll':
+            items.append(items.pop(-1 - n))
+        elif w == '-roll':
+            items.insert(len(items) - 1 - n, items.pop())
+        else:
+            items[-1], items[-1 - n] = items[-1 - n], items[-1]
+
+    def control(self, frame, w):
+        if w == 'execute':
+            frame.apply(self.pop_block(frame, w), w)
+
+        elif w in ('if', 'ifnot'):
+            e = self.pop_block(frame, w)
+            frame.pop(w)
+            if e[1] != e[0]:
+                raise StackError('Branch mismatch at `%s` in %s: the block changes the depth by %d, '
+                                 'the skipped block by 0' % (w, frame.where, e[1] - e[0]))
+            frame.apply(e, w)
+
+        elif w == 'cond':
+            neg = self.pop_block(frame, w)
+            pos = self.pop_block(frame, w)
+            frame.pop(w)
+            if pos[1] - pos[0] != neg[1] - neg[0]:
+                raise StackError('Branch mismatch at `cond` in %s: the branches change the depth by %d and %d' % (
+                    frame.where, pos[1] - pos[0], neg[1] - neg[0]))
+            inputs = max(pos[0], neg[0])
+            frame.apply((inputs, inputs + pos[1] - pos[0]), w)
+
+        elif w == 'times':
+            count = self.pop_int(frame, w)
+            e = self.pop_block(frame, w)
+            if count is not None:
+                frame.apply(_repeat(e, count), w)
+            elif e[1] == e[0]:
+                frame.apply(e, w)
+            else:
+                raise _Unknown()
+
+        elif w == 'while':
+            body = self.pop_block(frame, w)
+            c = self.pop_block(frame, w)
+            if c[1] - c[0] != 1 or body[1] != body[0]:
+                raise _Unknown()
+            frame.apply((max(c[0], body[0]), max(c[0], body[0])), w)
+
+        else:
+            e = self.pop_block(frame, w)
+            if e[1] - e[0] != 1:
+                raise _Unknown()
+            frame.apply((e[0], e[0]), w)
+
+
+def _source(code):
+    return isinstance(code, str) and code or str(code)
+
+
+def effect(code):
+    """
+    Returns the effect of the code (a node or the Fift source) as
+    (inputs, outputs) or None when it depends on the values.
+
+    Examples:
+        effect(rot())  # (3, 3)
+        effect('2 pick swap +')  # (3, 3)
+    """
+    return _Analyzer().body(compile_source(_source(code)), 'the code', strict=False)
+
+
+def check(code):
+    """
+    Checks the script (the Fift source or a recorder) which runs on the empty
+    stack. Raises a StackError on a stack underflow or a branch mismatch and
+    returns the effects of the defined words by name.
+    """
+    analyzer = _Analyzer()
+    analyzer.body(compile_source(_source(code)), 'the script', strict=True)
+    return dict(analyzer.words)
+
+
+def _step(items, w):
+    """
+    Applies the stack word to the tuple of the values or returns None when
+    there are not enough values.
+    """
+    if w in SHUFFLES:
+        k, f = SHUFFLES[w]
+        if len(items) < k:
+            return None
+        return items[:len(items) - k] + f(*items[len(items) - k:])
+
+    i, w = w.split()
+    i = int(i)
+    if len(items) < i + 1:
+        return None
+
+    items = list(items)
+    if w == 'pick':
+        items.append(items[-1 - i])
+    elif w == 'roll':
+        items.append(items.pop(-1 - i))
+    elif w == '-roll':
+        items.insert(len(items) - 1 - i, items.pop())
+    else:
+        items[-1], items[-1 - i] = items[-1 - i], items[-1]
+    return tuple(items)
+
+
+def _simulate(words, n):
+    items = tuple(range(n))
+    for w in words:
+        items = _step(items, w)
+        if items is None:
+            return None
+    return items
+
+
+def _inputs(words):
+    """
+    The number of the values the stack words use.
+    """
+    n = 0
+    while _simulate(words, n) is None:
+        n += 1
+    return n
+
+
+def cost(words):
+    """
+    The cost of the stack words: an indexed word like `2 pick` is a literal
+    and a word, so it costs twice as much as `dup`.
+    """
+    return sum(' ' in w and 2 or 1 for w in words)
+
+
+# the number of the searches which are remembered
+SHORTEST_CACHE_SIZE = 4096
+
+
+def shortest(words, max_cost=4, named=tuple(SHUFFLES)):
+    """
+    Returns the cheapest sequence of the stack words with the same effect
+    as the words or None when there is no cheaper one within `max_cost`.
+    The sequence is made of the `named` words and of `n pick`, `n roll`,
+    `n -roll` and `n exch`.
+
+    Examples:
+        shortest(('swap', 'drop'))  # ('nip',)
+        shortest(('3 pick', '3 pick'))  # ('2over',)
+    """
+    return _shortest(tuple(words), max_cost, tuple(named))
+
+
+@functools.lru_cache(maxsize=SHORTEST_CACHE_SIZE)
+def _shortest(words, max_cost, named):
+    n = _inputs(words)
+    target = _simulate(words, n)
+    limit = min(cost(words) - 1, max_cost)
+
+    vocabulary = list(named)
+    height = max(n, len(target)) + 1
+    for i in range(2, height):
+        vocabulary += ['%d pick' % i, '%d exch' % i]
+    for i in range(3, height):
+        vocabulary += ['%d roll' % i, '%d -roll' % i]
+
+    found = None
+    start = tuple(range(n))
+    seen = {start: 0}
+    heap = [(0, (), start)]
+    while heap:
+        c, seq, items = heapq.heappop(heap)
+        if items == target:
+            found = seq
+            break
+
+        for w in vocabulary:
+            nc = c + (' ' in w and 2 or 1)
+            if nc > limit:
+                continue
+
+            nxt = _step(items, w)
+            if nxt is None or len(nxt) > height or seen.get(nxt, nc + 1) <= nc:
+                continue
+            seen[nxt] = nc
+            heapq.heappush(heap, (nc, seq + (w,), nxt))
+
+    return found
+
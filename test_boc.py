@@ -0,0 +1,157 @@
+import base64
+
+import pytest
+
+from fift.boc import BocReader, crc32c, deserialize_boc, serialize_boc
+from fift.cell import Cell, CellError
+from fift.fift import *
+from fift.interp import run
+
+
+def test_crc32c():
+    assert crc32c(b'') == 0
+    assert crc32c(b'123456789') == 0xE3069283
+
+
+def test_empty_cell():
+    assert Cell().hash.hex() == '96a296d224f285c67bee93c30f8a309157f0daa35dc5b87e410b78630a09cfc7'
+    assert Cell().depth == 0
+    assert base64.b64encode(serialize_boc(Cell())) == b'te6cckEBAQEAAgAAAEysuc0='
+    assert serialize_boc(Cell(), has_crc32c=False).hex() == 'b5ee9c72010101010002000000'
+
+
+def test_hash_is_cached():
+    child = Cell(7, 4)
+    parent = Cell(1, 1, [child, child])
+    assert parent.depth == 1
+    assert parent.hash == parent._hash
+    assert child._hash is not None
+
+
+def test_deep_chains():
+    def chain(n, last=0):
+        c = Cell(last, 8)
+        for i in range(n):
+            c = Cell(i % 256, 8, [c])
+        return c
+
+    a, b = chain(20000), chain(20000)
+    assert a == b
+    assert hash(a) == hash(b)
+    assert a != chain(20000, last=1)
+    assert len({a, b}) == 1
+
+
+def test_shared_cells_are_stored_once():
+    child = Cell(7, 4)
+    boc = serialize_boc(Cell(1, 1, [child, Cell(7, 4)]), has_crc32c=False)
+    # two unique cells, refs go forward from the root
+    assert boc[6] == 2
+    assert boc.endswith(bytes.fromhex('0201c00101') + bytes.fromhex('000178'))
+
+
+def test_index():
+    boc = serialize_boc([Cell(1, 8), Cell(2, 8)], has_idx=True, has_crc32c=False)
+    assert boc[4] == 0x81
+    assert boc[7] == 2
+
+
+class TestNativeBuilder:
+    def test_matches_interpreter(self):
+        with recording():
+            b = builder().u(1, 8).i(-1, 8).s('x{F_}').b(b'\x0a\x0b').r(builder().u(7, 4)).d()
+            code = str(b)
+
+        hashu, boc = run(code + ' dup hashu swap 2 boc+>B').stack
+        assert hashu == int.from_bytes(b.cell().hash, 'big')
+        assert boc == b.boc()
+        assert run(code + ' boc>B').stack == [b.boc(has_crc32c=False)]
+
+    def test_const_ref(self):
+        with recording():
+            body = const('body', builder().u(5, 8))
+            assert builder().r(body).cell().refs == (Cell(5, 8),)
+
+    def test_runtime_values(self):
+        with recording():
+            with pytest.raises(TypeError):
+                builder().u(swap(), 8).cell()
+            with pytest.raises(TypeError):
+                builder().r(swap()).cell()
+
+
+TREE = Cell(1, 1, [Cell(7, 4), Cell(0xABCDEF, 24, [Cell(7, 4)])])
+
+
+@pytest.mark.parametrize('has_idx', [False, True])
+def test_deserialize(has_idx):
+    assert deserialize_boc(serialize_boc(TREE, has_idx=has_idx)) == [TREE]
+    assert deserialize_boc(serialize_boc([Cell(), TREE])) == [Cell(), TREE]
+
+
+def test_deserialize_errors():
+    boc = serialize_boc(TREE)
+    with pytest.raises(CellError):
+        deserialize_boc(b'\0' + boc[1:])
+    with pytest.raises(CellError):
+        deserialize_boc(boc[:-1] + b'\0')
+
+
+def _with_descriptor(d1):
+    # a BOC of one cell with no data, the first descriptor is right after
+    # the header of 6 + 3 * 1 + 1 bytes and the root index
+    boc = bytearray(serialize_boc(Cell(), has_crc32c=False))
+    boc[11] = d1
+    return bytes(boc)
+
+
+@pytest.mark.parametrize('d1, match', [
+    (8, 'Exotic cell 0'),
+    (1 << 5, 'level mask'),
+    (5, 'reference count'),
+])
+def test_unsupported_cells(d1, match):
+    with pytest.raises(CellError, match=match):
+        deserialize_boc(_with_descriptor(d1))
+    with pytest.raises(CellError, match=match):
+        BocReader(_with_descriptor(d1)).root().u(0)
+
+
+class TestReader:
+    def test_cursor(self):
+        s = BocReader(serialize_boc(TREE)).root()
+        assert s.u(1) == 1
+        assert s.remaining_bits() == 0
+        assert s.r().to_cell() == Cell(7, 4)
+
+        r = s.r()
+        assert r.i(4) == -6
+        assert r.s(8).to_cell() == Cell(0xBC, 8)
+        assert r.b(1) == b'\xde'
+        assert r.r().u(4) == 7
+        with pytest.raises(CellError):
+            r.u(5)
+        with pytest.raises(CellError):
+            s.r()
+
+    def test_maybe_ref(self):
+        s = BocReader(serialize_boc(Cell(2, 2, [Cell(7, 4)]))).root()
+        assert s.d() is not None
+        assert s.d() is None
+
+    def test_file(self, tmp_path):
+        path = str(tmp_path / 'state.boc')
+        with open(path, 'wb') as f:
+            f.write(serialize_boc(TREE, has_idx=True))
+
+        with BocReader.open(path, verify=True) as reader:
+            assert reader.root().r().to_cell() == Cell(7, 4)
+
+        with recording():
+            with file(path).parse() as s:
+                assert (s.u(1), s.r().u(4)) == (1, 7)
+            assert s.reader._mmap.closed
+
+    def test_interpreter(self):
+        c, = run('<b 1 8 u, <b 7 4 u, b> ref, b> 2 boc+>B B>boc').stack
+        assert c == Cell(1, 8, [Cell(7, 4)])
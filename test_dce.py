@@ -0,0 +1,80 @@
+from fift.fift import *
+
+
+def test_unused_definitions():
+    stats = []
+
+    @script(dce=True, stats=stats.append)
+    def main():
+        include('TonUtil.fif')
+        square = word('square', dup(), '*')
+        word('cube', dup(), square(), '*')
+        fourth = word('fourth', square(), square())
+        const('unused', 1)
+        a = const('a', 2)
+        b = const('b', 3)
+        include('TonUtil.fif')
+        fourth(a.read())
+        assign(b, 4)
+
+    assert main() == '"TonUtil.fif" include\n' \
+                     '{ dup * } : square\n' \
+                     '{  square  square } : fourth\n' \
+                     '2 constant a\n' \
+                     '@\' a fourth\n' \
+                     '3 constant b\n' \
+                     '4 =: b'
+    assert stats[0]['dead_roots'] == 3
+
+
+def test_exported_words():
+    @script(dce=True)
+    def main():
+        helper = word('helper', dup())
+        word('main', helper(), export=True)
+        word('other', drop())
+
+    assert main() == '{ dup } : helper\n{  helper } : main'
+
+
+def test_hoisted_constants():
+    @script(dce=True)
+    def main():
+        a = const('a', 1)
+        word('w', string('a=', a))
+        call_word('drop', a.read())
+
+    # the constant is hoisted in front of the word, so the word is kept
+    assert main() == '1 constant a\n{ "a=" @\' a (.) $+ } : w\n@\' a drop'
+
+
+def test_used_by_names():
+    @script(dce=True)
+    def main():
+        word('checked', dup())
+        is_def('checked')
+        const('n', 0)
+        slice('x{00}').u(8, const('n'))
+
+    assert main() == '{ dup } : checked\n' \
+                     'def? checked\n' \
+                     '0 constant n\n' \
+                     '<s x{00} 8 u@+ =: n\n' \
+                     '@\' n'
+
+
+def test_definitions_with_effects():
+    @script(dce=True)
+    def main():
+        include('Lib.fif').const('lib_ver')
+        const('printed', string('x').print(), 1)
+        const('read', file('data.boc').read())
+        const('shown', 1, 'dup', '.')
+        const('computed', builder().u(1, 8), '<s', 1, 2, '+')
+        call_word('lib_fn', 1)
+
+    assert main() == '"Lib.fif" include constant lib_ver\n' \
+                     '."x" 1 constant printed\n' \
+                     '"data.boc" file>B constant read\n' \
+                     '1 dup . constant shown\n' \
+                     '1 lib_fn'
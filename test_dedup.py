@@ -0,0 +1,76 @@
+from fift.fift import *
+from fift.interp import run
+
+
+def body(i=0):
+    return builder().u(i, 32).s('x{' + 'AB' * 30 + '}')
+
+
+def messages():
+    for i in range(3):
+        const('m%d' % i, builder().u(i, 8).r(body()))
+
+
+def test_repeated_cells():
+    stats = []
+    deduped = script(dedup_cells=True, stats=stats.append)(messages)
+    code = deduped()
+
+    assert stats[0]['merged_cells'] == 5
+    assert code.split('\n')[:4] == [
+        "<b 0 32 u, x{%s} s, b> constant __cell0" % ('AB' * 30),
+        "@' __cell0",
+        "<b 0 8 u, @' __cell0 ref, b> constant m0",
+        "@' __cell0",
+    ]
+    assert code.count('constant __cell0') == 1
+    assert run(code) == run(script()(messages)())
+
+
+def test_nested_cells():
+    def main():
+        for i in range(2):
+            const('m%d' % i, builder().r(builder().u(7, 64).r(body())).r(body()))
+
+    code = script(dedup_cells=True)(main)()
+    assert run(code) == run(script()(main)())
+    assert code.index('constant __cell0') < code.index('constant __cell1') < code.index('constant __cell2')
+    assert "<b @' __cell1 ref, @' __cell0 ref, b> constant __cell2\n@' __cell2 constant m0" in code
+
+
+def test_unique_and_runtime_cells():
+    stats = []
+
+    @script(dedup_cells=True, stats=stats.append)
+    def main():
+        body(1)
+        body(2)
+        builder().u(swap(), 32).s('x{' + 'AB' * 30 + '}')
+        builder().u(swap(), 32).s('x{' + 'AB' * 30 + '}')
+        builder().u(1, 1)
+        builder().u(1, 1)
+
+    assert '__cell' not in main()
+    assert stats[0]['merged_cells'] == 0
+
+
+def test_conditions_are_left():
+    @script(dedup_cells=True)
+    def main():
+        body()
+        cond().pos(body())
+        body()
+
+    assert main().count('<b 0 32 u,') == 2
+
+
+def test_template():
+    @script(template=True, dedup_cells=True)
+    def main(n):
+        body(n)
+        body(n)
+        body(0)
+
+    # the parameters are never merged with the literals
+    assert main(0).count('<b 0 32 u,') == 3
+    assert main(5).count('<b 5 32 u,') == 2
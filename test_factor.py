@@ -0,0 +1,126 @@
+from fift.fift import *
+from fift.interp import run
+
+
+def usage(name):
+    return word(
+        name,
+        string('usage: wallet.fif <filename-base> <dest-addr> <seqno> <amount> [<savefile>]').print(cr=True),
+        string('Creates a request to simple wallet created by new-wallet.fif').print(cr=True),
+        halt(1),
+    )
+
+
+def test_repeated_lines():
+    stats = []
+
+    @script(factor=True, stats=stats.append)
+    def main():
+        for i in range(3):
+            string('the same long line printed again').print(cr=True)
+            string('and its second line').print(cr=True)
+            dup()
+
+    code = main()
+    assert code == '{ ."the same long line printed again" cr ."and its second line" cr dup } : __w0\n' \
+                   ' __w0\n' \
+                   ' __w0\n' \
+                   ' __w0'
+    assert stats[0]['factored_words'] == 1
+    assert run('1 ' + code) == run('1 ' + str(_plain(main)))
+
+
+def _plain(main):
+    with recording() as rec:
+        main.__wrapped__()
+    return rec
+
+
+def test_bodies():
+    @script(factor=True)
+    def main():
+        usage('usage1')
+        usage('usage2')
+        cond(0).pos(
+            string('usage: wallet.fif <filename-base> <dest-addr> <seqno> <amount> [<savefile>]').print(cr=True),
+            string('Creates a request to simple wallet created by new-wallet.fif').print(cr=True),
+            halt(1),
+        ).neg(switch(2, {1: drop(), 2: string('usage: wallet.fif <filename-base> <dest-addr> <seqno> <amount> '
+                                              '[<savefile>]').print(cr=True)}))
+
+    code = main()
+    assert code.splitlines()[0] == '{ ."usage: wallet.fif <filename-base> <dest-addr> <seqno> <amount> ' \
+                                   '[<savefile>]" cr ."Creates a request to simple wallet created by ' \
+                                   'new-wallet.fif" cr 1 halt } : __w0'
+    assert code.count('."usage: wallet.fif') == 2
+    assert code.count('usage1') == code.count('usage2') == 1
+    assert run(code).output == run(str(_plain(main))).output == 'usage: wallet.fif <filename-base> ' \
+                                                                 '<dest-addr> <seqno> <amount> [<savefile>]\n'
+
+
+def test_not_worth():
+    @script(factor=True)
+    def main():
+        for i in range(2):
+            dup()
+            drop()
+
+    assert main() == 'dup\ndrop\ndup\ndrop'
+
+
+def test_definitions_are_kept():
+    @script(factor=True)
+    def main():
+        for i in range(5):
+            a = const('a_long_constant_name', 1234567)
+            assign(a, 7654321)
+            word('long_word_name_here', dup(), '*')
+
+    assert main() == '1234567 constant a_long_constant_name\n' \
+                     '7654321 =: a_long_constant_name\n' \
+                     '{ dup * } : long_word_name_here\n' * 4 + \
+                     '1234567 constant a_long_constant_name\n' \
+                     '7654321 =: a_long_constant_name\n' \
+                     '{ dup * } : long_word_name_here'
+
+
+def test_names_are_not_reused():
+    @script(factor=True)
+    def main():
+        word('__w0', dup())
+        for i in range(3):
+            string('a line long enough to be factored').print()
+
+    assert main() == '{ dup } : __w0\n' \
+                     '{ ."a line long enough to be factored" } : __w1\n' \
+                     ' __w1\n __w1\n __w1'
+
+
+def test_hoisted_constants():
+    @script(factor=True)
+    def main():
+        n = const('n', 10)
+        for i in range(3):
+            word('w%d' % i, string('the value of the constant is ', n).print(cr=True), drop())
+
+    code = main()
+    assert code == '10 constant n\n' \
+                   '{ ."the value of the constant is " @\' n (.) cr drop } : __w0\n' \
+                   '{  __w0 } : w0\n' \
+                   '{  __w0 } : w1\n' \
+                   '{  __w0 } : w2'
+    assert run(code + ' 1 w1') == run(str(_plain(main)) + ' 1 w1')
+
+
+def test_first_root():
+    @script(factor=True)
+    def main():
+        cond(1).pos(dup(), string('printed by the branch of the condition').print()).neg()
+        dup()
+        for i in range(3):
+            string('printed by the branch of the condition').print()
+
+    assert main() == '{ ."printed by the branch of the condition" } : __w0\n' \
+                     '1 { dup  __w0 } {  } cond\n' \
+                     'dup\n' \
+                     ' __w0\n __w0\n __w0'
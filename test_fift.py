@@ -1,4 +1,15 @@
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import fift.fift
 from fift.fift import *
+from fift.interp import run
 
 
 def test_create_empty_script():
@@ -9,6 +20,186 @@ def test_create_empty_script():
     assert main() == ''
 
 
+class TestStreaming:
+    @staticmethod
+    def body():
+        include('TonUtil.fif')
+        a = const('a', {})
+        a.add(1, (4, 'u'), builder())
+        a[2] = ((4, 'u'), builder(), 'Cannot be added')
+        string('abc').print(cr=True)
+
+    expected = '"TonUtil.fif" include\n' \
+               'dictnew constant a\n' \
+               '<b  b> <s 1 @\' a 4 udict! =: a\n' \
+               '<b  b> <s 2 @\' a 4 udict!+ not abort"Cannot be added" =: a\n' \
+               '."abc" cr'
+
+    def test_generator(self):
+        main = script(stream=True)(self.body)
+        lines = main()
+
+        assert next(lines) == '"TonUtil.fif" include'
+        assert '\n'.join(['"TonUtil.fif" include', *lines]) == self.expected
+
+    def test_text_stream(self):
+        out = io.StringIO()
+        main = script(stream=out)(self.body)
+
+        assert main() is None
+        assert out.getvalue() == self.expected
+
+    def test_file(self, tmp_path):
+        fn = tmp_path / 'script.fif'
+        main = script(out_filename=str(fn), stream=True)(self.body)
+
+        assert main() is None
+        assert fn.read_text() == self.expected
+        assert script(out_filename=str(fn))(self.body)() == self.expected
+
+    def test_file_is_replaced_atomically(self, tmp_path):
+        fn = tmp_path / 'script.fif'
+        fn.write_text('old')
+        fn.chmod(0o640)
+
+        # the callback runs after the last line is written
+        def streamed(stats):
+            assert fn.read_text() == 'old'
+
+        def failed(stats):
+            raise RuntimeError()
+
+        with pytest.raises(RuntimeError):
+            script(out_filename=str(fn), stream=True, stats=failed)(self.body)()
+        assert fn.read_text() == 'old'
+
+        script(out_filename=str(fn), stream=True, stats=streamed)(self.body)()
+        assert fn.read_text() == self.expected
+        assert fn.stat().st_mode & 0o777 == 0o640
+        assert [p.name for p in tmp_path.iterdir()] == ['script.fif']
+
+
+def wallet_query(dest, seqno, amount, comment='b{}', bounce=-1):
+    include('TonUtil.fif')
+    string('Transferring ', amount, ' to ', dest, ' seqno ', seqno).print(cr=True)
+    body = builder().u(0, 32).s(comment)
+    const('msg', builder().u(0x42, 9).i(bounce, 8).s(dest).u(amount, 64).r(body))
+
+
+class TestTemplate:
+    plain = staticmethod(script()(wallet_query))
+
+    def test_same_as_plain(self):
+        main = script(template=True)(wallet_query)
+        for args, kwargs in [
+            (('x{1234}', 1, 100), {}),
+            (('x{ABCD}', 7, 2 ** 64 - 1), {'comment': 'x{ABCD}'}),
+            (('x{00}',), {'seqno': 0, 'amount': -5, 'bounce': 0}),
+        ]:
+            assert main(*args, **kwargs) == self.plain(*args, **kwargs)
+
+    def test_body_runs_once_per_types(self):
+        calls = []
+
+        @script(template=True)
+        def main(a, b):
+            calls.append((a, b))
+            assign(a, b)
+
+        assert main('x', 1) == '1 =: x'
+        assert main('y', 2) == '2 =: y'
+        assert main('z', 'w') == 'w =: z'
+        assert len(calls) == 4
+
+    def test_not_substituted_types(self):
+        @script(template=True)
+        def main(a):
+            assign('x', a)
+
+        assert main(dup()) == 'dup =: x'
+        assert main(True) == 'True =: x'
+
+    def test_computed_value(self):
+        @script(template=True)
+        def main(a):
+            assign('x', a * 2)
+
+        with pytest.raises(ValueError):
+            main(1)
+
+    def test_branch_on_value(self):
+        @script(template=True)
+        def main(amount):
+            if amount > 0:
+                string('pay ', amount).print()
+            else:
+                halt(1)
+
+        with pytest.raises(ValueError):
+            main(0)
+
+        @script(template=True)
+        def main(dest):
+            if dest == 'none' or not dest:
+                halt(1)
+
+        with pytest.raises(ValueError):
+            main('x{00}')
+
+    @pytest.mark.parametrize('body, args', [
+        (lambda amount: assign('x', amount // 10**9), (5,)),
+        (lambda comment: assign('x', len(comment) * 8), ('abc',)),
+        (lambda dest: string(dest.strip()), ('addr',)),
+        (lambda s: string(s.upper()), ('abc',)),
+        (lambda addr: string(addr[2:]), ('0:abc',)),
+        (lambda s: string('a' + s), ('abc',)),
+        (lambda n: assign('x', 1 + n), (1,)),
+        (lambda n: assign('x', -n), (1,)),
+        (lambda n: string('%5d' % n), (1,)),
+        (lambda n: string(f'{n:5}'), (1,)),
+    ])
+    def test_opaque(self, body, args):
+        @script(template=True)
+        def main(p):
+            body(p)
+
+        with pytest.raises(ValueError):
+            main(*args)
+
+    def test_rendered(self):
+        @script(template=True)
+        def main(s, n):
+            string('%s %s' % (s, n), f' {s} {n}', ' ' + str(s)).print()
+
+        assert main('abc', 1) == '."abc 1" ." abc 1" ." abc"'
+        assert main('xyz', 22) == '."xyz 22" ." xyz 22" ." xyz"'
+
+    def test_quote(self):
+        @script(template=True)
+        def main(a):
+            string(a)
+
+        assert main('abc') == '"abc"'
+        assert main('a b') == '"a b"'
+        for v in ('a"b', 'a\nb', 'a\rb'):
+            with pytest.raises(ValueError):
+                main(v)
+
+    def test_word(self):
+        @script(template=True)
+        def main(name):
+            call_word(name)
+
+        assert main('abc') == ' abc'
+        for v in ('', 'a b', 'a\tb', 'a\nb', 'a"b'):
+            with pytest.raises(ValueError):
+                main(v)
+
+    def test_stream(self):
+        with pytest.raises(ValueError):
+            script(template=True, stream=True)
+
+
 class TestStackManipulationWords:
     def test_dup(self):
         assert str(dup()) == 'dup'
@@ -117,6 +308,30 @@ class TestConstants:
                          '<b  b> <s 2 @\' a 4 udict! =: a\n' \
                          '<b  b> <s 2 @\' a 4 udict!+ not abort"Cannot be added" =: a'
 
+    def test_filled_dict(self):
+        assert str(const('d', {1: builder().u(7, 8), 2: builder().u(swap(), 8)}, size=(16, 'u'))) == \
+               '<b swap 8 u, b> <s 2 <b 7 8 u, b> <s 1 dictnew { 16 udict! drop } 2 times constant d'
+
+    def test_literal_dict(self):
+        # 10{4} 00000001 (a long label), the value 00000111
+        assert str(const('d', {1: builder().u(7, 8)}, size=(8, 'u'))) == \
+               'B{B5EE9C72010101010005000005A0041E} B>boc constant d'
+        with pytest.raises(ValueError):
+            const('d', {1: builder()})
+
+    def test_update_dict(self):
+        @script()
+        def main():
+            a = const('a', {})
+            a.update({1: builder(), 2: builder().u(7, 8)}, (4, 'u'))
+            a.update(((i, builder()) for i in range(3)), (8, 'i'), 'Cannot be added')
+            a.update([], (4, 'u'))
+
+        assert main() == 'dictnew constant a\n' \
+                         '<b 7 8 u, b> <s 2 <b  b> <s 1 @\' a { 4 udict! drop } 2 times =: a\n' \
+                         '<b  b> <s 2 <b  b> <s 1 <b  b> <s 0 @\' a ' \
+                         '{ 8 idict!+ not abort"Cannot be added" } 3 times =: a'
+
     def test_read(self):
         assert const('a', 1).read() == '@\' a'
 
@@ -139,6 +354,25 @@ class TestConstants:
                          'dictnew constant c\n' \
                          '@\' $0'
 
+    def test_hoist_before_first_usage(self):
+        @script()
+        def main():
+            a = const('a', 1)
+            b = const('b', 2)
+            c = const('c', {})
+            string('x')
+            string(a, b)
+            c.add(1, (4, 'u'), builder())
+            string(b, a)
+
+        assert main() == '"x"\n' \
+                         '1 constant a\n' \
+                         '2 constant b\n' \
+                         '@\' a (.) @\' b (.) $+\n' \
+                         'dictnew constant c\n' \
+                         '<b  b> <s 1 @\' c 4 udict! =: c\n' \
+                         '@\' b (.) @\' a (.) $+'
+
 
 class TestAssign:
     def test_simple(self):
@@ -169,6 +403,35 @@ class TestWord:
         assert main() == '{ dup * } : square\n' \
                          '2 square'
 
+    def test_deep_nesting(self):
+        depth = sys.getrecursionlimit() * 2
+
+        @script()
+        def main():
+            w = word('w0', const('c', 1))
+            for i in range(1, depth):
+                w = word('w%d' % i, w)
+
+        assert main() == '1 constant c\n' \
+                         '{ w%d } : w%d' % (depth - 2, depth - 1)
+
+    def test_deep_blocks_and_conditions(self):
+        depth = sys.getrecursionlimit() * 2
+
+        @script()
+        def main():
+            b = block(dup())
+            for _ in range(depth):
+                b = block(b)
+
+            c = cond().pos(drop())
+            for _ in range(depth):
+                c = cond().pos(c).neg(dup())
+
+        blocks, conds = main().split('\n')
+        assert blocks == '{ ' * (depth + 1) + 'dup' + ' }' * (depth + 1)
+        assert conds == '{ ' * depth + '{ drop } {  } cond' + ' } { dup } cond' * depth
+
     def test_usage(self):
         @script()
         def main():
@@ -220,6 +483,68 @@ class TestBuilderPrimitive:
                          '<b @\' d dict, b>'
 
 
+class TestRenderCache:
+    def test_reused(self):
+        b = builder().u(1, 8)
+        assert str(b) is str(b)
+
+    def test_invalidated_by_mutation(self):
+        b = builder().u(1, 8)
+        c = const('c', b)
+        s = slice().u(7)
+        f = cond(1)
+        st = string('abc')
+        assert str(c) == '<b 1 8 u, b> constant c'
+        assert str(s) == '<s 7 u@+'
+        assert str(f) == '1 {  } {  } cond'
+        assert str(st) == '"abc"'
+
+        b.i(2, 4).inspect()
+        s.r()
+        f.pos(dup()).neg(drop())
+        st.print(cr=True)
+        assert str(c) == '<b 1 8 u, 2 4 i, .s b> constant c'
+        assert str(s) == '<s 7 u@+ ref@+'
+        assert str(f) == '1 { dup } { drop } cond'
+        assert str(st) == '."abc" cr'
+
+    def test_const_type(self):
+        a = const('a', 1)
+        w = word('w', a)
+        assert str(w) == '{ 1 constant a } : w'
+        a.type()
+        assert str(w) == '{ @\' a type } : w'
+
+    def test_only_the_parents_are_invalidated(self):
+        shared = builder().u(1, 8)
+        a = const('a', shared)
+        b = word('b', dup(), shared)
+        other = builder().u(3, 8)
+        c = const('c', other)
+        rendered = str(c)
+        assert str(a) == '<b 1 8 u, b> constant a'
+        assert str(b) == '{ dup <b 1 8 u, b> } : b'
+
+        shared.u(2, 8)
+        assert str(c) is rendered
+        assert str(a) == '<b 1 8 u, 2 8 u, b> constant a'
+        assert str(b) == '{ dup <b 1 8 u, 2 8 u, b> } : b'
+
+    def test_deep_nesting(self):
+        inner = builder().u(1, 8)
+        outer = word('outer', *[block() for _ in range(3)], block(inner))
+        assert str(outer) == '{ {  } {  } {  } { <b 1 8 u, b> } } : outer'
+        inner.u(2, 4)
+        assert str(outer) == '{ {  } {  } {  } { <b 1 8 u, 2 4 u, b> } } : outer'
+
+    def test_cell(self):
+        nested = builder().u(1, 8)
+        b = builder().r(nested)
+        assert b.cell().refs[0] == Cell(1, 8)
+        nested.u(2, 8)
+        assert b.cell().refs[0] == Cell(1 << 8 | 2, 16)
+
+
 class TestSlice:
     def test_create(self):
         assert str(slice()) == '<s '
@@ -337,3 +662,383 @@ class TestCond:
 
         assert main() == '{ { ."true" } { ."false" } cond } : ?\n' \
                          '2 3 < ?'
+
+
+class TestSwitch:
+    def test_tree(self):
+        assert str(switch(None, {2: (dup(), '*'), 1: String('one').print()}, default=String('?').print())) == \
+            '{ ."?" } swap dup 2 < { dup 1 = { 2drop ."one" } { drop execute } cond } ' \
+            '{ dup 2 = { 2drop dup * } { drop execute } cond } cond'
+
+    def test_default_once(self):
+        code = str(switch(None, {i: String(str(i)).print() for i in range(8)}, default=String('default').print()))
+        assert code.count('default') == 1
+        for v in range(-1, 9):
+            assert run('5 %d %s' % (v, code)) == ([5], 0 <= v < 8 and str(v) or 'default', 0)
+
+        # there is nothing to repeat without a default body or with one case
+        assert str(switch(None, {1: dup(), 2: drop()})) == \
+            'dup 2 < { dup 1 = { drop dup } { drop } cond } { dup 2 = { drop drop } { drop } cond } cond'
+        assert str(switch(None, {1: dup()}, default=drop())) == 'dup 1 = { drop dup } { drop drop } cond'
+
+    def test_value(self):
+        assert str(switch(3, {1: dup()})) == '3 dup 1 = { drop dup } { drop } cond'
+        assert str(switch("@' op", {})) == "@' op drop"
+
+    def test_balanced(self):
+        s = str(switch(None, {i: String(str(i)) for i in range(64)}))
+        assert s.count('<') == 63
+
+        # every case is found with log2(64) comparisons and one equality
+        depth = level = 0
+        for c in s:
+            level += (c == '{') - (c == '}')
+            depth = max(depth, level)
+        assert depth == 6 + 1
+
+    def test_keys(self):
+        with pytest.raises(TypeError):
+            switch(None, {'a': dup()})
+
+    def test_usage(self):
+        @script(optimize=True)
+        def main():
+            a = const('a', 1)
+            word('op', switch(None, {0: (swap(), swap(), string(a).print())}))
+
+        assert main() == '1 constant a\n' \
+                         '{ dup 0 = { drop @\' a (.) } { drop } cond } : op'
+
+
+class TestLoops:
+    def test_times(self):
+        assert str(times(3, String('a').print())) == '{ ."a" } 3 times'
+        assert str(times(None, drop())) == '{ drop } swap times'
+
+    def test_until(self):
+        assert str(until('1+', dup(), 10, '=')) == '{ 1+ dup 10 = } until'
+
+    def test_while(self):
+        assert str(while_(dup(), 10, '<').do('1+')) == '{ dup 10 < } { 1+ } while'
+
+    def test_range(self):
+        assert str(for_range(0, 3).do('.')) == '0 { dup . 1 + } 3 times drop'
+        assert str(for_range(10, 0, -3).do('.')) == '10 { dup . -3 + } 4 times drop'
+        assert str(for_range(1, "@' n", 2).do(drop())) == "1 { dup drop 2 + } @' n 1 - 1 + 2 / 0 max times drop"
+        with pytest.raises(ValueError):
+            for_range(0, 3, 0)
+        with pytest.raises(TypeError):
+            for_range(0, 3, "@' step")
+
+    def test_usage(self):
+        @script(optimize=True)
+        def main():
+            a = const('a', 7)
+            times(1000, string('a=', a).print(), swap(), swap())
+            for_range(0, 1000).do(dup(), drop(), '.')
+
+        assert main() == '7 constant a\n' \
+                         '{ ."a=" @\' a (.) } 1000 times\n' \
+                         '0 { dup . 1 + } 1000 times drop'
+
+
+@script()
+def concurrent_script(n):
+    include('TonUtil.fif')
+    d = const('d', {})
+    for i in range(n):
+        d.add(i, (16, 'u'), builder().u(i, 32))
+        threading.Event().wait(0)
+    sq = word('sq%s' % n, dup(), '*')
+    sq(n)
+    string('n=', n).print(cr=True)
+
+
+class TestRecording:
+    def test_nothing_recorded_outside_script(self):
+        str(dup())
+        assert fift.fift._current_recorder() is None
+
+    def test_collect_fragments(self):
+        with recording() as rec:
+            dup()
+            string('abc').print()
+            a = const('a', 1)
+            assign('b', string(a))
+
+        assert str(rec) == 'dup\n' \
+                           '."abc"\n' \
+                           '1 constant a\n' \
+                           '@\' a (.) =: b'
+        assert fift.fift._current_recorder() is None
+
+    def test_render_twice(self):
+        with recording() as rec:
+            a = const('a', 1)
+            assign('b', string(a))
+            assign('c', string(a))
+
+        code = '1 constant a\n@\' a (.) =: b\n@\' a (.) =: c'
+        assert str(rec) == code
+        assert str(rec) == code
+        assert list(rec.lines()) == code.split('\n')
+
+    def test_nested_in_script(self):
+        @script()
+        def main():
+            dup()
+            with recording() as rec:
+                drop()
+            swap()
+            assert str(rec) == 'drop'
+
+        assert main() == 'dup\nswap'
+
+
+class TestConcurrency:
+    expected = {n: concurrent_script(n) for n in range(8)}
+
+    def test_threads(self):
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                ns = [i % 8 for i in range(400)]
+                results = list(pool.map(concurrent_script, ns))
+        finally:
+            sys.setswitchinterval(interval)
+
+        for n, r in zip(ns, results):
+            assert r == self.expected[n]
+
+    def test_asyncio_tasks(self):
+        async def generate(n):
+            await asyncio.sleep(0)
+            return n, await asyncio.get_running_loop().run_in_executor(None, concurrent_script, n)
+
+        async def main():
+            return await asyncio.gather(*(generate(i % 8) for i in range(200)))
+
+        for n, r in asyncio.run(main()):
+            assert r == self.expected[n]
+
+    def test_asyncio_interleaved(self):
+        # the tasks record on one thread and switch between the nodes, every
+        # task runs in a copy of the context, so it has its own recorder
+        async def record(n):
+            with recording() as rec:
+                include('TonUtil.fif')
+                for i in range(n):
+                    const('c%d_%d' % (n, i), i)
+                    await asyncio.sleep(0)
+                    dup()
+                    await asyncio.sleep(0)
+                string('n=', n).print(cr=True)
+            return n, str(rec)
+
+        def expected(n):
+            lines = ['"TonUtil.fif" include']
+            for i in range(n):
+                lines += ['%d constant c%d_%d' % (i, n, i), 'dup']
+            return '\n'.join(lines + ['."n=" %d (.) type cr' % n])
+
+        async def main():
+            results = await asyncio.gather(*(record(i % 8) for i in range(200)))
+            assert fift.fift._current_recorder() is None
+            return results
+
+        for n, r in asyncio.run(main()):
+            assert r == expected(n)
+
+
+class TestGenerateMany:
+    def test_process_pool(self):
+        kwargs = [{'n': i % 8} for i in range(100)]
+        assert generate_many(concurrent_script, kwargs, workers=2, chunksize=8) == \
+               [TestConcurrency.expected[kw['n']] for kw in kwargs]
+
+    def test_in_process(self, tmp_path):
+        out = str(tmp_path / 'script-{index}-{n}.fif')
+        codes = generate_many(concurrent_script, [{'n': 3}, {'n': 5}], workers=1, out_filename=out)
+
+        assert codes == [TestConcurrency.expected[3], TestConcurrency.expected[5]]
+        assert (tmp_path / 'script-0-3.fif').read_text() == codes[0]
+        assert (tmp_path / 'script-1-5.fif').read_text() == codes[1]
+
+        os.utime(tmp_path / 'script-0-3.fif', ns=(0, 0))
+        generate_many(concurrent_script, [{'n': 3}], workers=1, out_filename=out)
+        assert (tmp_path / 'script-0-3.fif').stat().st_mtime_ns == 0
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith('.fift-')] == []
+
+
+def cached_body(n):
+    string('n=', n).print(cr=True)
+
+
+class TestCache:
+    def test_hit(self, tmp_path):
+        # the body is measured only when it runs
+        runs = []
+        f = script(cache=str(tmp_path), stats=runs.append)(cached_body)
+
+        assert f(1) == f(1) == '."n=" 1 (.) type cr'
+        assert f(n=2) != f(1)
+        assert len(runs) == 2
+
+    def test_code_change(self, tmp_path):
+        def main():
+            string('a').print()
+        first = script(cache=str(tmp_path))(main)()
+
+        def main():
+            string('b').print()
+        assert script(cache=str(tmp_path))(main)() != first
+
+    def test_options_are_in_the_key(self, tmp_path):
+        def main():
+            swap()
+            swap()
+
+        assert script(cache=str(tmp_path))(main)() == 'swap\nswap'
+        assert script(cache=str(tmp_path), optimize=True)(main)() == ''
+
+    def test_unstable_arguments(self, tmp_path):
+        runs = []
+        f = script(cache=str(tmp_path), stats=runs.append)(cached_body)
+        o = object()
+        f(o)
+        f(o)
+        assert len(runs) == 2
+
+    def test_stream(self, tmp_path):
+        with pytest.raises(ValueError):
+            script(cache=str(tmp_path), stream=True)
+
+    def test_write_if_changed(self, tmp_path):
+        out = tmp_path / 'out.fif'
+        f = script(out_filename=str(out), cache=str(tmp_path / 'cache'))(cached_body)
+
+        f(1)
+        os.utime(out, ns=(0, 0))
+        f(1)
+        assert out.stat().st_mtime_ns == 0
+        f(2)
+        assert out.stat().st_mtime_ns != 0
+        assert out.read_text() == '."n=" 2 (.) type cr'
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith('.fift-')] == []
+
+    def test_file_mode(self, tmp_path):
+        out = tmp_path / 'out.fif'
+        f = script(out_filename=str(out))(cached_body)
+
+        f(1)
+        assert out.stat().st_mode & 0o777 == 0o666 & ~fift.fift._umask()
+        out.chmod(0o640)
+        f(2)
+        assert out.stat().st_mode & 0o777 == 0o640
+
+    def test_helper_defined_later(self, tmp_path):
+        namespace = {}
+        exec('from fift.fift import *\n'
+             'def main():\n'
+             '    helper()\n'
+             'main = script(cache=%r)(main)\n'
+             'def helper():\n'
+             '    const("n", 1)\n' % str(tmp_path), namespace)
+        assert namespace['main']() == '1 constant n'
+
+        exec('def helper():\n'
+             '    const("n", 2)\n', namespace)
+        assert namespace['main']() == '2 constant n'
+
+    def test_global_values(self, tmp_path):
+        namespace = {}
+        exec('from fift.fift import *\n'
+             'N = 1\n'
+             'def main():\n'
+             '    const("n", N)\n'
+             'main = script(cache=%r)(main)\n' % str(tmp_path), namespace)
+        assert namespace['main']() == '1 constant n'
+
+        namespace['N'] = 2
+        assert namespace['main']() == '2 constant n'
+
+        namespace['N'] = object()
+        assert fift.fift._code_digest(namespace['main']) is None
+
+    def test_module_attributes(self, tmp_path, monkeypatch):
+        monkeypatch.syspath_prepend(str(tmp_path))
+        monkeypatch.delitem(sys.modules, 'cached_helpers', raising=False)
+        (tmp_path / 'cached_helpers.py').write_text('from fift.fift import *\n'
+                                                   'def body():\n'
+                                                   '    const("v", 1)\n')
+        import cached_helpers
+
+        namespace = {'cached_helpers': cached_helpers}
+        exec('from fift.fift import *\n'
+             'def main():\n'
+             '    cached_helpers.body()\n'
+             'main = script(cache=%r)(main)\n' % str(tmp_path / 'cache'), namespace)
+        assert namespace['main']() == '1 constant v'
+
+        exec('def body():\n'
+             '    const("v", 2)\n', vars(cached_helpers))
+        assert namespace['main']() == '2 constant v'
+
+    def test_class_methods(self, tmp_path):
+        namespace = {'__name__': 'cached_classes'}
+        exec('from fift.fift import *\n'
+             'class Helpers:\n'
+             '    @staticmethod\n'
+             '    def body():\n'
+             '        const("v", 1)\n'
+             'def main():\n'
+             '    Helpers.body()\n'
+             'main = script(cache=%r)(main)\n' % str(tmp_path), namespace)
+        assert namespace['main']() == '1 constant v'
+
+        exec('Helpers.body = staticmethod(lambda: const("v", 2))\n', namespace)
+        assert namespace['main']() == '2 constant v'
+
+    def test_stable_modules(self):
+        assert fift.fift._is_stable_module('os')
+        assert fift.fift._is_stable_module('sys')
+        assert fift.fift._is_stable_module('fift.interp')
+        assert not fift.fift._is_stable_module('pytest')
+
+
+class TestInstrumentation:
+    @staticmethod
+    def body():
+        a = const('a', builder().u(1, 8))
+        word('w', dup(), (cond()
+            .pos(string('x').print())
+            .neg(drop())))
+        string('a=', a).print(cr=True)
+
+    def test_stats(self):
+        stats = []
+        code = script(stats=stats.append)(self.body)()
+
+        s, = stats
+        assert s['script'] == 'body'
+        assert s['nodes']['Cond'] == 1
+        assert s['nodes']['Builder'] == 1
+        assert s['hoists'] == 1
+        assert s['output_bytes'] == len(code.encode())
+        for k in ('build_s', 'passes_s', 'traverse_s', 'render_s'):
+            assert s[k] >= 0
+
+    def test_stream(self):
+        stats = []
+        lines = script(stream=True, stats=stats.append)(self.body)()
+        assert stats == []
+
+        code = '\n'.join(lines)
+        assert stats[0]['output_bytes'] == len(code.encode())
+
+    def test_off(self):
+        with recording() as rec:
+            self.body()
+        assert not rec.instrument
+        assert rec.stats == {}
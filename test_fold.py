@@ -0,0 +1,88 @@
+import pytest
+
+from fift.fift import *
+from fift.fold import fold_expression, fold_string
+from fift.interp import FiftError, run
+
+
+def test_fold_string():
+    with recording():
+        a = const('a')
+        assert fold_string(('a', 'b', 1)) == ('ab1',)
+        assert fold_string((1,)) == ('1',)
+        assert fold_string(('a', a, 'b', -2, 'c')) == ('a', a, 'b-2c')
+        assert fold_string((True, 'a')) == (True, 'a')
+
+
+@pytest.mark.parametrize('args, folded', [
+    ((1, 2, '+', 3, '*'), (9,)),
+    ((7, 2, '/', 7, -2, '/', '-'), (7,)),
+    ((-7, 3, 'mod'), (2,)),
+    ((5, 'negate', '1+', 'abs'), (4,)),
+    ((1, 2, '<', 0, '='), (0,)),
+    ((1, 8, '<<', 255, 'and', 3, 'xor'), (3,)),
+    (("@' a", 2, 3, '*', '+'), ("@' a", 6, '+')),
+    ((2, "@' a", '+', 1, '+'), (2, "@' a", '+', 1, '+')),
+    ((True, 1, '+'), (True, 1, '+')),
+])
+def test_fold_expression(args, folded):
+    assert fold_expression(args) == folded
+    if "@' a" not in args and not any(a is True for a in args):
+        assert run(seq(*args)).stack == list(folded)
+
+
+@pytest.mark.parametrize('args', [
+    (1, 0, '/'),
+    (1, 0, 'mod'),
+    (1, 256, '<<'),
+    (1, -1, '>>'),
+    (1 << 255, 2, '*'),
+])
+def test_errors_are_left_to_fift(args):
+    assert fold_expression(args) == args
+
+
+def test_script():
+    stats = []
+
+    @script(fold=True, stats=stats.append)
+    def main():
+        a = const('a', 1, 2, '+')
+        n = const('n', 10, 3, '*')
+        string('value: ', 1, '+', 2, ' and ', a).print(cr=True)
+        string('x', 'y', n, 'z', 2)
+        assign(a, a.read(), 2, 3, '*', '+')
+        call_word('drop', 1, 2, '+')
+
+    code = main()
+    assert code == '3 constant a\n' \
+                   '."value: 1+2 and " @\' a (.) cr\n' \
+                   '30 constant n\n' \
+                   '"xy" @\' n (.) $+ "z2" $+\n' \
+                   '@\' a 6 + =: a\n' \
+                   '1 2 + drop'
+    assert stats[0]['folded_nodes'] == 5
+
+    # the folded value is an integer, so it is converted to a string
+    assert run(code) == run('."value: 1+2 and " 3 (.) cr "xy30z2"')
+
+
+def test_template():
+    @script(template=True, fold=True)
+    def main(dest, seqno):
+        string('Transferring to ', dest, ' seqno ', seqno).print(cr=True)
+        const('next', seqno, 1, '+')
+
+    assert main('addr', 5) == '."Transferring to addr seqno 5" cr\n5 1 + constant next'
+    assert main('other', 6) == '."Transferring to other seqno 6" cr\n6 1 + constant next'
+    assert run(main('addr', 5)).output == 'Transferring to addr seqno 5\n'
+
+
+def test_runtime_errors():
+    @script(fold=True)
+    def main():
+        const('a', 1, 0, '/')
+
+    assert main() == '1 0 / constant a'
+    with pytest.raises(FiftError, match='Division by zero'):
+        run(main())
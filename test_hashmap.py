@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from fift.cell import Cell, CellError
+from fift.fift import *
+from fift.hashmap import build_hashmap, parse_hashmap
+from fift.interp import FiftAbort, run
+
+
+def bits(cell):
+    return format(cell.data, '0%db' % cell.length) if cell.length else ''
+
+
+def test_empty():
+    assert build_hashmap([], 8) is None
+    assert parse_hashmap(None, 8) == {}
+
+
+def test_labels():
+    # hml_long: 10 1000 00000001, then the value
+    assert bits(build_hashmap([(1, Cell(7, 3))], 8)) == '10' '1000' '00000001' '111'
+    # hml_short: 0 10 1, the key has one bit
+    assert bits(build_hashmap([(1, Cell())], 1)) == '0' '10' '1'
+
+    root = build_hashmap([(0, Cell()), (0x80, Cell())], 8)
+    # the fork has an empty label: 0 0
+    assert bits(root) == '00'
+    # hml_same: 11 0 111 for seven zero bits
+    assert [bits(c) for c in root.refs] == ['11' '0' '111'] * 2
+
+
+@pytest.mark.parametrize('size', [1, 8, 32, 257])
+@pytest.mark.parametrize('kind', ['u', 'i'])
+def test_round_trip(kind, size):
+    rnd = random.Random(size)
+    keys = {rnd.getrandbits(size) - (kind == 'i' and 1 << (size - 1) or 0) for _ in range(100)}
+    items = [(k, Cell(k & 0xFF, 8)) for k in keys]
+
+    parsed = parse_hashmap(build_hashmap(items, size, kind), size, kind)
+    assert {k: v.to_cell() for k, v in parsed.items()} == dict(items)
+    assert list(parsed) == sorted(keys, key=lambda k: k & ((1 << size) - 1))
+
+
+def test_last_value_wins():
+    parsed = parse_hashmap(build_hashmap([(1, Cell(1, 1)), (1, Cell(0, 1))], 4), 4)
+    assert parsed[1].to_cell() == Cell(0, 1)
+
+
+def test_key_range():
+    with pytest.raises(CellError):
+        build_hashmap([(16, Cell())], 4)
+    with pytest.raises(CellError):
+        build_hashmap([(-9, Cell())], 4, 'i')
+
+
+class TestInterpreter:
+    def test_words(self):
+        r = run('dictnew <b 7 8 u, b> <s 5 rot 8 udict! drop '
+                '<b 9 8 u, b> <s 5 rot 8 udict!+ '
+                'swap dup 5 swap 8 udict@ drop 8 u@ swap 6 swap 8 udict@').stack
+        assert r == [0, 7, 0]
+        assert run('dictnew <b b> <s -1 rot 8 idict! drop -1 swap 8 idict@ nip').stack == [-1]
+
+    def test_literal_and_filled_dicts_match(self):
+        def values(i):
+            return builder().i(i, 16).r(builder().i(i * 7, 64))
+
+        @script()
+        def main():
+            const('a', {i: values(i) for i in range(-50, 50)}, size=(8, 'i'))
+            const('b', {i: values(i).inspect() for i in range(-50, 50)}, size=(8, 'i'))
+            const('a').read()
+            const('b').read()
+
+        code = main()
+        assert '\nB{B5EE9C72' in code
+        # the inspected builders are filled by the Fift code
+        a, b = run(code.replace('.s', '')).stack[-2:]
+        assert a == b
+        assert parse_hashmap(a, 8, 'i')[-3].to_cell() == values(-3).cell()
+
+    def test_update_abort(self):
+        @script()
+        def main():
+            d = const('d', {})
+            d.update({1: builder(), 2: builder()}, (8, 'u'), 'exists')
+            d.update({2: builder()}, (8, 'u'), 'exists')
+
+        with pytest.raises(FiftAbort, match='exists'):
+            run(main())
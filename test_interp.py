@@ -0,0 +1,234 @@
+import pytest
+
+from fift.cell import Cell, CellSlice
+from fift.fift import *
+from fift.interp import FiftAbort, FiftError, run
+
+
+def stack(source, **kwargs):
+    return run(source, **kwargs).stack
+
+
+def output(source, **kwargs):
+    return run(source, **kwargs).output
+
+
+class TestStack:
+    def test_words(self):
+        assert stack('1 2 dup') == [1, 2, 2]
+        assert stack('1 2 drop') == [1]
+        assert stack('1 2 swap') == [2, 1]
+        assert stack('1 2 3 rot') == [2, 3, 1]
+        assert stack('1 2 3 -rot') == [3, 1, 2]
+        assert stack('1 2 over') == [1, 2, 1]
+        assert stack('1 2 tuck') == [2, 1, 2]
+        assert stack('1 2 nip') == [2]
+        assert stack('1 2 2dup') == [1, 2, 1, 2]
+        assert stack('1 2 3 2drop') == [1]
+        assert stack('1 2 3 4 2swap') == [3, 4, 1, 2]
+        assert stack('0 ?dup 1 ?dup') == [0, 1, 1]
+
+    def test_indexed_words(self):
+        assert stack('1 2 3 2 pick') == [1, 2, 3, 1]
+        assert stack('1 2 3 2 roll') == [2, 3, 1]
+        assert stack('1 2 3 2 -roll') == [3, 1, 2]
+        assert stack('1 2 3 2 exch') == [3, 2, 1]
+        assert stack('1 2 3 4 1 3 exch2') == [3, 2, 1, 4]
+
+    def test_underflow(self):
+        with pytest.raises(FiftError):
+            run('1 swap')
+        with pytest.raises(FiftError):
+            run('1 2 5 pick')
+
+
+class TestArithmetic:
+    def test_words(self):
+        assert stack('2 3 + 2 3 - 2 3 * -7 2 / -7 2 mod') == [5, -1, 6, -4, 1]
+        assert stack('1 2 < 1 2 > 2 2 = 0 not 5 negate') == [-1, 0, -1, -1, -5]
+        assert stack('0x10 0b101 -3 007') == [16, 5, -3, 7]
+
+    def test_division_by_zero(self):
+        with pytest.raises(FiftError):
+            run('1 0 /')
+
+    def test_range(self):
+        assert stack('-1 256 << 1+ negate -1 256 <<') == [(1 << 256) - 1, -(1 << 256)]
+        assert stack('1 0 << 8 1023 >> -1 1023 >>') == [1, 0, -1]
+
+    @pytest.mark.parametrize('source', [
+        '1 300 << .',
+        '1 256 <<',
+        '1 255 << 2 *',
+        '-1 256 << 1-',
+        '-1 256 << -1 /',
+        '-1 256 << -1 /mod',
+        '-1 256 << 1+ negate 1+',
+    ])
+    def test_overflow(self, source):
+        with pytest.raises(FiftError, match='Integer overflow'):
+            run(source)
+
+    @pytest.mark.parametrize('source', ['1 -1 <<', '1 -1 >>', '1 1024 >>', '1 100000000000 <<'])
+    def test_shift_count(self, source):
+        with pytest.raises(FiftError, match='Shift count'):
+            run(source)
+
+
+class TestStrings:
+    def test_print(self):
+        assert output('."abc" cr "a b" " c" $+ type 12 (.) type 3 .') == 'abc\na b c123 '
+
+    def test_comments(self):
+        assert stack('1 // 2\n3 /* 4\n5 */ 6') == [1, 3, 6]
+
+    def test_dump(self):
+        assert output('1 "a" .s') == '1 "a"\n'
+
+
+class TestDefinitions:
+    def test_constant(self):
+        assert stack("1 constant a @' a a") == [1, 1]
+
+    def test_assign(self):
+        assert stack("1 constant a 2 =: a @' a { 3 =: a } execute a") == [2, 3]
+
+    def test_word(self):
+        assert stack('{ dup * } : square 3 square { square square } : **4 2 **4') == [9, 16]
+
+    def test_def(self):
+        assert stack('def? dup def? x 1 constant x def? x') == [-1, 0, -1]
+
+    def test_argv(self):
+        assert stack("@' $0 $1 $#", argv=('script.fif', 'a')) == ['script.fif', 'a', 1]
+
+    def test_undefined(self):
+        with pytest.raises(FiftError):
+            run('foo')
+
+    def test_include(self):
+        assert stack('"TonUtil.fif" include "a.fif" include x', includes={'a.fif': '1 constant x'}) == [1]
+        with pytest.raises(FiftError):
+            run('"other.fif" include')
+
+
+class TestControlFlow:
+    def test_cond(self):
+        assert output('1 { ."t" } { ."f" } cond 0 { ."t" } { ."f" } cond') == 'tf'
+
+    def test_cond_empty_branch(self):
+        assert output('-1 { } { ."neg" } cond 0 { ."pos" } { } cond') == ''
+
+        @script()
+        def main():
+            cond(1).neg(String('neg').print())
+
+        assert run(main()) == ([], '', 0)
+
+    def test_if(self):
+        assert stack('1 { 5 } if 0 { 6 } if 0 { 7 } ifnot') == [5, 7]
+
+    def test_loops(self):
+        assert stack('0 { 1+ } 5 times') == [5]
+        assert stack('0 { dup 3 < } { 1+ } while') == [3]
+        assert stack('0 { 1+ dup 4 = } until') == [4]
+
+    def test_halt(self):
+        r = run('1 ."a" 2 halt ."b"')
+        assert r.stack == [1]
+        assert r.output == 'a'
+        assert r.exit_code == 2
+
+    def test_abort(self):
+        assert stack('0 abort"failed" 1') == [1]
+        with pytest.raises(FiftAbort, match='failed'):
+            run('1 abort"failed"')
+
+
+class TestCells:
+    def test_builder(self):
+        c, = stack('<b 1 8 u, -1 8 i, x{F_} s, B{0A0B} B, <b 7 4 u, b> ref, null dict, b>')
+        assert isinstance(c, Cell)
+        assert c.length == 8 + 8 + 3 + 16 + 1
+        assert c.refs == (Cell(7, 4),)
+
+    def test_slice(self):
+        r = stack('<b 1 8 u, -1 8 i, x{F_} s, B{0A0B} B, <b 7 4 u, b> ref, b> <s '
+                  '8 u@+ 8 i@+ 3 s@+ 2 B@+ ref@+ empty?')
+        assert r[:2] == [1, -1]
+        assert r[2].bits() == (7, 3)
+        assert r[3:5] == [b'\x0a\x0b', Cell(7, 4)]
+        assert r[5] == -1
+
+    def test_quiet_fetch(self):
+        r = stack('<b 1 4 u, b> <s 8 u@?+')
+        assert isinstance(r[0], CellSlice)
+        assert r[1] == 0
+        assert stack('<b 1 4 u, b> <s 4 u@?+ nip') == [1, -1]
+
+    def test_overflow(self):
+        with pytest.raises(FiftError):
+            run('<b 256 8 u, b>')
+
+
+class TestGeneratedScripts:
+    def test_check_sign(self):
+        @script()
+        def main():
+            pos_neg_cond = (cond('0<')
+                .pos(String('negative').print())
+                .neg(String('positive').print()))
+
+            check_sign = word('check_sign', dupnz(), (cond()
+                .pos(pos_neg_cond)
+                .neg(String('zero').print())))
+
+            check_sign(-17)
+            check_sign(0)
+            check_sign(3)
+
+        assert run(main()) == ([], 'negativezeropositive', 0)
+
+    def test_usage(self):
+        @script()
+        def main():
+            include('TonUtil.fif')
+            string('usage: ', const('$0'), ' <seqno>').print(cr=True)
+            halt(1)
+
+        assert run(main(), argv=('wallet.fif',)) == ([], 'usage: wallet.fif <seqno>\n', 1)
+
+    def test_builder(self):
+        @script()
+        def main():
+            b = const('b', builder().u(3, 16).i(-2, 8))
+            string('=', 5).print(cr=True)
+            builder().r(b.read())
+
+        r = run(main())
+        assert r.output == '=5\n'
+        assert r.stack == [Cell(0, 0, [Cell(3 << 8 | 0xFE, 24)])]
+
+    def test_loops(self):
+        @script()
+        def main():
+            times(2, string('a').print())
+            for_range(0, 3).do('.')
+            for_range(5, 0, -2).do('.')
+            call_word('0')
+            until('1+', dup(), 3, '=')
+            while_(dup(), 5, '<').do('1+')
+            const('n', 4)
+            for_range(1, "@' n").do('.')
+
+        assert run(main()) == ([5], 'aa0 1 2 5 3 1 1 2 3 ', 0)
+
+    def test_switch(self):
+        @script()
+        def main():
+            show = word('show', switch(None, {i: string('%d ' % i).print() for i in range(-5, 30, 3)},
+                                       default=string('- ').print()))
+            for_range(-6, 32).do(show())
+
+        expected = ''.join('%d ' % i if i in range(-5, 30, 3) else '- ' for i in range(-6, 32))
+        assert run(main()) == ([], expected, 0)
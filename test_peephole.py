@@ -0,0 +1,113 @@
+import pytest
+
+from fift import interp
+from fift.fift import *
+from fift.peephole import NODES, PAIR_RULES, SINGLE_RULES, peephole
+
+
+def run(words, depth=8):
+    """
+    Executes the stack words on the stack [0, 1, ..., depth - 1].
+    """
+    s = list(range(depth))
+    for w in words:
+        if w.endswith(' pick'):
+            s.append(s[-1 - int(w.split()[0])])
+        elif w.endswith(' -roll'):
+            n = int(w.split()[0])
+            s.insert(len(s) - 1 - n, s.pop())
+        elif w.endswith(' roll'):
+            n = int(w.split()[0])
+            s.append(s.pop(-1 - n))
+        elif w.endswith(' exch'):
+            n = int(w.split()[0])
+            s[-1], s[-1 - n] = s[-1 - n], s[-1]
+        else:
+            {
+                'dup': lambda: s.append(s[-1]),
+                '2dup': lambda: s.extend(s[-2:]),
+                'drop': lambda: s.pop(),
+                '2drop': lambda: (s.pop(), s.pop()),
+                'swap': lambda: s.extend([s.pop(), s.pop()]),
+                '2swap': lambda: s.extend([s.pop(-4), s.pop(-3)]),
+                'rot': lambda: s.append(s.pop(-3)),
+                '-rot': lambda: s.insert(-2, s.pop()),
+                'over': lambda: s.append(s[-2]),
+                'tuck': lambda: s.insert(-2, s[-1]),
+                'nip': lambda: s.pop(-2),
+            }[w]()
+
+    return s
+
+
+def test_simulator():
+    assert run(['rot']) == run(['2 roll'])
+    assert run(['swap', 'rot']) == run(['2 exch'])
+    assert run(['2 -roll']) == run(['-rot'])
+
+
+@pytest.mark.parametrize('rule', sorted(SINGLE_RULES.items()))
+def test_single_rule_keeps_stack_effect(rule):
+    word, replacement = rule
+    assert run([word]) == run(replacement)
+
+
+@pytest.mark.parametrize('rule', sorted(PAIR_RULES.items()))
+def test_pair_rule_keeps_stack_effect(rule):
+    words, replacement = rule
+    assert run(words) == run(replacement)
+    assert len(replacement) < len(words)
+
+
+def test_replacements_are_known():
+    for replacement in list(SINGLE_RULES.values()) + list(PAIR_RULES.values()):
+        for w in replacement:
+            assert str(NODES[w]()) == w
+
+
+def test_chains():
+    with recording():
+        assert [str(n) for n in peephole([swap(), dup(), drop(), swap()])] == []
+        assert [str(n) for n in peephole([rot(), rot(), rot()])] == []
+        assert [str(n) for n in peephole([pick(1), pick(1)])] == ['2dup']
+        assert [str(n) for n in peephole([swap(), '+', swap(), swap()])] == ['swap', '+']
+        assert [str(n) for n in peephole([roll(1), drop(), drop()])] == ['2drop']
+        assert [str(n) for n in peephole([pick('n'), exch2(1, 2)])] == ['n pick', '1 2 exch2']
+
+
+def test_shortest_runs():
+    with recording():
+        words = [swap(), rot(), rot(), '+', pick(2), pick(2), pick(2), rot(), drop()]
+        out = [str(n) for n in peephole(words)]
+        assert out == ['swap', '-rot', '+', '2dup']
+        code = '1 2 3 4 5 '
+        assert interp.run(code + ' '.join(out)).stack == interp.run(code + ' '.join(map(str, words))).stack
+
+
+def test_script():
+    @script(optimize=True)
+    def main():
+        square = word('square', pick(0), swap(), swap(), '*')
+        swap()
+        swap()
+        square(2)
+        block(rot(), nrot(), over())
+        check = word('?', (cond()
+            .pos(dup(), drop(), string('true').print())
+            .neg(roll(1), drop())))
+        check(2)
+
+    assert main() == '{ dup * } : square\n' \
+                     '2 square\n' \
+                     '{ over }\n' \
+                     '{ { ."true" } { nip } cond } : ?\n' \
+                     '2 ?'
+
+
+def test_optimized_template():
+    @script(template=True, optimize=True)
+    def main(a):
+        word('w', a, dup(), drop(), '+')
+
+    assert main(3) == '{ 3 + } : w'
+    assert main(4) == '{ 4 + } : w'
@@ -0,0 +1,103 @@
+import pytest
+
+from fift.fift import *
+from fift.interp import run
+from fift.stack import SHUFFLES, StackError, _simulate, check, cost, effect, shortest
+
+
+def test_effects():
+    assert effect(dup()) == (1, 2)
+    assert effect(rot()) == (3, 3)
+    assert effect(pick(3)) == (4, 5)
+    assert effect(exch2(1, 3)) == (4, 4)
+    # the count and the block are swapped into place for `times`
+    assert effect('1 { drop } 5 0 2 exch2 times') == (0, 0)
+    assert effect('2 pick swap +') == (3, 3)
+    assert effect(builder().u(1, 8).r(swap())) == (1, 1)
+    assert effect(string('a', 1).print()) == (0, 0)
+    assert effect('?dup') is None
+
+
+def test_control_flow():
+    assert effect('{ 1 + } { 2 - } cond') == (2, 1)
+    assert effect('{ drop } 3 times') == (3, 0)
+    assert effect('{ dup } 0 times') == (0, 0)
+    assert effect('{ dup 10 < } { 1+ } while') == (1, 1)
+    assert effect('{ 1+ dup 10 = } until') == (1, 1)
+    assert effect('{ 2 } swap times') is None
+
+
+def test_words():
+    assert check('{ dup * } : square 3 square . { square square } : **4') == {
+        'square': (1, 2 - 1),
+        '**4': (1, 1),
+    }
+    assert check('"TonUtil.fif" include 1 unknown { drop } : d')['d'] == (1, 0)
+
+
+def test_underflow():
+    with pytest.raises(StackError, match='underflow at `swap`'):
+        check('1 swap')
+    with pytest.raises(StackError, match='underflow at `square`'):
+        check('{ dup * } : square square')
+    with pytest.raises(StackError, match='underflow at `0 3 exch2`'):
+        check('1 2 3 0 3 exch2')
+    with pytest.raises(StackError, match='underflow at `cond`'):
+        check('1 { + } { drop } cond')
+    with pytest.raises(StackError, match='underflow at `3 pick`'):
+        check('1 2 3 pick')
+
+
+def test_branch_mismatch():
+    with pytest.raises(StackError, match='Branch mismatch at `cond` in word w'):
+        check('{ { 1 } { } cond } : w')
+    with pytest.raises(StackError, match='Branch mismatch at `if`'):
+        check('1 { 2 } if')
+
+
+def test_script():
+    @script(check_stack=True)
+    def main():
+        square = word('square', dup(), '*')
+        square(3)
+        switch(None, {1: drop()})
+
+    with pytest.raises(StackError):
+        main()
+
+    @script(check_stack=True)
+    def main():
+        word('w', cond().pos(dup()).neg(drop()))
+
+    with pytest.raises(StackError):
+        main()
+
+
+@pytest.mark.parametrize('words', [
+    ('swap', 'drop'),
+    ('1 roll', 'drop', 'drop'),
+    ('3 pick', '3 pick'),
+    ('swap', 'rot', 'rot'),
+    ('2 pick', '2 pick', '2 pick', 'rot', 'drop'),
+    ('over', 'over', 'swap'),
+])
+def test_shortest(words):
+    best = shortest(words)
+    assert best is not None and cost(best) < cost(words)
+    assert _simulate(best, 6) == _simulate(words, 6)
+    assert run(' '.join(('1 2 3 4 5 6',) + best)).stack == run(' '.join(('1 2 3 4 5 6',) + words)).stack
+
+
+def test_shortest_none():
+    assert shortest(('rot', 'swap')) is None
+    assert shortest(('dup',)) is None
+    assert shortest(('3 pick', '3 pick'), named=tuple(w for w in SHUFFLES if w != '2over')) is None
+
+
+def test_optimize():
+    @script(optimize=True)
+    def main():
+        word('w', swap(), rot(), rot(), '+')
+        word('v', pick(3), pick(3), '+')
+
+    assert main() == '{ swap -rot + } : w\n{ 3 pick 3 pick + } : v'